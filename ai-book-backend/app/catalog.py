@@ -0,0 +1,248 @@
+"""
+Локальный каталог книг (SQLite + FTS5): импорт больших дампов и сверка ответов LLM с каталогом.
+
+Импорт:  python -m app.catalog import books.jsonl [--replace]
+         python -m app.catalog import books.csv
+Поля дампа: title, authors|author, genres|genre, description, cover_url|cover, id (необязательно).
+"""
+import csv
+import json
+import os
+import re
+import sqlite3
+import sys
+from difflib import SequenceMatcher
+from typing import Iterator, List, Optional
+
+from app.db_sqlite import DB_DIR, Database
+
+CATALOG_PATH = os.getenv("CATALOG_PATH", os.path.join(DB_DIR, "catalog.db"))
+CATALOG_MATCH_MIN = float(os.getenv("CATALOG_MATCH_MIN", "0.75"))   # порог похожести названия
+CATALOG_STRICT = os.getenv("CATALOG_STRICT", "1") == "1"             # выкидывать книги, которых нет в каталоге
+CATALOG_CANDIDATES = 5
+CATALOG_COMMON_DF = 0.02   # слова, встречающиеся в >2% названий, в MATCH не берём (кроме крайнего случая)
+IMPORT_BATCH = 5000
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS books (
+        id INTEGER PRIMARY KEY,
+        title TEXT NOT NULL,
+        authors TEXT,
+        genres TEXT,
+        description TEXT,
+        cover_url TEXT
+    )""",
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+        title, authors, content='books', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS books_vocab USING fts5vocab(books_fts, 'col')",
+]
+
+_WORD = re.compile(r"\w+", re.U)
+
+
+def normalize(s: Optional[str]) -> str:
+    return " ".join(_WORD.findall((s or "").casefold().replace("ё", "е")))
+
+
+def _title_words(title: Optional[str]) -> List[str]:
+    return [w for w in normalize(title).split() if len(w) > 1][:8]
+
+
+def _fts_query(words: List[str], df: dict, common: int) -> Optional[str]:
+    # OR по словам названия: полнота важнее точности, точность добираем ранжированием ниже.
+    # Частые слова ("book", "и") матчат полкаталога и делают bm25-сортировку дорогой — отбрасываем их.
+    known = [w for w in words if df.get(w)]
+    rare = [w for w in known if df[w] <= common]
+    if not rare:
+        rare = sorted(known, key=df.get)[:2] or words
+    if not rare:
+        return None
+    return "title : (" + " OR ".join(f'"{w}"' for w in rare) + ")"
+
+
+def _score(title: str, author: Optional[str], cand_title: str, cand_authors: Optional[str]) -> float:
+    s = SequenceMatcher(None, normalize(title), normalize(cand_title)).ratio()
+    if author and cand_authors:
+        a = normalize(author)
+        if a and (a in normalize(cand_authors) or
+                  SequenceMatcher(None, a, normalize(cand_authors)).ratio() > 0.7):
+            s += 0.1
+    return s
+
+
+# ---------- импорт ----------
+
+def _pick(row: dict, *names) -> Optional[str]:
+    for n in names:
+        v = row.get(n)
+        if isinstance(v, list):
+            v = ", ".join(str(x) for x in v)
+        if v not in (None, ""):
+            return str(v).strip()
+    return None
+
+
+def _read_dump(path: str) -> Iterator[dict]:
+    if path.endswith((".csv", ".tsv")):
+        with open(path, newline="", encoding="utf-8") as f:
+            yield from csv.DictReader(f, delimiter="\t" if path.endswith(".tsv") else ",")
+    else:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def import_catalog(path: str, db_path: str = CATALOG_PATH, replace: bool = False) -> int:
+    """Потоково заливает дамп пачками по IMPORT_BATCH и один раз перестраивает FTS-индекс."""
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        for sql in SCHEMA:
+            conn.execute(sql)
+        if replace:
+            conn.execute("DELETE FROM books")
+        n, batch = 0, []
+        sql = ("INSERT OR REPLACE INTO books(id, title, authors, genres, description, cover_url) "
+               "VALUES (?, ?, ?, ?, ?, ?)")
+        for row in _read_dump(path):
+            title = _pick(row, "title", "name")
+            if not title:
+                continue
+            book_id = _pick(row, "id", "book_id")
+            batch.append((
+                int(book_id) if book_id and book_id.isdigit() else None, title,
+                _pick(row, "authors", "author"), _pick(row, "genres", "genre", "tags"),
+                _pick(row, "description", "annotation"), _pick(row, "cover_url", "cover", "image_url"),
+            ))
+            if len(batch) >= IMPORT_BATCH:
+                conn.executemany(sql, batch)
+                n += len(batch)
+                batch = []
+        if batch:
+            conn.executemany(sql, batch)
+            n += len(batch)
+        conn.execute("INSERT INTO books_fts(books_fts) VALUES('rebuild')")
+        conn.commit()
+        conn.execute("PRAGMA optimize")
+        return n
+    finally:
+        conn.close()
+
+
+# ---------- рантайм ----------
+
+class Catalog:
+    def __init__(self, path: str = CATALOG_PATH):
+        self.path = path
+        self._db: Optional[Database] = None
+        self.size = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._db is not None and self.size > 0
+
+    async def open(self):
+        if not os.path.exists(self.path):
+            return
+        self._db = Database(self.path, readers=2)
+        await self._db.open()
+        async with self._db.write() as conn:
+            for sql in SCHEMA:
+                await conn.execute(sql)
+        async with self._db.read() as conn:
+            rows = await conn.execute_fetchall("SELECT count(*) FROM books")
+        self.size = rows[0][0]
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    async def resolve(self, books: List[dict]) -> List[Optional[dict]]:
+        """
+        Сопоставляет книги из ответа LLM ({"title", "author"}) с каталогом: один MATCH-запрос на весь ответ
+        (плюс дешёвый запрос частот слов из books_vocab). Возвращает для каждой книги строку каталога или None.
+        """
+        if not self.ready or not books:
+            return [None] * len(books)
+        words = [_title_words(b.get("title")) for b in books]
+        vocab = sorted({w for ws in words for w in ws})
+        if not vocab:
+            return [None] * len(books)
+        async with self._db.read() as conn:
+            df = dict(await conn.execute_fetchall(
+                "SELECT term, doc FROM books_vocab WHERE col = 'title' AND term IN "
+                f"({','.join('?' * len(vocab))})", vocab,
+            ))
+        common = max(50, int(self.size * CATALOG_COMMON_DF))
+
+        parts, params = [], []
+        for i, ws in enumerate(words):
+            q = _fts_query(ws, df, common)
+            if q is None:
+                continue
+            parts.append(
+                "SELECT * FROM (SELECT ? AS idx, rowid AS book_id, bm25(books_fts) AS r "
+                "FROM books_fts WHERE books_fts MATCH ? ORDER BY r LIMIT ?)"
+            )
+            params += [i, q, CATALOG_CANDIDATES]
+        if not parts:
+            return [None] * len(books)
+        sql = (
+            "SELECT c.idx, b.id, b.title, b.authors, b.genres, b.description, b.cover_url "
+            f"FROM ({' UNION ALL '.join(parts)}) c JOIN books b ON b.id = c.book_id"
+        )
+        async with self._db.read() as conn:
+            rows = await conn.execute_fetchall(sql, params)
+
+        best: List[Optional[tuple]] = [None] * len(books)
+        for idx, *cand in rows:
+            b = books[idx]
+            s = _score(b.get("title"), b.get("author"), cand[1], cand[2])
+            if s >= CATALOG_MATCH_MIN and (best[idx] is None or s > best[idx][0]):
+                best[idx] = (s, cand)
+        out: List[Optional[dict]] = []
+        for m in best:
+            if m is None:
+                out.append(None)
+                continue
+            book_id, title, authors, genres, description, cover_url = m[1]
+            out.append({
+                "id": book_id, "title": title, "authors": authors, "genres": genres,
+                "description": description, "cover_url": cover_url, "score": round(m[0], 3),
+            })
+        return out
+
+    async def get_many(self, ids: List[int]) -> dict:
+        """id -> строка каталога, одним запросом."""
+        if not self.ready or not ids:
+            return {}
+        async with self._db.read() as conn:
+            rows = await conn.execute_fetchall(
+                "SELECT id, title, authors, genres, description, cover_url FROM books "
+                f"WHERE id IN ({','.join('?' * len(ids))})", list(ids),
+            )
+        return {
+            r[0]: {"id": r[0], "title": r[1], "authors": r[2], "genres": r[3],
+                   "description": r[4], "cover_url": r[5]}
+            for r in rows
+        }
+
+
+catalog = Catalog()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if len(args) < 2 or args[0] != "import":
+        print(__doc__)
+        sys.exit(1)
+    count = import_catalog(args[1], replace="--replace" in args)
+    print(f"imported {count} books into {CATALOG_PATH}")
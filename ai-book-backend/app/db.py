@@ -1,74 +1,125 @@
-import aiosqlite
+"""
+Точка входа в хранилище: функции ниже делегируют в Repository (app/repository.py), выбранный DB_BACKEND:
+  sqlite     — файл DB_PATH на узле (app/db_sqlite.py), по умолчанию;
+  sqlalchemy — DATABASE_URL через SQLAlchemy async (app/db_sql.py): postgresql+asyncpg://... для
+               нескольких узлов с общим состоянием или sqlite+aiosqlite:///... для локальной проверки.
+"""
 import os
+from typing import Optional
+
+from app.metrics import db_timed
+from app.repository import Repository, SEGMENT_KINDS  # noqa: F401
+from app.resp_cache import resp_cache
+
+DB_BACKEND = os.getenv("DB_BACKEND", "sqlite")
+
+_repo: Optional[Repository] = None
+
+
+def _create() -> Repository:
+    if DB_BACKEND == "sqlite":
+        from app.db_sqlite import SqliteRepository
+        return SqliteRepository()
+    if DB_BACKEND == "sqlalchemy":
+        # импорт здесь: SQLAlchemy/asyncpg нужны только этому бэкенду
+        from app.db_sql import SqlAlchemyRepository
+        return SqlAlchemyRepository()
+    raise ValueError(f"unknown DB_BACKEND={DB_BACKEND!r}, expected sqlite or sqlalchemy")
+
+
+def get_repository() -> Repository:
+    global _repo
+    if _repo is None:
+        _repo = _create()
+    return _repo
 
-DB_DIR = os.path.join(os.path.dirname(__file__), "data")
-DB_PATH = os.path.join(DB_DIR, "app.db")
 
 async def init_db():
-    os.makedirs(DB_DIR, exist_ok=True)
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS profiles (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            lang TEXT,
-            preferred_genres TEXT,
-            preferred_authors TEXT
-        )""")
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS quiz (
-            user_id INTEGER PRIMARY KEY,
-            q1_favorite_book TEXT,
-            q2_books_per_year INTEGER
-        )""")
-        await db.commit()
+    await get_repository().init()
 
+
+async def close_db():
+    global _repo
+    if _repo is not None:
+        await _repo.close()
+        _repo = None
+
+# ---------- профиль и викторина ----------
+# Каждая запись сбрасывает готовые ответы GET этого процесса (app/resp_cache.py) — после записи в базу.
+
+@db_timed
 async def upsert_profile(user_id:int, username, first_name, last_name, lang, genres, authors):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-        INSERT INTO profiles(user_id, username, first_name, last_name, lang, preferred_genres, preferred_authors)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ON CONFLICT(user_id) DO UPDATE SET
-            username=excluded.username,
-            first_name=excluded.first_name,
-            last_name=excluded.last_name,
-            lang=excluded.lang,
-            preferred_genres=excluded.preferred_genres,
-            preferred_authors=excluded.preferred_authors
-        """, (user_id, username, first_name, last_name, lang, ",".join(genres), ",".join(authors)))
-        await db.commit()
+    await get_repository().upsert_profile(user_id, username, first_name, last_name, lang, genres, authors)
+    resp_cache.invalidate("profiles", (user_id,))
 
+@db_timed
 async def get_profile(user_id:int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT user_id, username, first_name, last_name, lang, preferred_genres, preferred_authors FROM profiles WHERE user_id=?", (user_id,))
-        row = await cur.fetchone()
-        if not row: return None
-        return {
-            "user_id": row[0],
-            "username": row[1],
-            "first_name": row[2],
-            "last_name": row[3],
-            "lang": row[4],
-            "preferred_genres": row[5].split(",") if row[5] else [],
-            "preferred_authors": row[6].split(",") if row[6] else [],
-        }
+    return await get_repository().get_profile(user_id)
 
+@db_timed
 async def upsert_quiz(user_id:int, q1, q2):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-        INSERT INTO quiz(user_id, q1_favorite_book, q2_books_per_year)
-        VALUES (?, ?, ?)
-        ON CONFLICT(user_id) DO UPDATE SET
-            q1_favorite_book=excluded.q1_favorite_book,
-            q2_books_per_year=excluded.q2_books_per_year
-        """, (user_id, q1, q2))
-        await db.commit()
+    await get_repository().upsert_quiz(user_id, q1, q2)
+    resp_cache.invalidate("quiz", (user_id,))
 
+@db_timed
 async def get_quiz(user_id:int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT user_id, q1_favorite_book, q2_books_per_year FROM quiz WHERE user_id=?", (user_id,))
-        row = await cur.fetchone()
-        if not row: return None
-        return {"user_id": row[0], "q1_favorite_book": row[1], "q2_books_per_year": row[2]}
+    return await get_repository().get_quiz(user_id)
+
+@db_timed
+async def get_user_context(user_id:int):
+    """(профиль, квиз) пользователя; отсутствующие — None."""
+    return await get_repository().get_user_context(user_id)
+
+@db_timed
+async def get_version(table: str, user_id:int):
+    return await get_repository().get_version(table, user_id)
+
+# ---------- bulk ----------
+
+def iter_profiles(user_ids):
+    """Профили пачками по DB_IN_CHUNK: один запрос IN (...) на пачку."""
+    return get_repository().iter_profiles(user_ids)
+
+def iter_quizzes(user_ids):
+    return get_repository().iter_quizzes(user_ids)
+
+@db_timed
+async def get_profiles(user_ids) -> list:
+    return [p async for chunk in iter_profiles(user_ids) for p in chunk]
+
+@db_timed
+async def get_quizzes(user_ids) -> list:
+    return [q async for chunk in iter_quizzes(user_ids) for q in chunk]
+
+@db_timed
+async def upsert_profiles(items) -> int:
+    """items: dict-и с полями профиля и user_id; всё пишется одной транзакцией."""
+    n = await get_repository().upsert_profiles(items)
+    resp_cache.invalidate("profiles", (p["user_id"] for p in items))
+    return n
+
+@db_timed
+async def upsert_quizzes(items) -> int:
+    n = await get_repository().upsert_quizzes(items)
+    resp_cache.invalidate("quiz", (q["user_id"] for q in items))
+    return n
+
+# ---------- сегменты ----------
+
+@db_timed
+async def top_segment(kind: str, limit: int = 20) -> list:
+    return await get_repository().top_segment(kind, limit)
+
+@db_timed
+async def segment_users(filters: dict, after: int = 0, limit: int = 1000) -> dict:
+    return await get_repository().segment_users(filters, after, limit)
+
+# ---------- предрасчитанные рекомендации ----------
+
+@db_timed
+async def get_precomputed(user_id:int):
+    return await get_repository().get_precomputed(user_id)
+
+@db_timed
+async def save_precomputed(user_id:int, fingerprint: str, books: list):
+    await get_repository().save_precomputed(user_id, fingerprint, books)
@@ -0,0 +1,616 @@
+"""
+SQLite-хранилище (DB_PATH): постоянные соединения с WAL, опциональный write-behind.
+Общее для процессов одного узла; для нескольких узлов — DB_BACKEND=sqlalchemy (app/db_sql.py).
+"""
+import aiosqlite
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from app.metrics import db_timed
+from app.repository import Repository, SEGMENT_KINDS, new_version
+from app.write_behind import WriteBehindBuffer
+
+DB_DIR = os.path.join(os.path.dirname(__file__), "data")
+DB_PATH = os.getenv("DB_PATH", os.path.join(DB_DIR, "app.db"))
+
+# Постоянные соединения вместо aiosqlite.connect() на каждый вызов:
+# один писатель + небольшой пул читателей, WAL и переиспользование подготовленных выражений.
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "256"))
+
+# Write-behind для upsert профиля/викторины: записи копятся и коммитятся пачкой.
+# DB_WRITE_BEHIND_DELAY_MS — окно, в течение которого подтверждённая запись может быть потеряна при падении.
+DB_WRITE_BEHIND = os.getenv("DB_WRITE_BEHIND", "0") == "1"
+DB_WRITE_BEHIND_BATCH = int(os.getenv("DB_WRITE_BEHIND_BATCH", "256"))
+DB_WRITE_BEHIND_DELAY_MS = int(os.getenv("DB_WRITE_BEHIND_DELAY_MS", "50"))
+
+# размер пачки id в одном WHERE user_id IN (...) для bulk-чтения
+DB_IN_CHUNK = int(os.getenv("DB_IN_CHUNK", "500"))
+
+# версия схемы в PRAGMA user_version: 1 — жанры и авторы профиля в отдельных таблицах,
+# 2 — столбец version у profiles и quiz (ETag ответов), 3 — available_at у rec_jobs (пауза перед повтором)
+SCHEMA_VERSION = 3
+# разделитель списков в group_concat: в названиях жанров/авторов его не бывает (вычищается при записи)
+NAMES_SEP = "\x1f"
+
+
+async def _pragma(conn: aiosqlite.Connection, sql: str):
+    # курсор PRAGMA надо дочитать и закрыть, иначе оператор держит блокировку файла
+    await conn.execute_fetchall(sql)
+
+
+class Database:
+    def __init__(self, path: str = DB_PATH, readers: int = DB_READERS):
+        self.path = path
+        self.readers_count = max(1, readers)
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._readers: List[aiosqlite.Connection] = []
+        self._pool: Optional[asyncio.Queue] = None
+        self._write_lock = asyncio.Lock()
+
+    async def _connect(self, readonly: bool = False) -> aiosqlite.Connection:
+        # cached_statements — кэш prepared statements внутри sqlite3 на каждое соединение
+        conn = await aiosqlite.connect(
+            self.path, timeout=DB_BUSY_TIMEOUT_MS / 1000, cached_statements=DB_STATEMENT_CACHE,
+        )
+        await _pragma(conn, f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        await _pragma(conn, "PRAGMA synchronous=NORMAL")
+        await _pragma(conn, "PRAGMA temp_store=MEMORY")
+        if readonly:
+            await _pragma(conn, "PRAGMA query_only=1")
+        return conn
+
+    async def open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._writer = await self._connect()
+        # journal_mode хранится в файле БД: достаточно выставить один раз с писателя
+        await _pragma(self._writer, "PRAGMA journal_mode=WAL")
+        self._pool = asyncio.Queue()
+        for _ in range(self.readers_count):
+            conn = await self._connect(readonly=True)
+            self._readers.append(conn)
+            self._pool.put_nowait(conn)
+
+    @asynccontextmanager
+    async def read(self):
+        conn = await self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self):
+        # один писатель на процесс; между процессами (uvicorn workers) — WAL + busy_timeout
+        async with self._write_lock:
+            try:
+                yield self._writer
+                await self._writer.commit()
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+    async def close(self):
+        async with self._write_lock:
+            for conn in self._readers:
+                await conn.close()
+            self._readers = []
+            if self._writer is not None:
+                await self._writer.close()
+                self._writer = None
+
+
+_db: Optional[Database] = None
+_db_lock = asyncio.Lock()
+_wb: Optional[WriteBehindBuffer] = None
+
+
+async def get_db() -> Database:
+    global _db
+    if _db is None:
+        async with _db_lock:
+            if _db is None:
+                db = Database()
+                await db.open()
+                _db = db
+    return _db
+
+
+async def close_db():
+    global _db, _wb
+    if _wb is not None:
+        await _wb.close()
+        _wb = None
+    if _db is not None:
+        await _db.close()
+        _db = None
+
+
+async def init_db():
+    global _wb
+    db = await get_db()
+    if DB_WRITE_BEHIND and _wb is None:
+        _wb = WriteBehindBuffer(_flush_batch, DB_WRITE_BEHIND_BATCH, DB_WRITE_BEHIND_DELAY_MS / 1000)
+        _wb.start()
+    async with db.write() as conn:
+        await conn.execute("""
+        CREATE TABLE IF NOT EXISTS profiles (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            lang TEXT,
+            version INTEGER NOT NULL DEFAULT 0
+        )""")
+        # жанры и авторы профиля: справочник + связь многие-ко-многим с порядком (pos);
+        # users — число профилей с этим значением, поддерживается триггерами для топов без GROUP BY
+        for kind in ("genre", "author"):
+            await conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {kind}s (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE,
+                users INTEGER NOT NULL DEFAULT 0
+            )""")
+            await conn.execute(f"CREATE INDEX IF NOT EXISTS {kind}s_users ON {kind}s(users)")
+            await conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS profile_{kind}s (
+                user_id INTEGER NOT NULL,
+                {kind}_id INTEGER NOT NULL,
+                pos INTEGER NOT NULL,
+                PRIMARY KEY (user_id, {kind}_id)
+            ) WITHOUT ROWID""")
+            await conn.execute(
+                f"CREATE INDEX IF NOT EXISTS profile_{kind}s_{kind} ON profile_{kind}s({kind}_id, user_id)")
+            await conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS profile_{kind}s_ins AFTER INSERT ON profile_{kind}s BEGIN
+                UPDATE {kind}s SET users = users + 1 WHERE id = NEW.{kind}_id;
+            END""")
+            await conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS profile_{kind}s_del AFTER DELETE ON profile_{kind}s BEGIN
+                UPDATE {kind}s SET users = users - 1 WHERE id = OLD.{kind}_id;
+            END""")
+        await conn.execute("""
+        CREATE TABLE IF NOT EXISTS quiz (
+            user_id INTEGER PRIMARY KEY,
+            q1_favorite_book TEXT,
+            q2_books_per_year INTEGER,
+            version INTEGER NOT NULL DEFAULT 0
+        )""")
+        await conn.execute("""
+        CREATE TABLE IF NOT EXISTS rec_precomputed (
+            user_id INTEGER PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            books TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )""")
+        await conn.execute("""
+        CREATE TABLE IF NOT EXISTS rec_jobs (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            request TEXT NOT NULL,
+            status TEXT NOT NULL,
+            result TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at REAL NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )""")
+        await conn.execute("CREATE INDEX IF NOT EXISTS rec_jobs_status ON rec_jobs(status, created_at)")
+    await _migrate(db)
+
+
+async def _migrate(db: "Database"):
+    async with db.write() as conn:
+        # IMMEDIATE: при нескольких воркерах uvicorn миграцию выполняет один, остальные ждут и видят версию
+        await conn.execute("BEGIN IMMEDIATE")
+        version = (await conn.execute_fetchall("PRAGMA user_version"))[0][0]
+        if version >= SCHEMA_VERSION:
+            return
+        columns = {row[1] for row in await conn.execute_fetchall("PRAGMA table_info(profiles)")}
+        if "preferred_genres" in columns:
+            # старые строки "a,b,c" из profiles -> profile_genres/profile_authors, пачками
+            cur = await conn.execute(
+                "SELECT user_id, preferred_genres, preferred_authors FROM profiles "
+                "WHERE coalesce(preferred_genres, '') != '' OR coalesce(preferred_authors, '') != ''")
+            while True:
+                rows = await cur.fetchmany(DB_IN_CHUNK)
+                if not rows:
+                    break
+                await _write_names(conn, [(uid, _clean((g or "").split(",")), _clean((a or "").split(",")))
+                                          for uid, g, a in rows])
+            await cur.close()
+            await conn.execute("ALTER TABLE profiles DROP COLUMN preferred_genres")
+            await conn.execute("ALTER TABLE profiles DROP COLUMN preferred_authors")
+        for table in ("profiles", "quiz"):
+            if "version" not in {row[1] for row in await conn.execute_fetchall(f"PRAGMA table_info({table})")}:
+                await conn.execute(f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        if "available_at" not in {row[1] for row in await conn.execute_fetchall("PRAGMA table_info(rec_jobs)")}:
+            await conn.execute("ALTER TABLE rec_jobs ADD COLUMN available_at REAL NOT NULL DEFAULT 0")
+        await conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+
+UPSERT_PROFILE_SQL = """
+        INSERT INTO profiles(user_id, username, first_name, last_name, lang, version)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            username=excluded.username,
+            first_name=excluded.first_name,
+            last_name=excluded.last_name,
+            lang=excluded.lang,
+            version=excluded.version
+        """
+# списки профиля в порядке pos одной строкой через NAMES_SEP; подзапросы идут по первичному ключу (user_id, ...)
+_NAMES_SQL = """(SELECT group_concat(name, char(31)) FROM (
+            SELECT k.name FROM profile_{kind}s pk JOIN {kind}s k ON k.id = pk.{kind}_id
+            WHERE pk.user_id = p.user_id ORDER BY pk.pos))"""
+PROFILE_COLUMNS_SQL = ("p.user_id, p.username, p.first_name, p.last_name, p.lang, "
+                       + _NAMES_SQL.format(kind="genre") + ", " + _NAMES_SQL.format(kind="author")
+                       + ", p.version")
+SELECT_PROFILE_SQL = f"SELECT {PROFILE_COLUMNS_SQL} FROM profiles p"
+GET_PROFILE_SQL = SELECT_PROFILE_SQL + " WHERE user_id=?"
+UPSERT_QUIZ_SQL = """
+        INSERT INTO quiz(user_id, q1_favorite_book, q2_books_per_year, version)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            q1_favorite_book=excluded.q1_favorite_book,
+            q2_books_per_year=excluded.q2_books_per_year,
+            version=excluded.version
+        """
+SELECT_QUIZ_SQL = "SELECT user_id, q1_favorite_book, q2_books_per_year, version FROM quiz"
+GET_QUIZ_SQL = SELECT_QUIZ_SQL + " WHERE user_id=?"
+
+
+def _clean(names) -> tuple:
+    # без пустых, повторов и разделителя NAMES_SEP; порядок пользователя сохраняется
+    return tuple(dict.fromkeys(n.replace(NAMES_SEP, " ").strip() for n in names if n and n.strip()))
+
+
+def _names(value) -> list:
+    # строка из group_concat (чтение из БД) или кортеж (ещё не записанные параметры write-behind)
+    if isinstance(value, str):
+        return value.split(NAMES_SEP) if value else []
+    return list(value or ())
+
+
+async def _write_names(conn, rows):
+    """rows: (user_id, жанры, авторы) — списки пользователя заменяются целиком."""
+    for i, kind in ((1, "genre"), (2, "author")):
+        await conn.executemany(f"DELETE FROM profile_{kind}s WHERE user_id=?", [(r[0],) for r in rows])
+        names = {n for r in rows for n in r[i]}
+        if not names:
+            continue
+        await conn.executemany(f"INSERT OR IGNORE INTO {kind}s(name) VALUES (?)", [(n,) for n in names])
+        await conn.executemany(
+            f"INSERT INTO profile_{kind}s(user_id, {kind}_id, pos) SELECT ?, id, ? FROM {kind}s WHERE name=?",
+            [(r[0], pos, n) for r in rows for pos, n in enumerate(r[i])])
+
+
+async def _write_profiles(conn, rows):
+    # rows — 8-кортежи (user_id, username, first_name, last_name, lang, жанры, авторы, version)
+    await conn.executemany(UPSERT_PROFILE_SQL, [r[:5] + (r[7],) for r in rows])
+    await _write_names(conn, [(r[0], r[5], r[6]) for r in rows])
+
+
+def _profile_params(user_id, username, first_name, last_name, lang, genres, authors) -> tuple:
+    return (user_id, username, first_name, last_name, lang, _clean(genres or ()), _clean(authors or ()),
+            new_version())
+
+
+@db_timed
+async def _flush_batch(batch: dict):
+    # одна транзакция на пачку; ключ буфера — (таблица, user_id), значение — параметры upsert
+    profiles = [v for (table, _), v in batch.items() if table == "profiles"]
+    quiz = [v for (table, _), v in batch.items() if table == "quiz"]
+    db = await get_db()
+    async with db.write() as conn:
+        if profiles:
+            await _write_profiles(conn, profiles)
+        if quiz:
+            await conn.executemany(UPSERT_QUIZ_SQL, quiz)
+
+
+def _profile_dict(row):
+    return {
+        "user_id": row[0],
+        "username": row[1],
+        "first_name": row[2],
+        "last_name": row[3],
+        "lang": row[4],
+        "preferred_genres": _names(row[5]),
+        "preferred_authors": _names(row[6]),
+        "version": row[7],
+    }
+
+def _quiz_dict(row):
+    return {"user_id": row[0], "q1_favorite_book": row[1], "q2_books_per_year": row[2], "version": row[3]}
+
+async def upsert_profile(user_id:int, username, first_name, last_name, lang, genres, authors):
+    params = _profile_params(user_id, username, first_name, last_name, lang, genres, authors)
+    if _wb is not None:
+        _wb.put(("profiles", user_id), params)
+        return
+    db = await get_db()
+    async with db.write() as conn:
+        await _write_profiles(conn, [params])
+
+async def get_profile(user_id:int):
+    if _wb is not None:
+        pending = _wb.get(("profiles", user_id))
+        if pending is not None:
+            return _profile_dict(pending)
+    db = await get_db()
+    async with db.read() as conn:
+        rows = await conn.execute_fetchall(GET_PROFILE_SQL, (user_id,))
+    if not rows: return None
+    return _profile_dict(rows[0])
+
+async def upsert_quiz(user_id:int, q1, q2):
+    params = (user_id, q1, q2, new_version())
+    if _wb is not None:
+        _wb.put(("quiz", user_id), params)
+        return
+    db = await get_db()
+    async with db.write() as conn:
+        await conn.execute(UPSERT_QUIZ_SQL, params)
+
+async def get_quiz(user_id:int):
+    if _wb is not None:
+        pending = _wb.get(("quiz", user_id))
+        if pending is not None:
+            return _quiz_dict(pending)
+    db = await get_db()
+    async with db.read() as conn:
+        rows = await conn.execute_fetchall(GET_QUIZ_SQL, (user_id,))
+    if not rows: return None
+    return _quiz_dict(rows[0])
+
+async def get_version(table: str, user_id:int):
+    """Версия строки profiles/quiz (с учётом буфера write-behind); None — строки нет."""
+    if table not in ("profiles", "quiz"):
+        raise ValueError("table must be profiles or quiz")
+    if _wb is not None:
+        pending = _wb.get((table, user_id))
+        if pending is not None:
+            return pending[-1]
+    db = await get_db()
+    async with db.read() as conn:
+        rows = await conn.execute_fetchall(f"SELECT version FROM {table} WHERE user_id=?", (user_id,))
+    return rows[0][0] if rows else None
+
+USER_CONTEXT_SQL = f"""
+        SELECT {PROFILE_COLUMNS_SQL},
+               q.user_id, q.q1_favorite_book, q.q2_books_per_year, q.version
+        FROM (SELECT ? AS user_id) u
+        LEFT JOIN profiles p ON p.user_id = u.user_id
+        LEFT JOIN quiz q ON q.user_id = u.user_id
+        """
+
+async def get_user_context(user_id:int):
+    """(профиль, квиз) пользователя одним запросом; отсутствующие — None."""
+    db = await get_db()
+    async with db.read() as conn:
+        rows = await conn.execute_fetchall(USER_CONTEXT_SQL, (user_id,))
+    row = rows[0]
+    profile = row[:8] if row[0] is not None else None
+    quiz = row[8:] if row[8] is not None else None
+    if _wb is not None:
+        profile = _wb.get(("profiles", user_id), profile)
+        quiz = _wb.get(("quiz", user_id), quiz)
+    return (_profile_dict(profile) if profile else None, _quiz_dict(quiz) if quiz else None)
+
+# ---------- bulk ----------
+
+def _chunks(ids, size: int = DB_IN_CHUNK):
+    ids = list(dict.fromkeys(ids))     # без дублей, порядок сохраняем
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+async def _iter_many(table: str, select_sql: str, to_dict, user_ids):
+    db = await get_db()
+    for chunk in _chunks(user_ids):
+        sql = f"{select_sql} WHERE user_id IN ({','.join('?' * len(chunk))})"
+        async with db.read() as conn:
+            rows = await conn.execute_fetchall(sql, chunk)
+        found = {row[0]: row for row in rows}
+        if _wb is not None:
+            for uid in chunk:
+                pending = _wb.get((table, uid))
+                if pending is not None:
+                    found[uid] = pending
+        yield [to_dict(found[uid]) for uid in chunk if uid in found]
+
+def iter_profiles(user_ids):
+    """Профили пачками по DB_IN_CHUNK: один запрос IN (...) на пачку."""
+    return _iter_many("profiles", SELECT_PROFILE_SQL, _profile_dict, user_ids)
+
+def iter_quizzes(user_ids):
+    return _iter_many("quiz", SELECT_QUIZ_SQL, _quiz_dict, user_ids)
+
+async def _upsert_many(table: str, write, rows: list):
+    if _wb is not None:
+        for params in rows:
+            _wb.put((table, params[0]), params)
+        return
+    db = await get_db()
+    async with db.write() as conn:
+        await write(conn, rows)
+
+async def _write_quizzes(conn, rows):
+    await conn.executemany(UPSERT_QUIZ_SQL, rows)
+
+async def upsert_profiles(items) -> int:
+    """items: dict-и с полями профиля и user_id; всё пишется одной транзакцией."""
+    # повтор user_id в пачке — побеждает последняя запись (иначе связи жанров/авторов вставятся дважды)
+    items = {p["user_id"]: p for p in items}.values()
+    rows = [
+        _profile_params(p["user_id"], p.get("username"), p.get("first_name"), p.get("last_name"), p.get("lang"),
+                        p.get("preferred_genres"), p.get("preferred_authors"))
+        for p in items
+    ]
+    await _upsert_many("profiles", _write_profiles, rows)
+    return len(rows)
+
+async def upsert_quizzes(items) -> int:
+    version = new_version()
+    rows = list({q["user_id"]: (q["user_id"], q.get("q1_favorite_book") or "", q.get("q2_books_per_year") or 0, version)
+                 for q in items}.values())
+    await _upsert_many("quiz", _write_quizzes, rows)
+    return len(rows)
+
+# ---------- сегменты по жанрам и авторам ----------
+# Читают только записанное в БД: профили из буфера write-behind видны через DB_WRITE_BEHIND_DELAY_MS.
+
+async def top_segment(kind: str, limit: int = 20) -> list:
+    """Самые частые жанры/авторы профилей с числом пользователей — по индексу на счётчике, без GROUP BY."""
+    if kind not in SEGMENT_KINDS:
+        raise ValueError(f"kind must be one of {SEGMENT_KINDS}")
+    db = await get_db()
+    async with db.read() as conn:
+        rows = await conn.execute_fetchall(
+            f"SELECT name, users FROM {kind}s WHERE users > 0 ORDER BY users DESC LIMIT ?", (limit,))
+    return [{"name": name, "users": users} for name, users in rows]
+
+async def segment_users(filters: dict, after: int = 0, limit: int = 1000) -> dict:
+    """
+    user_id профилей, у которых есть все значения filters ({"genre": ..., "author": ...}), по возрастанию.
+    Постранично по ключу: следующая страница — after=next_after. total — размер сегмента по одному фильтру
+    (точный, если фильтр один).
+    """
+    if not filters or not set(filters) <= set(SEGMENT_KINDS):
+        raise ValueError(f"filters must use {SEGMENT_KINDS}")
+    db = await get_db()
+    async with db.read() as conn:
+        found = []
+        for kind, name in filters.items():
+            rows = await conn.execute_fetchall(f"SELECT id, users FROM {kind}s WHERE name=?", (name,))
+            if not rows:
+                return {"total": 0, "user_ids": [], "next_after": None}
+            found.append((kind, rows[0][0], rows[0][1]))
+        # ведём по самому маленькому сегменту, остальные проверяем по первичному ключу
+        found.sort(key=lambda x: x[2])
+        (kind, kid, total), rest = found[0], found[1:]
+        joins = "".join(f" JOIN profile_{k}s f{i} ON f{i}.user_id = s.user_id AND f{i}.{k}_id = {int(v)}"
+                        for i, (k, v, _) in enumerate(rest))
+        rows = await conn.execute_fetchall(
+            f"SELECT s.user_id FROM profile_{kind}s s{joins} "
+            f"WHERE s.{kind}_id = ? AND s.user_id > ? ORDER BY s.user_id LIMIT ?",
+            (kid, after, limit))
+    ids = [r[0] for r in rows]
+    return {"total": total, "user_ids": ids, "next_after": ids[-1] if len(ids) == limit else None}
+
+# ---------- предрасчитанные рекомендации ----------
+
+async def get_precomputed(user_id:int):
+    db = await get_db()
+    async with db.read() as conn:
+        rows = await conn.execute_fetchall(
+            "SELECT fingerprint, books, updated_at FROM rec_precomputed WHERE user_id=?", (user_id,))
+    if not rows: return None
+    return {"fingerprint": rows[0][0], "books": json.loads(rows[0][1]), "updated_at": rows[0][2]}
+
+async def save_precomputed(user_id:int, fingerprint: str, books: list):
+    db = await get_db()
+    async with db.write() as conn:
+        await conn.execute("""
+        INSERT INTO rec_precomputed(user_id, fingerprint, books, updated_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            fingerprint=excluded.fingerprint,
+            books=excluded.books,
+            updated_at=excluded.updated_at
+        """, (user_id, fingerprint, json.dumps(books, ensure_ascii=False), time.time()))
+
+# ---------- очередь задач ----------
+
+CLAIM_SQL = """
+UPDATE rec_jobs SET status='running', attempts=attempts+1, updated_at=?
+WHERE id = (SELECT id FROM rec_jobs WHERE status='queued' AND available_at <= ? ORDER BY created_at LIMIT 1)
+RETURNING id, user_id, request, attempts
+"""
+
+async def enqueue_job(job_id: str, user_id: int, request: str, now: float):
+    db = await get_db()
+    async with db.write() as conn:
+        await conn.execute(
+            "INSERT INTO rec_jobs(id, user_id, request, status, attempts, available_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, 'queued', 0, ?, ?, ?)",
+            (job_id, user_id, request, now, now, now),
+        )
+
+async def get_job(job_id: str):
+    db = await get_db()
+    async with db.read() as conn:
+        rows = await conn.execute_fetchall(
+            "SELECT id, user_id, status, result, error, created_at, updated_at FROM rec_jobs WHERE id=?",
+            (job_id,),
+        )
+    return tuple(rows[0]) if rows else None
+
+async def claim_job(now: float):
+    # UPDATE ... RETURNING атомарен: задачу получит ровно один процесс
+    db = await get_db()
+    async with db.write() as conn:
+        rows = await conn.execute_fetchall(CLAIM_SQL, (now, now))
+    return tuple(rows[0]) if rows else None
+
+async def finish_job(job_id: str, status: str, result, error, now: float):
+    db = await get_db()
+    async with db.write() as conn:
+        await conn.execute(
+            "UPDATE rec_jobs SET status=?, result=?, error=?, updated_at=? WHERE id=?",
+            (status, result, error, now, job_id),
+        )
+
+async def requeue_job(job_id: str, available_at: float):
+    db = await get_db()
+    async with db.write() as conn:
+        await conn.execute("UPDATE rec_jobs SET status='queued', available_at=? WHERE id=?", (available_at, job_id))
+
+async def requeue_running(before: float):
+    db = await get_db()
+    async with db.write() as conn:
+        await conn.execute("UPDATE rec_jobs SET status='queued' WHERE status='running' AND updated_at <= ?",
+                           (before,))
+
+async def cleanup_jobs(before: float):
+    db = await get_db()
+    async with db.write() as conn:
+        await conn.execute("DELETE FROM rec_jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (before,))
+
+
+class SqliteRepository(Repository):
+    """Repository поверх функций этого модуля (соединения и буфер write-behind — на процесс)."""
+
+    async def init(self):
+        await init_db()
+
+    async def close(self):
+        await close_db()
+
+    upsert_profile = staticmethod(upsert_profile)
+    get_profile = staticmethod(get_profile)
+    upsert_quiz = staticmethod(upsert_quiz)
+    get_quiz = staticmethod(get_quiz)
+    get_user_context = staticmethod(get_user_context)
+    get_version = staticmethod(get_version)
+    iter_profiles = staticmethod(iter_profiles)
+    iter_quizzes = staticmethod(iter_quizzes)
+    upsert_profiles = staticmethod(upsert_profiles)
+    upsert_quizzes = staticmethod(upsert_quizzes)
+    top_segment = staticmethod(top_segment)
+    segment_users = staticmethod(segment_users)
+    get_precomputed = staticmethod(get_precomputed)
+    save_precomputed = staticmethod(save_precomputed)
+    enqueue_job = staticmethod(enqueue_job)
+    get_job = staticmethod(get_job)
+    claim_job = staticmethod(claim_job)
+    finish_job = staticmethod(finish_job)
+    requeue_job = staticmethod(requeue_job)
+    requeue_running = staticmethod(requeue_running)
+    cleanup_jobs = staticmethod(cleanup_jobs)
@@ -0,0 +1,286 @@
+"""
+Журнал событий взаимодействия (показ рекомендации, клик, оценка...). Приём не трогает БД:
+put() кладёт событие в кольцевой буфер в памяти (при переполнении вытесняются самые старые),
+фоновая задача раз в EVENTS_FLUSH_MS или по набору EVENTS_BATCH пишет пачку одной транзакцией.
+
+Хранилище — отдельный файл EVENTS_DB_PATH (свой писатель и WAL, не конкурирует с профилями):
+  events_YYYYMMDD    — сырые события, по таблице на сутки UTC, только INSERT; старые партиции
+                       целиком удаляются через EVENTS_RETENTION_DAYS (DROP TABLE вместо DELETE);
+  event_title_daily  — (type, day, title) -> n, счётчики пополняются при каждом сбросе;
+  event_user_daily   — (day, user_id): активные пользователи за сутки.
+Агрегаты считаются при записи, поэтому отчёты не сканируют сырые события.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import Counter, deque
+from datetime import date, datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from app.db_sqlite import DB_DIR, Database
+
+log = logging.getLogger(__name__)
+
+EVENTS_DB_PATH = os.getenv("EVENTS_DB_PATH", os.path.join(DB_DIR, "events.db"))
+EVENTS_BUFFER = int(os.getenv("EVENTS_BUFFER", "100000"))
+EVENTS_BATCH = int(os.getenv("EVENTS_BATCH", "5000"))
+EVENTS_FLUSH_MS = int(os.getenv("EVENTS_FLUSH_MS", "1000"))
+EVENTS_RETENTION_DAYS = int(os.getenv("EVENTS_RETENTION_DAYS", "90"))   # 0 — хранить сырые события всегда
+# время события от клиента принимается, если оно не старше EVENTS_MAX_DELAY сек и не из будущего;
+# иначе берётся время приёма — чтобы кривые часы клиента не плодили партиции
+EVENTS_MAX_DELAY = float(os.getenv("EVENTS_MAX_DELAY", "86400"))
+
+PARTITION_PREFIX = "events_"
+
+# (ts, user_id, type, title, props)
+Event = Tuple[float, int, str, Optional[str], Optional[dict]]
+
+
+def day_of(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d")
+
+
+def partition_of(day: str) -> str:
+    return PARTITION_PREFIX + day.replace("-", "")
+
+
+class EventLog:
+    def __init__(self, path: str = EVENTS_DB_PATH, buffer: int = EVENTS_BUFFER, batch: int = EVENTS_BATCH,
+                 flush_ms: int = EVENTS_FLUSH_MS, retention_days: int = EVENTS_RETENTION_DAYS):
+        self.path = path
+        self.batch = max(1, batch)
+        self.interval = flush_ms / 1000
+        self.retention_days = retention_days
+        self._buf: deque = deque(maxlen=max(1, buffer))
+        self._db: Optional[Database] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._closing = False
+        # партиции, о которых этот процесс знает; другие воркеры создают свои — см. _find_partitions
+        self._partitions: Set[str] = set()
+        self._purged_day = ""
+        self.accepted = 0
+        self.dropped = 0
+        self.written = 0
+        self.flushes = 0
+        self.failed = 0
+
+    # ---------- приём ----------
+
+    def put(self, events: Iterable[Event]) -> int:
+        """Синхронно и без ввода-вывода: событие попадает в буфер, запись — позже, в фоне."""
+        now = time.time()
+        n = 0
+        for ts, user_id, type_, title, props in events:
+            if ts is None or not (now - EVENTS_MAX_DELAY <= ts <= now + 60):
+                ts = now
+            if len(self._buf) == self._buf.maxlen:
+                self.dropped += 1
+            self._buf.append((ts, user_id, type_, title, props))
+            n += 1
+        self.accepted += n
+        if self._wakeup is not None and len(self._buf) >= self.batch:
+            self._wakeup.set()
+        return n
+
+    # ---------- фоновая запись ----------
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._closing = False
+        self._db = Database(self.path, readers=2)
+        await self._db.open()
+        async with self._db.write() as conn:
+            await conn.execute("""
+            CREATE TABLE IF NOT EXISTS event_title_daily (
+                type TEXT NOT NULL,
+                day TEXT NOT NULL,
+                title TEXT NOT NULL,
+                n INTEGER NOT NULL,
+                PRIMARY KEY (type, day, title)
+            ) WITHOUT ROWID""")
+            await conn.execute("""
+            CREATE TABLE IF NOT EXISTS event_user_daily (
+                day TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                PRIMARY KEY (day, user_id)
+            ) WITHOUT ROWID""")
+        await self._find_partitions()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _find_partitions(self) -> Set[str]:
+        """Партиции по sqlite_master: при нескольких воркерах часть из них создали другие процессы."""
+        async with self._db.read() as conn:
+            rows = await conn.execute_fetchall(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name GLOB 'events_[0-9]*'")
+        self._partitions = {r[0] for r in rows}
+        return self._partitions
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                while len(self._buf) >= self.batch:
+                    await self.flush()
+                await self.flush()
+                await self._purge()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("event flush failed, %d events buffered", len(self._buf))
+                await asyncio.sleep(self.interval)
+
+    async def flush(self):
+        if not self._buf or self._db is None:
+            return
+        batch = [self._buf.popleft() for _ in range(min(self.batch, len(self._buf)))]
+        try:
+            await self._write(batch)
+        except Exception:
+            self.failed += 1
+            # пачку — обратно в начало буфера; если за это время он заполнился, старые события вытесняются
+            room = self._buf.maxlen - len(self._buf)
+            self.dropped += max(0, len(batch) - room)
+            self._buf.extendleft(reversed(batch[len(batch) - room:] if room < len(batch) else batch))
+            raise
+        self.flushes += 1
+        self.written += len(batch)
+
+    async def _write(self, batch: List[Event]):
+        by_day: Dict[str, list] = {}
+        titles: Counter = Counter()
+        users = set()
+        for ts, user_id, type_, title, props in batch:
+            day = day_of(ts)
+            by_day.setdefault(day, []).append(
+                (ts, user_id, type_, title, json.dumps(props, ensure_ascii=False) if props else None))
+            if title:
+                titles[(type_, day, title)] += 1
+            users.add((day, user_id))
+        async with self._db.write() as conn:
+            for day, rows in by_day.items():
+                table = partition_of(day)
+                if table not in self._partitions:
+                    await conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        ts REAL NOT NULL,
+                        user_id INTEGER NOT NULL,
+                        type TEXT NOT NULL,
+                        title TEXT,
+                        props TEXT
+                    )""")
+                await conn.executemany(
+                    f"INSERT INTO {table}(ts, user_id, type, title, props) VALUES (?, ?, ?, ?, ?)", rows)
+            await conn.executemany(
+                "INSERT INTO event_title_daily(type, day, title, n) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(type, day, title) DO UPDATE SET n = n + excluded.n",
+                [(*k, n) for k, n in titles.items()])
+            await conn.executemany("INSERT OR IGNORE INTO event_user_daily(day, user_id) VALUES (?, ?)",
+                                   sorted(users))
+        # в кэш имён — только после коммита: при откате таблица могла не создаться
+        self._partitions.update(partition_of(day) for day in by_day)
+
+    async def _purge(self):
+        # раз в сутки: сырые партиции старше срока хранения удаляются целиком, агрегаты остаются
+        today = day_of(time.time())
+        if self.retention_days <= 0 or today == self._purged_day:
+            return
+        oldest = partition_of(day_of(time.time() - self.retention_days * 86400))
+        old = sorted(t for t in await self._find_partitions() if t < oldest)
+        if old:
+            async with self._db.write() as conn:
+                for table in old:
+                    await conn.execute(f"DROP TABLE IF EXISTS {table}")
+            self._partitions.difference_update(old)
+            log.info("dropped %d event partitions older than %s", len(old), oldest)
+        self._purged_day = today
+
+    async def close(self):
+        # задачу не отменяем: отмена посреди flush() потеряла бы уже вынутую из буфера пачку
+        self._closing = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        if self._db is not None:
+            # дренируем буфер при остановке
+            try:
+                while self._buf:
+                    await self.flush()
+            except Exception:
+                log.exception("event flush on shutdown failed, %d events lost", len(self._buf))
+            await self._db.close()
+            self._db = None
+
+    # ---------- отчёты ----------
+
+    async def title_rollup(self, type_: str, day_from: date, day_to: date,
+                           title: Optional[str] = None, limit: int = 100) -> list:
+        """Счётчики событий по названию и дню; без title — топ limit названий за каждый день."""
+        params = [type_, day_from.isoformat(), day_to.isoformat()]
+        where = "type = ? AND day BETWEEN ? AND ?"
+        if title is not None:
+            where += " AND title = ?"
+            params.append(title)
+        params.append(limit)
+        sql = f"""
+            SELECT day, title, n FROM (
+                SELECT day, title, n, row_number() OVER (PARTITION BY day ORDER BY n DESC, title) AS r
+                FROM event_title_daily WHERE {where}
+            ) WHERE r <= ? ORDER BY day, n DESC, title"""
+        async with self._db.read() as conn:
+            rows = await conn.execute_fetchall(sql, params)
+        return [{"day": d, "title": t, "count": n} for d, t, n in rows]
+
+    async def active_users(self, day_from: date, day_to: date) -> dict:
+        """Активные пользователи по дням и уникальные за весь период."""
+        params = (day_from.isoformat(), day_to.isoformat())
+        async with self._db.read() as conn:
+            days = await conn.execute_fetchall(
+                "SELECT day, count(*) FROM event_user_daily WHERE day BETWEEN ? AND ? GROUP BY day ORDER BY day",
+                params)
+            total = await conn.execute_fetchall(
+                "SELECT count(DISTINCT user_id) FROM event_user_daily WHERE day BETWEEN ? AND ?", params)
+        return {"days": [{"day": d, "users": n} for d, n in days], "unique": total[0][0]}
+
+    async def iter_raw(self, day: date, after: int = 0, limit: int = 1000):
+        """Сырые события за сутки пачками по rowid; соединение берётся на пачку, а не на весь поток."""
+        table = partition_of(day.isoformat())
+        if table not in self._partitions and table not in await self._find_partitions():
+            return
+        while True:
+            async with self._db.read() as conn:
+                rows = await conn.execute_fetchall(
+                    f"SELECT rowid, ts, user_id, type, title, props FROM {table} WHERE rowid > ? "
+                    "ORDER BY rowid LIMIT ?", (after, limit))
+            if not rows:
+                return
+            yield [{"id": r[0], "ts": r[1], "user_id": r[2], "type": r[3], "title": r[4],
+                    "props": json.loads(r[5]) if r[5] else None} for r in rows]
+            after = rows[-1][0]
+            if len(rows) < limit:
+                return
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._buf),
+            "capacity": self._buf.maxlen,
+            "accepted": self.accepted,
+            "dropped": self.dropped,
+            "written": self.written,
+            "flushes": self.flushes,
+            "failed": self.failed,
+            "partitions": len(self._partitions),
+        }
+
+
+event_log = EventLog()
@@ -0,0 +1,199 @@
+"""
+Очередь задач на рекомендации в хранилище (таблица rec_jobs): POST сразу возвращает id задачи,
+пул асинхронных воркеров забирает задачи по одной атомарным UPDATE ... RETURNING (безопасно и для
+нескольких процессов uvicorn и узлов с общей базой), клиент опрашивает результат или ждёт его long-poll'ом.
+Неудачная попытка возвращается в очередь с паузой (available_at), до JOBS_MAX_ATTEMPTS попыток.
+Задачу, прерванную штатной остановкой, воркер сам возвращает в очередь; оборванные падением процесса
+или узла (status='running' дольше JOBS_RUNNING_TIMEOUT) возвращаются при старте и затем раз в минуту
+любым живым процессом.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from app.db import get_repository
+
+log = logging.getLogger(__name__)
+
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "4"))                  # 0 — только приём, без обработки
+JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", "1"))     # задачи, поставленные другими процессами
+JOBS_MAX_WAIT = float(os.getenv("JOBS_MAX_WAIT", "30"))              # предел long-poll
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+# пауза перед повтором: JOBS_RETRY_DELAY × 2^(попытка-1), не больше JOBS_RETRY_DELAY_MAX — при сбое LLM
+# или отказах планировщика (503) задачи не долбят апстрим повторами подряд
+JOBS_RETRY_DELAY = float(os.getenv("JOBS_RETRY_DELAY", "5"))
+JOBS_RETRY_DELAY_MAX = float(os.getenv("JOBS_RETRY_DELAY_MAX", "60"))
+JOBS_TTL = int(os.getenv("JOBS_TTL", str(24 * 3600)))                # сколько хранить завершённые задачи
+# running-задача, не завершившаяся за столько секунд, считается оборванной и возвращается в очередь.
+# Должно быть заметно больше худшего времени задачи: ожидание в планировщике LLM (LLM_QUEUE_TIMEOUT) +
+# (1 + LLM_RETRIES) × (LLM_TIMEOUT + пауза между попытками) ≈ 300 сек по умолчанию — иначе при общей базе
+# старт одного узла перезапустит задачи, которые ещё выполняют другие (повторные вызовы LLM и attempts).
+# 0 — при старте вернуть все running-задачи (только для единственного процесса на базу).
+JOBS_RUNNING_TIMEOUT = float(os.getenv("JOBS_RUNNING_TIMEOUT", "600"))
+
+FINISHED = ("done", "failed")
+
+
+def _job_dict(row) -> dict:
+    job_id, user_id, status, result, error, created_at, updated_at = row
+    out = {"job_id": job_id, "user_id": user_id, "status": status,
+           "created_at": created_at, "updated_at": updated_at}
+    if result is not None:
+        out["result"] = json.loads(result)
+    if error is not None:
+        out["error"] = error
+    return out
+
+
+def retry_delay(attempts: int) -> float:
+    return min(JOBS_RETRY_DELAY_MAX, JOBS_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+class JobQueue:
+    def __init__(self, workers: int = JOBS_WORKERS):
+        self.workers = workers
+        self._run: Optional[Callable[[int, dict], Awaitable[dict]]] = None
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+        self._last_cleanup = 0.0
+        self.done = 0
+        self.failed = 0
+
+    async def start(self, run: Callable[[int, dict], Awaitable[dict]]):
+        """run(user_id, request) -> результат задачи (dict). Вызывать после init_db()."""
+        if self._tasks:
+            return
+        self._run = run
+        self._wakeup = asyncio.Event()
+        await get_repository().requeue_running(time.time() - JOBS_RUNNING_TIMEOUT)
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def enqueue(self, user_id: int, request: dict) -> dict:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        await get_repository().enqueue_job(job_id, user_id, json.dumps(request, ensure_ascii=False), now)
+        self._wakeup.set()
+        return {"job_id": job_id, "user_id": user_id, "status": "queued", "created_at": now, "updated_at": now}
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        row = await get_repository().get_job(job_id)
+        return _job_dict(row) if row else None
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[dict]:
+        """Long-poll: ждёт завершения задачи не дольше timeout, возвращает её текущее состояние."""
+        deadline = time.monotonic() + min(timeout, JOBS_MAX_WAIT)
+        while True:
+            job = await self.get(job_id)
+            left = deadline - time.monotonic()
+            if job is None or job["status"] in FINISHED or left <= 0:
+                return job
+            fut = asyncio.get_event_loop().create_future()
+            self._waiters.setdefault(job_id, []).append(fut)
+            try:
+                # задачу может завершить другой процесс — поэтому ещё и перечитываем по таймеру
+                await asyncio.wait_for(fut, min(left, JOBS_POLL_INTERVAL))
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                waiters = self._waiters.get(job_id)
+                if waiters and fut in waiters:
+                    waiters.remove(fut)
+                    if not waiters:
+                        del self._waiters[job_id]
+
+    def _notify(self, job_id: str):
+        for fut in self._waiters.pop(job_id, []):
+            if not fut.done():
+                fut.set_result(None)
+
+    async def _finish(self, job_id: str, status: str, result=None, error: Optional[str] = None):
+        await get_repository().finish_job(
+            job_id, status, None if result is None else json.dumps(result, ensure_ascii=False), error, time.time())
+        self._notify(job_id)
+
+    async def _claim(self):
+        return await get_repository().claim_job(time.time())
+
+    async def _cleanup(self):
+        now = time.time()
+        if now - self._last_cleanup < 60:
+            return
+        self._last_cleanup = now
+        await get_repository().cleanup_jobs(now - JOBS_TTL)
+        if JOBS_RUNNING_TIMEOUT > 0:
+            # задачи упавших процессов/узлов, а также те, чей итог не удалось записать
+            await get_repository().requeue_running(now - JOBS_RUNNING_TIMEOUT)
+
+    async def _worker(self):
+        while True:
+            try:
+                row = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("job claim failed")
+                row = None
+            if row is None:
+                try:
+                    await self._cleanup()
+                    await asyncio.wait_for(self._wakeup.wait(), JOBS_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    log.exception("job cleanup failed")
+                self._wakeup.clear()
+                continue
+            job_id, user_id, request, attempts = row
+            error = None
+            try:
+                result = await self._run(user_id, json.loads(request))
+            except asyncio.CancelledError:
+                # процесс останавливается — возвращаем задачу в очередь сразу: иначе следующий запуск
+                # подхватит её только через JOBS_RUNNING_TIMEOUT; этот возврат нужен лишь упавшим узлам
+                try:
+                    await asyncio.shield(get_repository().requeue_job(job_id, time.time()))
+                except Exception:
+                    log.exception("job %s: requeue on shutdown failed", job_id)
+                raise
+            except Exception as e:
+                log.warning("job %s failed (attempt %d): %s", job_id, attempts, e)
+                error = e
+            # ошибка хранилища при записи итога не должна ронять воркер: задача останется running
+            # и вернётся в очередь через requeue_running
+            try:
+                if error is None:
+                    await self._finish(job_id, "done", result=result)
+                    self.done += 1
+                elif attempts < JOBS_MAX_ATTEMPTS:
+                    await get_repository().requeue_job(job_id, time.time() + retry_delay(attempts))
+                else:
+                    await self._finish(job_id, "failed", error=str(getattr(error, "detail", error)))
+                    self.failed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("job %s: saving status failed", job_id)
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "waiters": sum(len(w) for w in self._waiters.values()),
+            "done": self.done,
+            "failed": self.failed,
+        }
+
+
+job_queue = JobQueue()
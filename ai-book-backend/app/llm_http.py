@@ -0,0 +1,74 @@
+import os
+import time
+from types import SimpleNamespace
+from typing import Optional
+
+import aiohttp
+
+# Общая HTTP-сессия к LLM на всё время жизни приложения:
+# keep-alive соединения, пул с лимитами и кэш DNS вместо нового TCP+TLS на каждый запрос.
+LLM_API_URL = os.getenv("LLM_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+LLM_POOL_LIMIT = int(os.getenv("LLM_POOL_LIMIT", "100"))
+LLM_POOL_LIMIT_PER_HOST = int(os.getenv("LLM_POOL_LIMIT_PER_HOST", "32"))
+LLM_KEEPALIVE = float(os.getenv("LLM_KEEPALIVE", "60"))
+LLM_DNS_TTL = int(os.getenv("LLM_DNS_TTL", "300"))
+
+_session: Optional[aiohttp.ClientSession] = None
+_api_url: str = LLM_API_URL
+
+
+async def _on_request_start(session, ctx: SimpleNamespace, params):
+    # trace_request_ctx — dict, переданный в session.post(...): сюда пишем отметки фаз запроса
+    if isinstance(ctx.trace_request_ctx, dict):
+        ctx.trace_request_ctx["start"] = time.perf_counter()
+
+
+async def _on_request_headers_sent(session, ctx: SimpleNamespace, params):
+    if isinstance(ctx.trace_request_ctx, dict):
+        ctx.trace_request_ctx["sent"] = time.perf_counter()
+
+
+def _trace_config() -> aiohttp.TraceConfig:
+    """Отметки времени для метрик: start — запрос начат, sent — соединение есть и заголовки ушли."""
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(_on_request_start)
+    trace.on_request_headers_sent.append(_on_request_headers_sent)
+    return trace
+
+
+def _new_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=LLM_POOL_LIMIT,
+        limit_per_host=LLM_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=LLM_KEEPALIVE,
+        ttl_dns_cache=LLM_DNS_TTL,
+        use_dns_cache=True,
+    )
+    return aiohttp.ClientSession(connector=connector, trace_configs=[_trace_config()])
+
+
+async def start_llm_session(api_url: Optional[str] = None):
+    """Вызывается на startup. api_url позволяет тестам подменить апстрим на локальную заглушку."""
+    global _session, _api_url
+    if api_url:
+        _api_url = api_url
+    if _session is None or _session.closed:
+        _session = _new_session()
+
+
+async def close_llm_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def get_llm_session() -> aiohttp.ClientSession:
+    # если приложение запущено без startup-хука (скрипты, тесты) — создаём сессию по требованию
+    if _session is None or _session.closed:
+        await start_llm_session()
+    return _session
+
+
+def llm_api_url() -> str:
+    return _api_url
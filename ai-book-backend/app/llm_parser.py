@@ -0,0 +1,176 @@
+import json
+import re
+from typing import Any, List, Optional, Tuple
+
+# один проход по тексту: регулярками только прыгаем к следующему значимому символу, без возвратов
+_TOP = re.compile(r'[\[{"\]]')          # между элементами массива: начало элемента или конец массива
+_INNER = re.compile(r'[",{}\[\]]')      # внутри элемента вне строки
+_STR = re.compile(r'["\\]')             # внутри строки
+
+_CLOSE = {"{": "}", "[": "]"}
+
+
+class JsonArrayStream:
+    """
+    Инкрементальный разбор JSON-массива из ответа LLM за линейное время.
+    feed(chunk) возвращает элементы массива, которые завершились в этом куске;
+    текст до первой '[' (```json, пояснения) пропускается, как и пустые/нестроковые "[...]"
+    в пояснениях до настоящего массива. finish() в конце ответа достраивает оборванный
+    последний объект, если от него осталось хотя бы одно целое поле.
+    """
+
+    def __init__(self):
+        self.done = False
+        self.count = 0           # сколько элементов отдано
+        self._in_array = False
+        self._stack: List[str] = []      # открытые скобки текущего элемента
+        self._in_str = False
+        self._esc = False
+        self._buf: List[str] = []
+        self._len = 0
+        self._safe: Optional[Tuple[int, str]] = None   # (длина буфера, закрывающие скобки) до последней запятой
+
+    def _push(self, s: str):
+        if s:
+            self._buf.append(s)
+            self._len += len(s)
+
+    def _start(self, ch: str):
+        self._buf, self._len, self._safe = [], 0, None
+        self._push(ch)
+        if ch == '"':
+            self._in_str = True      # элемент-строка: ["Дюна", "Солярис"]
+        else:
+            self._stack.append(ch)
+
+    def _closers(self) -> str:
+        return "".join(_CLOSE[b] for b in reversed(self._stack))
+
+    def _emit(self, out: List[Any]):
+        raw = "".join(self._buf)
+        self._buf, self._len, self._safe = [], 0, None
+        self._stack.clear()
+        try:
+            out.append(json.loads(raw))
+            self.count += 1
+        except (ValueError, RecursionError):
+            pass
+
+    def feed(self, chunk: str) -> List[Any]:
+        out: List[Any] = []
+        i, n = 0, len(chunk)
+        while i < n and not self.done:
+            if self._esc:
+                # экранированный символ пришёл в следующем куске
+                self._push(chunk[i])
+                self._esc = False
+                i += 1
+                continue
+            if not self._in_array:
+                j = chunk.find("[", i)
+                if j < 0:
+                    break
+                self._in_array = True
+                i = j + 1
+                continue
+            if self._in_str:
+                m = _STR.search(chunk, i)
+                if m is None:
+                    self._push(chunk[i:])
+                    break
+                k = m.start()
+                if chunk[k] == "\\":
+                    if k + 1 < n:
+                        self._push(chunk[i:k + 2])
+                        i = k + 2
+                    else:
+                        self._push(chunk[i:])
+                        self._esc = True
+                        i = n
+                    continue
+                self._push(chunk[i:k + 1])
+                i = k + 1
+                self._in_str = False
+                if not self._stack:
+                    self._emit(out)
+                continue
+            if not self._stack:
+                m = _TOP.search(chunk, i)
+                if m is None:
+                    break
+                i = m.end()
+                if m.group() == "]":
+                    if self.count:
+                        self.done = True
+                    else:
+                        self._in_array = False     # "[о жанрах]" в пояснении — ищем следующий массив
+                    continue
+                self._start(m.group())
+                continue
+            m = _INNER.search(chunk, i)
+            if m is None:
+                self._push(chunk[i:])
+                break
+            k = m.start()
+            ch = chunk[k]
+            if ch == ",":
+                self._safe = (self._len + k - i, self._closers())
+            self._push(chunk[i:k + 1])
+            i = k + 1
+            if ch == '"':
+                self._in_str = True
+            elif ch in "{[":
+                self._stack.append(ch)
+            elif ch != ",":
+                self._stack.pop()
+                if not self._stack:
+                    self._emit(out)
+        return out
+
+    def finish(self) -> List[Any]:
+        """Конец ответа: пробует починить оборванный последний элемент. Возвращает 0 или 1 элемент."""
+        if self.done or not self._stack:
+            return []
+        raw = "".join(self._buf)
+        candidates = []
+        if not self._in_str and not self._esc:
+            candidates.append(raw.rstrip().rstrip(",:") + self._closers())   # оборвалось сразу после значения
+        if self._safe is not None:
+            cut, closers = self._safe
+            candidates.append(raw[:cut] + closers)                          # до последнего целого поля
+        self._buf, self._len, self._safe = [], 0, None
+        self._stack.clear()
+        self._in_str = False
+        for c in candidates:
+            try:
+                item = json.loads(c)
+            except (ValueError, RecursionError):
+                continue
+            self.count += 1
+            return [item]
+        return []
+
+
+def parse_array(text: str) -> Optional[list]:
+    """
+    Массив из ответа модели: чистый JSON, {"books": [...]} (structured output), массив внутри
+    ```json-блока или пояснений, оборванный на середине. None — массива в тексте нет.
+    """
+    s = text.strip()
+    if s[:1] in ("[", "{"):
+        # быстрый путь: ответ целиком валидный JSON
+        try:
+            value = json.loads(s)
+        except (ValueError, RecursionError):
+            pass
+        else:
+            if isinstance(value, list):
+                return value
+            if isinstance(value, dict):
+                for v in value.values():
+                    if isinstance(v, list):
+                        return v
+    p = JsonArrayStream()
+    items = p.feed(text)
+    items += p.finish()
+    return items if items else None
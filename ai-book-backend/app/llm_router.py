@@ -0,0 +1,210 @@
+"""
+Маршрутизация запросов к LLM по пулу моделей. Для каждой модели — EWMA задержки успешных ответов и
+доли ошибок; запрос уходит самой быстрой здоровой модели (ещё не опробованные — первыми, изредка
+случайной, чтобы оценки остальных не устаревали). После LLM_BREAKER_FAILURES ошибок подряд или доли
+ошибок выше LLM_BREAKER_ERROR_RATE модель выключается (circuit breaker) на LLM_BREAKER_COOLDOWN сек,
+затем пропускается один пробный запрос: успех — модель снова в пуле, ошибка — пауза вдвое длиннее.
+
+    LLM_MODELS="deepseek/deepseek-chat-v3.1:free,meta-llama/llama-3.3-70b-instruct:free"
+    LLM_MODELS="fast=http://127.0.0.1:8790/v1/chat/completions,slow=http://127.0.0.1:8791/v1/chat/completions"
+
+Без LLM_MODELS пул — один OPENROUTER_MODEL. URL у модели необязателен: по умолчанию общий LLM_API_URL.
+"""
+import asyncio
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from app.llm_scheduler import LLMUpstreamError
+
+OPENROUTER_MODEL = os.getenv("OPENROUTER_MODEL", "deepseek/deepseek-chat-v3.1:free")
+LLM_MODELS = os.getenv("LLM_MODELS", OPENROUTER_MODEL)
+LLM_ROUTER_ALPHA = float(os.getenv("LLM_ROUTER_ALPHA", "0.2"))         # вес нового замера в EWMA
+LLM_ROUTER_EXPLORE = float(os.getenv("LLM_ROUTER_EXPLORE", "0.05"))     # доля запросов случайной здоровой модели
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+LLM_BREAKER_MIN_REQUESTS = int(os.getenv("LLM_BREAKER_MIN_REQUESTS", "10"))   # до этого — только «подряд»
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+LLM_BREAKER_COOLDOWN_MAX = float(os.getenv("LLM_BREAKER_COOLDOWN_MAX", "300"))
+# таймаут запроса: LLM_TIMEOUT, а при нескольких моделях — LLM_TIMEOUT_FACTOR × EWMA модели (не меньше
+# LLM_TIMEOUT_MIN): деградировавшая модель обрывается раньше и уступает место остальным
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_TIMEOUT_MIN = float(os.getenv("LLM_TIMEOUT_MIN", "10"))
+LLM_TIMEOUT_FACTOR = float(os.getenv("LLM_TIMEOUT_FACTOR", "4"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class ModelState:
+    def __init__(self, name: str, url: Optional[str] = None):
+        self.name = name
+        self.url = url
+        self.latency: Optional[float] = None     # EWMA успешных ответов, сек; None — ещё не пробовали
+        self.error_rate = 0.0
+        self.inflight = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive = 0
+        self.trips = 0
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.cooldown = LLM_BREAKER_COOLDOWN
+        self.probe: Optional[object] = None     # токен пробного запроса в HALF_OPEN; None — пробы нет
+
+    def available(self, now: float) -> bool:
+        if self.state == OPEN and now >= self.open_until:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            return self.probe is None
+        return self.state == CLOSED
+
+    def score(self) -> float:
+        # ожидаемое время до успешного ответа: задержка с поправкой на долю ошибок
+        return (self.latency or 0.0) / max(0.05, 1.0 - self.error_rate)
+
+
+def parse_models(spec: str) -> List[ModelState]:
+    models = []
+    for part in spec.split(","):
+        name, _, url = part.strip().partition("=")
+        if name:
+            models.append(ModelState(name.strip(), url.strip() or None))
+    if not models:
+        raise ValueError("LLM_MODELS is empty")
+    return models
+
+
+class LLMRouter:
+    def __init__(self, models: List[ModelState], alpha: float = LLM_ROUTER_ALPHA,
+                 explore: float = LLM_ROUTER_EXPLORE, seed: Optional[int] = None):
+        self.models = models
+        self.alpha = alpha
+        self.explore = explore
+        self.rejected = 0
+        self._rnd = random.Random(seed)
+
+    @property
+    def key(self) -> str:
+        """Для ключа кэша рекомендаций: ответы любой модели пула взаимозаменяемы."""
+        return ",".join(m.name for m in self.models)
+
+    def get(self, name: str) -> Optional[ModelState]:
+        return next((m for m in self.models if m.name == name), None)
+
+    def pick(self) -> Tuple[ModelState, Optional[object]]:
+        """(модель, токен пробы): токен не None, только если этот запрос — пробный; его передают в track()."""
+        now = time.monotonic()
+        healthy = [m for m in self.models if m.available(now)]
+        if not healthy:
+            # все выключены — сразу ошибка (вызывающий уйдёт в локальный fallback), а не ожидание таймаута
+            self.rejected += 1
+            wait = min(m.open_until for m in self.models) - now
+            raise LLMUpstreamError(503, "all LLM models are unavailable (circuit open)",
+                                   retry_after=max(0.0, wait), retryable=False)
+        if len(healthy) > 1 and self._rnd.random() < self.explore:
+            model = self._rnd.choice(healthy)
+        else:
+            model = min(healthy, key=ModelState.score)
+        probe = None
+        if model.state == HALF_OPEN:
+            probe = model.probe = object()
+        return model, probe
+
+    def timeout(self, model: ModelState) -> float:
+        if len(self.models) < 2 or model.latency is None:
+            return LLM_TIMEOUT
+        return min(LLM_TIMEOUT, max(LLM_TIMEOUT_MIN, LLM_TIMEOUT_FACTOR * model.latency))
+
+    def _ewma(self, old: Optional[float], value: float) -> float:
+        return value if old is None else old + self.alpha * (value - old)
+
+    def _open(self, m: ModelState):
+        m.state = OPEN
+        m.open_until = time.monotonic() + m.cooldown
+        m.cooldown = min(m.cooldown * 2, LLM_BREAKER_COOLDOWN_MAX)
+        m.trips += 1
+
+    def record(self, m: ModelState, ok: bool, latency: Optional[float] = None):
+        m.error_rate = self._ewma(m.error_rate, 0.0 if ok else 1.0)
+        if latency is not None:
+            m.latency = self._ewma(m.latency, latency)
+        if ok:
+            m.consecutive = 0
+            if m.state != CLOSED:
+                # пробный запрос прошёл: модель снова в пуле, история ошибок до паузы не в счёт
+                m.state = CLOSED
+                m.cooldown = LLM_BREAKER_COOLDOWN
+                m.error_rate = 0.0
+            return
+        m.failures += 1
+        m.consecutive += 1
+        if m.state == HALF_OPEN or m.consecutive >= LLM_BREAKER_FAILURES or (
+                m.requests >= LLM_BREAKER_MIN_REQUESTS and m.error_rate >= LLM_BREAKER_ERROR_RATE):
+            if m.state != OPEN:
+                self._open(m)
+
+    @asynccontextmanager
+    async def track(self, m: ModelState, probe: Optional[object] = None):
+        """Учёт одного запроса к модели: задержка успеха, ошибка или таймаут (с его длительностью)."""
+        m.inflight += 1
+        m.requests += 1
+        started = time.perf_counter()
+        try:
+            yield
+        except asyncio.CancelledError:
+            # проигравший hedge-запрос: ответа не дождались, но модель была не быстрее elapsed
+            elapsed = time.perf_counter() - started
+            if m.latency is not None and elapsed > m.latency:
+                m.latency = self._ewma(m.latency, elapsed)
+            raise
+        except asyncio.TimeoutError:
+            self.record(m, False, time.perf_counter() - started)
+            raise
+        except (LLMUpstreamError, HTTPException) as e:
+            if getattr(e, "fault", True):
+                # таймаут — тоже замер задержки: модель отвечает не быстрее, чем мы ждали
+                self.record(m, False, time.perf_counter() - started if e.status_code == 504 else None)
+            raise
+        except Exception:
+            self.record(m, False)
+            raise
+        else:
+            self.record(m, True, time.perf_counter() - started)
+        finally:
+            m.inflight -= 1
+            # пробу снимает только её владелец: обычный запрос, начатый до паузы, не открывает вторую пробу
+            if probe is not None and m.probe is probe:
+                m.probe = None
+
+    def reset(self, m: ModelState):
+        m.state = CLOSED
+        m.cooldown = LLM_BREAKER_COOLDOWN
+        m.consecutive = 0
+        m.error_rate = 0.0
+        m.probe = None
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "models": [{
+                "name": m.name,
+                "url": m.url,
+                "state": m.state,
+                "latency_ms": None if m.latency is None else round(m.latency * 1000, 1),
+                "error_rate": round(m.error_rate, 4),
+                "timeout_s": round(self.timeout(m), 1),
+                "inflight": m.inflight,
+                "requests": m.requests,
+                "failures": m.failures,
+                "trips": m.trips,
+                "retry_in_s": round(max(0.0, m.open_until - now), 1) if m.state == OPEN else None,
+            } for m in self.models],
+            "rejected": self.rejected,
+        }
+
+
+llm_router = LLMRouter(parse_models(LLM_MODELS))
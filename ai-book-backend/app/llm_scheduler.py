@@ -0,0 +1,246 @@
+import asyncio
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from fastapi import HTTPException
+
+from app.metrics import LLM_PHASE
+
+# Планировщик вызовов LLM: лимит параллелизма, token bucket, ограниченная очередь ожидания,
+# повторы с джиттером (с учётом Retry-After) и опциональные hedged-запросы.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_RATE_PER_SEC = float(os.getenv("LLM_RATE_PER_SEC", "0"))     # 0 — без ограничения
+LLM_RATE_BURST = int(os.getenv("LLM_RATE_BURST", "10"))
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "64"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+LLM_RETRY_AFTER_MAX = float(os.getenv("LLM_RETRY_AFTER_MAX", "20"))
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))       # сек; 0 — без hedging
+
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+T = TypeVar("T")
+
+
+class LLMUpstreamError(Exception):
+    """
+    Ошибка апстрима. status_code/detail уходят клиенту, если повторы не помогли.
+    fault=False — модель исправна (например, повтор без response_format), в её статистику не идёт.
+    """
+
+    def __init__(self, status_code: int, detail: str,
+                 retry_after: Optional[float] = None, retryable: bool = True, fault: bool = True):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+        self.retryable = retryable
+        self.fault = fault
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        if self.rate <= 0:
+            return True
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def reserve(self, max_wait: float) -> Optional[float]:
+        """
+        Бронирует токен и возвращает, сколько секунд ждать его появления (токены могут уйти в минус —
+        очередь броней FIFO). None — ждать пришлось бы дольше max_wait, токен не взят.
+        """
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        wait = max(0.0, (1 - self.tokens) / self.rate)
+        if wait > max_wait:
+            return None
+        self.tokens -= 1
+        return wait
+
+    def refund(self):
+        # бронь не понадобилась (отмена во время ожидания)
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class LLMScheduler:
+    def __init__(self, concurrency: int = LLM_MAX_CONCURRENCY, rate: float = LLM_RATE_PER_SEC,
+                 burst: int = LLM_RATE_BURST, queue_size: int = LLM_QUEUE_SIZE,
+                 queue_timeout: float = LLM_QUEUE_TIMEOUT, retries: int = LLM_RETRIES,
+                 hedge_after: float = LLM_HEDGE_AFTER):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.retries = retries
+        self.hedge_after = hedge_after
+        self.bucket = TokenBucket(rate, burst)
+        self._sem = asyncio.Semaphore(concurrency)
+        self.waiting = 0
+        self.running = 0
+        self.shed = 0
+        self.retried = 0
+        self.hedged = 0
+
+    def _shed(self, detail: str):
+        self.shed += 1
+        raise HTTPException(503, detail, headers={"Retry-After": "5"})
+
+    async def _acquire_slot(self, mode: str = "json"):
+        # слот и токен скорости укладываются в общий бюджет queue_timeout; ожидание токена тоже считается
+        # очередью (waiting, queue_size), иначе при низком LLM_RATE_PER_SEC запросы копились бы в слотах
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.queue_timeout
+        if not self._sem.locked():
+            await self._sem.acquire()   # свободный слот — без ожидания
+        else:
+            if self.waiting >= self.queue_size:
+                self._shed("LLM queue is full, try again later")
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._sem.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._shed("LLM queue wait timeout")
+            finally:
+                self.waiting -= 1
+        wait = self.bucket.reserve(max(0.0, deadline - time.monotonic()))
+        if wait is None:
+            self._sem.release()
+            self._shed("LLM rate limit exceeded, try again later")
+        if wait > 0:
+            if self.waiting >= self.queue_size:
+                self.bucket.refund()
+                self._sem.release()
+                self._shed("LLM queue is full, try again later")
+            self.waiting += 1
+            try:
+                await asyncio.sleep(wait)
+            except BaseException:
+                self.bucket.refund()
+                self._sem.release()
+                raise
+            finally:
+                self.waiting -= 1
+        self.running += 1
+        LLM_PHASE.observe(time.perf_counter() - started, "queue", mode)
+
+    async def _try_acquire_slot(self) -> bool:
+        # для hedge: только если слот и токен есть прямо сейчас, без ожидания
+        if self._sem.locked() or not self.bucket.try_acquire():
+            return False
+        await self._sem.acquire()   # не заблокирован — возвращается сразу
+        self.running += 1
+        return True
+
+    def _release_slot(self):
+        self.running -= 1
+        self._sem.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        # для стриминга: слот держится всё время чтения ответа, без повторов и hedging
+        await self._acquire_slot("stream")
+        try:
+            yield
+        finally:
+            self._release_slot()
+
+    async def _guarded(self, attempt: Callable[[], Awaitable[T]], acquired: bool = False) -> T:
+        if not acquired:
+            await self._acquire_slot()
+        try:
+            return await attempt()
+        finally:
+            self._release_slot()
+
+    async def _hedged(self, attempt: Callable[[], Awaitable[T]]) -> T:
+        if self.hedge_after <= 0:
+            return await self._guarded(attempt)
+
+        tasks = {asyncio.ensure_future(self._guarded(attempt))}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+            if not done and await self._try_acquire_slot():
+                self.hedged += 1
+                tasks.add(asyncio.ensure_future(self._guarded(attempt, acquired=True)))
+
+            # побеждает первый успешный ответ; ошибка — только если упали оба
+            error: Optional[BaseException] = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    if t.exception() is None:
+                        return t.result()
+                    error = t.exception()
+            raise error
+        finally:
+            for t in tasks:
+                if not t.done():
+                    t.cancel()
+
+    def _backoff(self, attempt_no: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            return retry_after + random.uniform(0, LLM_BACKOFF_BASE)
+        # full jitter
+        return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt_no)))
+
+    async def run(self, attempt: Callable[[], Awaitable[T]]) -> T:
+        for n in range(self.retries + 1):
+            try:
+                return await self._hedged(attempt)
+            except LLMUpstreamError as e:
+                last = n >= self.retries
+                too_long = e.retry_after is not None and e.retry_after > LLM_RETRY_AFTER_MAX
+                if last or not e.retryable or too_long:
+                    raise HTTPException(e.status_code, e.detail)
+                self.retried += 1
+                await asyncio.sleep(self._backoff(n, e.retry_after))
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "running": self.running,
+            "waiting": self.waiting,
+            "queue_size": self.queue_size,
+            "shed": self.shed,
+            "retried": self.retried,
+            "hedged": self.hedged,
+        }
+
+
+llm_scheduler = LLMScheduler()
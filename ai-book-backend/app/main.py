@@ -1,10 +1,26 @@
-from fastapi import FastAPI
+import time
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+
+from typing import Optional
 
-from app.db import init_db
-from app.routers import recommendations, profile, quiz
+from app.db import init_db, close_db
+from app.catalog import catalog
+from app.recommender import recommender
+from app.precompute import precomputer
+from app.jobs import job_queue
+from app.llm_http import start_llm_session, close_llm_session
+from app.llm_scheduler import llm_scheduler
+from app.llm_router import llm_router
+from app.rec_cache import rec_cache
+from app.resp_cache import resp_cache
+from app.events import event_log
+from app.metrics import registry, HTTP_LATENCY, loop_lag
+from app.routers import recommendations, profile, quiz, bulk, segments, logs, users
 
-def create_app() -> FastAPI:
+def create_app(llm_api_url: Optional[str] = None) -> FastAPI:
     app = FastAPI(title="AI Book Backend", version="1.0.0")
 
     app.add_middleware(
@@ -15,17 +31,71 @@ def create_app() -> FastAPI:
         allow_headers=["*"],
     )
 
+    @app.middleware("http")
+    async def timing(request: Request, call_next):
+        # метка — шаблон пути (/v1/users/{user_id}/...), а не сам путь: иначе по ряду на пользователя
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            HTTP_LATENCY.observe(time.perf_counter() - started, request.method,
+                                 getattr(route, "path", "unmatched"), str(status))
+
+    registry.stats_gauges("llm_scheduler", "LLM scheduler state", llm_scheduler.stats)
+    registry.stats_gauges("rec_cache", "Recommendation cache state", rec_cache.stats)
+    registry.stats_gauges("resp_cache", "Profile/quiz GET response cache state", resp_cache.stats)
+    registry.stats_gauges("precompute", "Background precompute state", precomputer.stats)
+    registry.stats_gauges("rec_jobs", "Recommendation job queue state", job_queue.stats)
+    registry.stats_gauges("events", "Interaction event buffer state", event_log.stats)
+    registry.gauge("event_loop_lag_last_seconds", "Last sampled event loop lag", lambda: loop_lag.last)
+    registry.gauge("llm_model_latency_ewma_seconds", "LLM router: EWMA latency of successful calls",
+                   lambda: {m.name: m.latency for m in llm_router.models if m.latency is not None}, label="model")
+    registry.gauge("llm_model_error_rate", "LLM router: EWMA error rate",
+                   lambda: {m.name: m.error_rate for m in llm_router.models}, label="model")
+    registry.gauge("llm_model_circuit_open", "LLM router: 1 if the model's circuit breaker is open or half-open",
+                   lambda: {m.name: int(m.state != "closed") for m in llm_router.models}, label="model")
+
     app.include_router(recommendations.router)
     app.include_router(profile.router)
     app.include_router(quiz.router)
+    app.include_router(bulk.router)
+    app.include_router(segments.router)
+    app.include_router(logs.router)
+    app.include_router(users.router)
 
     @app.get("/")
     async def root():
         return {"ok": True, "service": "ai-book-backend"}
 
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
     @app.on_event("startup")
     async def on_startup():
+        loop_lag.start()
         await init_db()
+        await event_log.start()
+        await catalog.open()
+        recommender.load()
+        await start_llm_session(llm_api_url)
+        if recommendations.OPENROUTER_API_KEY:
+            precomputer.start(recommendations.precompute_books, llm_router.key)
+        await job_queue.start(recommendations.run_job)
+
+    @app.on_event("shutdown")
+    async def on_shutdown():
+        await job_queue.close()
+        await precomputer.close()
+        await close_llm_session()
+        await catalog.close()
+        await event_log.close()
+        await close_db()
+        await loop_lag.close()
 
     return app
 
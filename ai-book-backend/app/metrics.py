@@ -0,0 +1,202 @@
+"""
+Метрики в текстовом формате Prometheus без внешних зависимостей: счётчики, гистограммы и
+gauge-функции, которые вычисляются в момент запроса /metrics. Плюс замер лага event loop.
+"""
+import asyncio
+import bisect
+import functools
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LOOP_LAG_INTERVAL = 0.5
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(v: float) -> str:
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, n: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + n
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_labels(self.label_names, k)} {_num(v)}" for k, v in self._values.items()
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self._values: Dict[Tuple, list] = {}     # labels -> [счётчики по корзинам..., +Inf, sum]
+
+    def observe(self, value: float, *labels):
+        row = self._values.get(labels)
+        if row is None:
+            row = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        row[bisect.bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t, *labels)
+
+    def render(self) -> List[str]:
+        out = self.header()
+        for k, row in self._values.items():
+            acc = 0
+            for le, n in zip(self.buckets, row):
+                acc += n
+                bucket = 'le="%s"' % le
+                out.append(f"{self.name}_bucket{_labels(self.label_names, k, bucket)} {acc}")
+            acc += row[len(self.buckets)]
+            bucket = 'le="+Inf"'
+            out.append(f"{self.name}_bucket{_labels(self.label_names, k, bucket)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.label_names, k)} {_num(row[-1])}")
+            out.append(f"{self.name}_count{_labels(self.label_names, k)} {acc}")
+        return out
+
+
+class GaugeFunc(_Metric):
+    """Значения считаются при выдаче /metrics: fn() -> число или {значение метки: число}."""
+    kind = "gauge"
+
+    def __init__(self, name, help, fn: Callable, label: Optional[str] = None):
+        super().__init__(name, help, (label,) if label else ())
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        value = self.fn()
+        out = self.header()
+        if isinstance(value, dict):
+            out += [f"{self.name}{_labels(self.label_names, (k,))} {_num(v)}"
+                    for k, v in value.items() if isinstance(v, (int, float))]
+        elif value is not None:
+            out.append(f"{self.name} {_num(value)}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()) -> Counter:
+        return self._metrics.get(name) or self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._metrics.get(name) or self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, fn: Callable, label: Optional[str] = None) -> GaugeFunc:
+        return self.register(GaugeFunc(name, help, fn, label))
+
+    def stats_gauges(self, prefix: str, help: str, stats: Callable[[], dict]):
+        """Все числовые поля stats() одного компонента — одной gauge с меткой field."""
+        self.gauge(prefix, help, stats, label="field")
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics.values():
+            lines += m.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# --- общие метрики бэкенда ---
+HTTP_LATENCY = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+LLM_PHASE = registry.histogram(
+    "llm_phase_seconds", "LLM call time by phase: queue (scheduler wait), connect (until request sent), "
+    "generate (until response read)", ("phase", "mode"))
+LLM_RESPONSES = registry.counter("llm_responses_total", "LLM upstream responses by status", ("status",))
+LLM_FALLBACKS = registry.counter("llm_fallback_total", "Answers served by the fallback instead of LLM", ("reason",))
+LLM_PARSE_FAILURES = registry.counter("llm_parse_failures_total", "LLM answers that were not a JSON array")
+DB_QUERY = registry.histogram("db_query_seconds", "Database call latency by function", ("op",))
+LOOP_LAG = registry.histogram(
+    "event_loop_lag_seconds", "Event loop scheduling delay",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+
+
+def db_timed(fn):
+    """Декоратор для функций app/db.py: время вызова в db_query_seconds{op=имя функции}."""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        t = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            DB_QUERY.observe(time.perf_counter() - t, fn.__name__)
+    return wrapper
+
+
+class LoopLagMonitor:
+    """Раз в interval засыпает и меряет, насколько позже запланированного проснулся."""
+
+    def __init__(self, hist: Histogram = LOOP_LAG, interval: float = LOOP_LAG_INTERVAL):
+        self.hist = hist
+        self.interval = interval
+        self.last = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            t = loop.time()
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, loop.time() - t - self.interval)
+            self.hist.observe(self.last)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+loop_lag = LoopLagMonitor()
@@ -0,0 +1,132 @@
+"""
+Фоновый предрасчёт рекомендаций: после изменения профиля или квиза пользователь ставится в очередь,
+пул воркеров пересчитывает рекомендации и сохраняет их в rec_precomputed вместе с отпечатком входа
+(pref_key от любимой книги из квиза, жанров и авторов профиля). Эндпоинт рекомендаций отдаёт
+сохранённый результат сразу, если отпечаток запроса совпадает.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, List, Optional, Set
+
+from app.db import get_precomputed, get_user_context, save_precomputed
+from app.rec_cache import pref_key
+
+log = logging.getLogger(__name__)
+
+PRECOMPUTE_WORKERS = int(os.getenv("PRECOMPUTE_WORKERS", "2"))      # 0 — выключить
+PRECOMPUTE_QUEUE = int(os.getenv("PRECOMPUTE_QUEUE", "10000"))
+# профиль и квиз обычно сохраняются друг за другом — ждём немного, чтобы считать один раз
+PRECOMPUTE_DELAY = float(os.getenv("PRECOMPUTE_DELAY", "2"))
+
+
+def user_inputs(profile: Optional[dict], quiz: Optional[dict]):
+    """(favorites, genres, authors) пользователя — так же, как их собирает бот в rec_auto."""
+    fav = (quiz or {}).get("q1_favorite_book")
+    return (
+        [fav] if fav else [],
+        (profile or {}).get("preferred_genres") or [],
+        (profile or {}).get("preferred_authors") or [],
+    )
+
+
+class Precomputer:
+    def __init__(self, workers: int = PRECOMPUTE_WORKERS, queue_size: int = PRECOMPUTE_QUEUE,
+                 delay: float = PRECOMPUTE_DELAY):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.delay = delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued: Set[int] = set()
+        self._tasks: List[asyncio.Task] = []
+        self._compute: Optional[Callable[[List[str], List[str], List[str]], Awaitable[list]]] = None
+        self.model = ""
+        self.done = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self, compute: Callable[[List[str], List[str], List[str]], Awaitable[list]], model: str):
+        """compute(favorites, genres, authors) -> список книг (dict), model входит в отпечаток."""
+        if self.running or self.workers <= 0:
+            return
+        self._compute = compute
+        self.model = model
+        self._queue = asyncio.Queue(self.queue_size)
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    def fingerprint(self, favorites, genres, authors) -> str:
+        return pref_key(favorites, genres, authors, self.model)
+
+    def notify(self, user_id: int):
+        """Входные данные пользователя изменились. Не блокирует: при переполнении очереди задача теряется."""
+        if not self.running or user_id in self._queued:
+            return
+        try:
+            self._queue.put_nowait((time.monotonic() + self.delay, user_id))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return
+        self._queued.add(user_id)
+
+    async def lookup(self, user_id: int, fingerprint: str) -> Optional[list]:
+        row = await get_precomputed(user_id)
+        if row and row["fingerprint"] == fingerprint:
+            return row["books"]
+        return None
+
+    async def _process(self, user_id: int):
+        profile, quiz = await get_user_context(user_id)
+        favorites, genres, authors = user_inputs(profile, quiz)
+        fp = self.fingerprint(favorites, genres, authors)
+        row = await get_precomputed(user_id)
+        if row and row["fingerprint"] == fp:
+            self.skipped += 1
+            return
+        books = await self._compute(favorites, genres, authors)
+        if books:
+            await save_precomputed(user_id, fp, books)
+            self.done += 1
+
+    async def _worker(self):
+        while True:
+            due, user_id = await self._queue.get()
+            try:
+                wait = due - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                # изменения после этого момента снова поставят пользователя в очередь
+                self._queued.discard(user_id)
+                await self._process(user_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed += 1
+                log.exception("precompute failed for user %s", user_id)
+            finally:
+                self._queue.task_done()
+
+    async def close(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queued.clear()
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "queued": self._queue.qsize() if self._queue else 0,
+            "done": self.done,
+            "skipped": self.skipped,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+precomputer = Precomputer()
@@ -0,0 +1,99 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List
+
+# Кэш готовых рекомендаций: TTL + LRU по размеру + склейка одинаковых запросов "в полёте".
+REC_CACHE_TTL = float(os.getenv("REC_CACHE_TTL", "600"))      # 0 — кэш выключен
+REC_CACHE_SIZE = int(os.getenv("REC_CACHE_SIZE", "2048"))
+
+
+def _canon(items: Iterable[str]) -> List[str]:
+    # регистр, пробелы, порядок и дубли не влияют на ключ
+    return sorted({" ".join(x.split()).casefold() for x in items if x and x.strip()})
+
+
+def pref_key(favorites, genres, authors, model: str) -> str:
+    raw = json.dumps(
+        [model, _canon(favorites), _canon(genres), _canon(authors)],
+        ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class RecCache:
+    def __init__(self, ttl: float = REC_CACHE_TTL, maxsize: int = REC_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()   # key -> (expires_at, value)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: Any):
+        if self.ttl <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_compute(self, key: str, factory: Callable[[], Awaitable[Any]]):
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            fut = asyncio.ensure_future(factory())
+            self._inflight[key] = fut
+
+            def _done(f: asyncio.Future, key=key):
+                self._inflight.pop(key, None)
+                if not f.cancelled() and f.exception() is None:
+                    self.put(key, f.result())
+
+            fut.add_done_callback(_done)
+        # shield: отключившийся клиент не отменяет общий апстрим-вызов для остальных
+        return await asyncio.shield(fut)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
+
+
+rec_cache = RecCache()
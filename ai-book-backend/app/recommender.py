@@ -0,0 +1,253 @@
+"""
+Локальный рекомендатель поверх каталога: запасной вариант для LLM и режим "instant".
+
+Сборка артефакта:  python -m app.recommender build [--dim 128]
+Артефакт (REC_MODEL_DIR): items.npy — L2-нормированные float32-векторы книг (TF-IDF по жанрам,
+авторам и описанию, свёрнутые hashing trick'ом до dim), ids.npy — id книг в каталоге,
+default.npy — "средний вкус" по профилям, meta.json — idf признаков и их совместная встречаемость
+в жанрах/авторах профилей. Векторы открываются через mmap, загрузка почти мгновенная.
+"""
+import json
+import math
+import os
+import sqlite3
+import sys
+import time
+import zlib
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.catalog import CATALOG_PATH, catalog, normalize
+from app.db_sqlite import DB_DIR, DB_PATH, NAMES_SEP
+
+REC_MODEL_DIR = os.getenv("REC_MODEL_DIR", os.path.join(DB_DIR, "recommender"))
+REC_DIM = int(os.getenv("REC_DIM", "128"))
+
+GENRE_WEIGHT = 2.0
+AUTHOR_WEIGHT = 2.0
+WORD_WEIGHT = 1.0
+MAX_WORDS = 50_000          # словарь слов описания: самые частые, но не встречающиеся почти везде
+COOC_TOP = 10               # соседей по совместной встречаемости на признак
+COOC_WEIGHT = 0.3
+MIN_SCORE = 0.05            # ниже — случайные совпадения хэшей, а не похожесть
+BUILD_BATCH = 10_000
+
+
+def _split(s: Optional[str]) -> List[str]:
+    return [x for x in (normalize(p) for p in (s or "").split(",")) if x]
+
+
+def _features(title, authors, genres, description) -> Counter:
+    f = Counter()
+    for g in _split(genres):
+        f["g:" + g] += 1
+    for a in _split(authors):
+        f["a:" + a] += 1
+    for w in normalize(f"{title} {description or ''}").split():
+        if len(w) > 2:
+            f["w:" + w] += 1
+    return f
+
+
+def _slots(feature: str, dim: int):
+    # два хэша на признак со знаком — меньше коллизий при малом dim
+    h1 = zlib.crc32(feature.encode("utf-8"))
+    h2 = zlib.crc32((feature + "#").encode("utf-8"))
+    return ((h1 % dim, 1.0 if h1 & 0x80000000 else -1.0),
+            (h2 % dim, 1.0 if h2 & 0x80000000 else -1.0))
+
+
+def _kind_weight(feature: str) -> float:
+    return {"g": GENRE_WEIGHT, "a": AUTHOR_WEIGHT}.get(feature[0], WORD_WEIGHT)
+
+
+def _add(vec: np.ndarray, feature: str, weight: float):
+    for i, sign in _slots(feature, vec.shape[0]):
+        vec[i] += sign * weight
+
+
+# ---------- сборка ----------
+
+def _profile_rows(db_path: str):
+    if not os.path.exists(db_path):
+        return []
+    conn = sqlite3.connect(db_path)
+    try:
+        # списки профиля через NAMES_SEP (см. app.db_sqlite.PROFILE_COLUMNS_SQL), по одной строке на пользователя
+        rows = conn.execute(
+            "SELECT (SELECT group_concat(g.name, char(31)) FROM profile_genres pg JOIN genres g ON g.id = pg.genre_id"
+            " WHERE pg.user_id = p.user_id),"
+            " (SELECT group_concat(a.name, char(31)) FROM profile_authors pa JOIN authors a ON a.id = pa.author_id"
+            " WHERE pa.user_id = p.user_id)"
+            " FROM profiles p").fetchall()
+        return [((g or "").split(NAMES_SEP), (a or "").split(NAMES_SEP)) for g, a in rows]
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        conn.close()
+
+
+def build(catalog_path: str = CATALOG_PATH, db_path: str = DB_PATH,
+          out_dir: str = REC_MODEL_DIR, dim: int = REC_DIM) -> dict:
+    """Два прохода по каталогу (частоты, затем векторы пачками прямо в .npy через memmap)."""
+    os.makedirs(out_dir, exist_ok=True)
+    cat = sqlite3.connect(catalog_path)
+    try:
+        n = cat.execute("SELECT count(*) FROM books").fetchone()[0]
+        if not n:
+            raise SystemExit("catalog is empty, run `python -m app.catalog import ...` first")
+        select = "SELECT id, title, authors, genres, description FROM books ORDER BY id"
+
+        df = Counter()
+        for row in cat.execute(select):
+            df.update(_features(*row[1:]).keys())
+        words = [(f, c) for f, c in df.items() if f[0] == "w" and 2 <= c <= n * 0.5]
+        keep = {f for f, c in df.items() if f[0] != "w"}
+        keep.update(f for f, _ in sorted(words, key=lambda x: -x[1])[:MAX_WORDS])
+        idf = {f: round(math.log(n / (1 + df[f])) + 1.0, 4) for f in keep}
+
+        items = np.lib.format.open_memmap(os.path.join(out_dir, "items.npy.tmp"), mode="w+",
+                                          dtype=np.float32, shape=(n, dim))
+        ids = np.empty(n, dtype=np.int64)
+        for i, row in enumerate(cat.execute(select)):
+            ids[i] = row[0]
+            vec = items[i]
+            for f, tf in _features(*row[1:]).items():
+                w = idf.get(f)
+                if w is not None:
+                    _add(vec, f, (1.0 + math.log(tf)) * w * _kind_weight(f))
+            if (i + 1) % BUILD_BATCH == 0:
+                block = items[i + 1 - BUILD_BATCH:i + 1]
+                block /= np.maximum(np.linalg.norm(block, axis=1, keepdims=True), 1e-9)
+        tail = n % BUILD_BATCH
+        if tail:
+            block = items[n - tail:]
+            block /= np.maximum(np.linalg.norm(block, axis=1, keepdims=True), 1e-9)
+        items.flush()
+        del items
+    finally:
+        cat.close()
+
+    # совместная встречаемость жанров/авторов в профилях → расширение запроса
+    pair = defaultdict(Counter)
+    freq = Counter()
+    default = np.zeros(dim, dtype=np.float32)
+    for genres, authors in _profile_rows(db_path):
+        feats = {"g:" + g for g in map(normalize, genres) if g} | {"a:" + a for a in map(normalize, authors) if a}
+        feats &= keep
+        freq.update(feats)
+        for f in feats:
+            _add(default, f, idf[f] * _kind_weight(f))
+            for g in feats:
+                if g != f:
+                    pair[f][g] += 1
+    cooc = {
+        f: [[g, round(c / math.sqrt(freq[f] * freq[g]), 4)] for g, c in nb.most_common(COOC_TOP)]
+        for f, nb in pair.items()
+    }
+
+    np.save(os.path.join(out_dir, "ids.npy"), ids)
+    np.save(os.path.join(out_dir, "default.npy"), default)
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"dim": dim, "size": n, "built_at": int(time.time()), "idf": idf, "cooc": cooc},
+                  f, ensure_ascii=False)
+    os.replace(os.path.join(out_dir, "items.npy.tmp"), os.path.join(out_dir, "items.npy"))
+    return {"size": n, "dim": dim, "features": len(idf), "cooc": len(cooc)}
+
+
+# ---------- рантайм ----------
+
+class LocalRecommender:
+    def __init__(self, model_dir: str = REC_MODEL_DIR, cat=None):
+        self.model_dir = model_dir
+        self.catalog = cat or catalog
+        self.items: Optional[np.ndarray] = None
+        self.ids: Optional[np.ndarray] = None
+        self.default: Optional[np.ndarray] = None
+        self.idf: Dict[str, float] = {}
+        self.cooc: Dict[str, list] = {}
+
+    @property
+    def ready(self) -> bool:
+        return self.items is not None and self.catalog.ready
+
+    def load(self):
+        path = os.path.join(self.model_dir, "items.npy")
+        if not os.path.exists(path):
+            return
+        with open(os.path.join(self.model_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.idf = meta["idf"]
+        self.cooc = meta["cooc"]
+        self.items = np.load(path, mmap_mode="r")
+        self.ids = np.load(os.path.join(self.model_dir, "ids.npy"))
+        self.default = np.load(os.path.join(self.model_dir, "default.npy"))
+
+    def query_vector(self, genres, authors, favorite_rows=()) -> np.ndarray:
+        q = np.zeros(self.items.shape[1], dtype=np.float32)
+        base = [("g:" + normalize(g), GENRE_WEIGHT) for g in genres] + \
+               [("a:" + normalize(a), AUTHOR_WEIGHT) for a in authors]
+        for f, w in base:
+            if f in self.idf:
+                _add(q, f, self.idf[f] * w)
+            for g, c in self.cooc.get(f, ()):
+                _add(q, g, self.idf.get(g, 1.0) * _kind_weight(g) * c * COOC_WEIGHT)
+        for row in favorite_rows:
+            q += self.items[row]
+        if not q.any():
+            q = self.default.copy()
+        norm = np.linalg.norm(q)
+        return q / norm if norm else q
+
+    def top_k(self, q: np.ndarray, k: int = 5, exclude=()) -> List[int]:
+        if not q.any():
+            return []
+        scores = self.items @ q
+        if len(exclude):
+            scores[list(exclude)] = -np.inf
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [int(self.ids[i]) for i in top if scores[i] > MIN_SCORE]
+
+    def rows_for(self, book_ids) -> List[int]:
+        pos = np.searchsorted(self.ids, book_ids)
+        return [int(p) for p, b in zip(pos, book_ids) if p < len(self.ids) and self.ids[p] == b]
+
+    async def recommend(self, favorites, genres, authors, k: int = 5) -> List[dict]:
+        if not self.ready:
+            return []
+        fav_rows = []
+        if favorites:
+            matches = await self.catalog.resolve([{"title": t} for t in favorites])
+            fav_rows = self.rows_for([m["id"] for m in matches if m])
+        q = self.query_vector(genres, authors, fav_rows)
+        ids = self.top_k(q, k, exclude=fav_rows)
+        rows = await self.catalog.get_many(ids)
+        wanted = {normalize(g) for g in genres}
+        out = []
+        for book_id in ids:
+            b = rows.get(book_id)
+            if not b:
+                continue
+            common = [g for g in (b["genres"] or "").split(",") if normalize(g) in wanted]
+            reason = f"Жанр: {', '.join(x.strip() for x in common)}" if common else "Похоже на ваши любимые книги"
+            out.append({
+                "title": b["title"], "author": b["authors"], "reason": reason,
+                "catalog_id": b["id"], "cover_url": b["cover_url"], "description": b["description"],
+            })
+        return out
+
+
+recommender = LocalRecommender()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args or args[0] != "build":
+        print(__doc__)
+        sys.exit(1)
+    dim = int(args[args.index("--dim") + 1]) if "--dim" in args else REC_DIM
+    print(build(dim=dim))
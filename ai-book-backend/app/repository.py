@@ -0,0 +1,131 @@
+"""
+Интерфейс хранилища бэкенда: профили, викторины, сегменты, предрасчитанные рекомендации и очередь
+задач. Реализации: SqliteRepository (app/db_sqlite.py, файл SQLite на узле) и SqlAlchemyRepository
+(app/db_sql.py, SQLAlchemy async — PostgreSQL через asyncpg, общий для нескольких узлов).
+Какая используется — решает DB_BACKEND (см. app/db.py); остальной код ходит через функции app.db.
+"""
+import time
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, List, Optional, Sequence, Tuple
+
+SEGMENT_KINDS = ("genre", "author")
+
+# строка задачи: (id, user_id, status, result, error, created_at, updated_at)
+JobRow = Tuple[str, int, str, Optional[str], Optional[str], float, float]
+# захваченная задача: (id, user_id, request, attempts)
+ClaimedJob = Tuple[str, int, str, int]
+
+
+def new_version() -> int:
+    """
+    Версия строки профиля/викторины — метка времени записи в микросекундах: назначается при upsert,
+    поэтому известна и до сброса write-behind, и без чтения старой версии из базы.
+    Нужна для ETag, а не для упорядочивания: сравнивается только на равенство.
+    """
+    return time.time_ns() // 1000
+
+
+class Repository(ABC):
+    @abstractmethod
+    async def init(self):
+        """Схема и миграции; вызывается на старте каждого процесса."""
+
+    @abstractmethod
+    async def close(self):
+        ...
+
+    # ---------- профиль и викторина ----------
+
+    @abstractmethod
+    async def upsert_profile(self, user_id: int, username, first_name, last_name, lang,
+                             genres: Sequence[str], authors: Sequence[str]):
+        ...
+
+    @abstractmethod
+    async def get_profile(self, user_id: int) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def upsert_quiz(self, user_id: int, q1, q2):
+        ...
+
+    @abstractmethod
+    async def get_quiz(self, user_id: int) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def get_user_context(self, user_id: int) -> Tuple[Optional[dict], Optional[dict]]:
+        """(профиль, квиз) пользователя; отсутствующие — None."""
+
+    @abstractmethod
+    async def get_version(self, table: str, user_id: int) -> Optional[int]:
+        """Поле version строки profiles/quiz без чтения остального; None — строки нет."""
+
+    # ---------- bulk ----------
+
+    @abstractmethod
+    def iter_profiles(self, user_ids) -> AsyncIterator[List[dict]]:
+        """Профили пачками, в порядке user_ids, без дублей и отсутствующих."""
+
+    @abstractmethod
+    def iter_quizzes(self, user_ids) -> AsyncIterator[List[dict]]:
+        ...
+
+    @abstractmethod
+    async def upsert_profiles(self, items) -> int:
+        ...
+
+    @abstractmethod
+    async def upsert_quizzes(self, items) -> int:
+        ...
+
+    # ---------- сегменты ----------
+
+    @abstractmethod
+    async def top_segment(self, kind: str, limit: int = 20) -> list:
+        ...
+
+    @abstractmethod
+    async def segment_users(self, filters: dict, after: int = 0, limit: int = 1000) -> dict:
+        ...
+
+    # ---------- предрасчитанные рекомендации ----------
+
+    @abstractmethod
+    async def get_precomputed(self, user_id: int) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def save_precomputed(self, user_id: int, fingerprint: str, books: list):
+        ...
+
+    # ---------- очередь задач (app/jobs.py) ----------
+
+    @abstractmethod
+    async def enqueue_job(self, job_id: str, user_id: int, request: str, now: float):
+        ...
+
+    @abstractmethod
+    async def get_job(self, job_id: str) -> Optional[JobRow]:
+        ...
+
+    @abstractmethod
+    async def claim_job(self, now: float) -> Optional[ClaimedJob]:
+        """Атомарно забирает самую старую задачу в статусе queued с available_at <= now
+        (безопасно для нескольких процессов/узлов)."""
+
+    @abstractmethod
+    async def finish_job(self, job_id: str, status: str, result: Optional[str], error: Optional[str], now: float):
+        ...
+
+    @abstractmethod
+    async def requeue_job(self, job_id: str, available_at: float):
+        """Вернуть задачу в queued; забрать её можно не раньше available_at (пауза перед повтором)."""
+
+    @abstractmethod
+    async def requeue_running(self, before: float):
+        """Вернуть в очередь задачи status='running', не обновлявшиеся с before (оборваны остановкой)."""
+
+    @abstractmethod
+    async def cleanup_jobs(self, before: float):
+        """Удалить завершённые задачи старше before."""
@@ -0,0 +1,110 @@
+"""
+Готовые ответы GET профиля и викторины: тело, уже сериализованное orjson, и ETag из версии строки
+(app.repository.new_version). Запись через app.db сбрасывает запись кэша этого процесса; другие
+воркеры и узлы узнают об изменении, сверив версию — одно чтение по первичному ключу вместо профиля
+с подзапросами жанров/авторов, dict и JSON-кодирования. RESP_CACHE_REVALIDATE > 0 — доверять записи
+кэша столько секунд без сверки (годится для одного процесса на базу).
+Клиент с актуальным If-None-Match получает 304 без тела.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, Tuple
+
+import orjson
+
+RESP_CACHE_SIZE = int(os.getenv("RESP_CACHE_SIZE", "10000"))     # 0 — кэш выключен, ETag/304 остаются
+RESP_CACHE_REVALIDATE = float(os.getenv("RESP_CACHE_REVALIDATE", "0"))
+
+Key = Tuple[str, int]     # (таблица, user_id)
+
+
+class Entry:
+    __slots__ = ("version", "etag", "body", "checked")
+
+    def __init__(self, version: int, etag: str, body: bytes, checked: float):
+        self.version = version
+        self.etag = etag
+        self.body = body
+        self.checked = checked
+
+
+def etag_for(table: str, user_id: int, version) -> str:
+    return f'"{table[0]}{user_id}.{version}"'
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+    return "*" in tags or etag in tags
+
+
+class ResponseCache:
+    def __init__(self, maxsize: int = RESP_CACHE_SIZE, revalidate: float = RESP_CACHE_REVALIDATE):
+        self.maxsize = maxsize
+        self.revalidate = revalidate
+        self._data: "OrderedDict[Key, Entry]" = OrderedDict()
+        # счётчик сбросов: чтение, во время которого что-то записали, в кэш не кладётся
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.not_modified = 0
+
+    def invalidate(self, table: str, user_ids):
+        self._writes += 1
+        for uid in user_ids:
+            self._data.pop((table, uid), None)
+
+    async def _entry(self, table: str, user_id: int, load: Callable[[int], Awaitable[Optional[dict]]],
+                     get_version: Callable[[str, int], Awaitable[Optional[int]]]) -> Optional[Entry]:
+        key = (table, user_id)
+        entry = self._data.get(key)
+        now = time.monotonic()
+        if entry is not None and now - entry.checked >= self.revalidate:
+            if await get_version(table, user_id) == entry.version:
+                entry.checked = now
+            else:
+                self._data.pop(key, None)
+                self.stale += 1
+                entry = None
+        if entry is not None:
+            self.hits += 1
+            self._data.move_to_end(key)
+            return entry
+        self.misses += 1
+        writes = self._writes
+        data = await load(user_id)
+        if data is None:
+            return None
+        version = data.get("version") or 0
+        entry = Entry(version, etag_for(table, user_id, version), orjson.dumps(data), time.monotonic())
+        if self.maxsize > 0 and writes == self._writes:
+            self._data[key] = entry
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return entry
+
+    async def lookup(self, table: str, user_id: int, if_none_match: Optional[str],
+                     load, get_version) -> Tuple[Optional[Entry], bool]:
+        """(запись, совпал ли If-None-Match); запись None — строки нет."""
+        entry = await self._entry(table, user_id, load, get_version)
+        if entry is None:
+            return None, False
+        if etag_matches(if_none_match, entry.etag):
+            self.not_modified += 1
+            return entry, True
+        return entry, False
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "not_modified": self.not_modified,
+        }
+
+
+resp_cache = ResponseCache()
@@ -0,0 +1,80 @@
+import json
+from typing import List
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+
+from app.db import iter_profiles, iter_quizzes, upsert_profiles, upsert_quizzes
+from app.precompute import precomputer
+from app.routers.profile import ProfileIn
+from app.routers.quiz import QuizIn
+
+# Пакетные операции для ночных задач: одна пачка id — один запрос IN (...),
+# запись — executemany в одной транзакции. Большие выборки можно читать NDJSON-потоком.
+router = APIRouter(prefix="/v1/bulk", tags=["bulk"])
+
+NDJSON = "application/x-ndjson"
+BULK_MAX_IDS = 100_000
+
+class BulkIds(BaseModel):
+    user_ids: List[int] = Field(default_factory=list, max_length=BULK_MAX_IDS)
+
+class ProfileItem(ProfileIn):
+    user_id: int
+
+class QuizItem(QuizIn):
+    user_id: int
+
+def _wants_ndjson(request: Request, fmt: str) -> bool:
+    return fmt == "ndjson" or NDJSON in request.headers.get("accept", "")
+
+async def _read_items(request: Request, model) -> list:
+    # тело: {"items": [...]} или NDJSON — по объекту на строку
+    try:
+        if NDJSON in request.headers.get("content-type", ""):
+            items, tail = [], b""
+            async for chunk in request.stream():
+                lines = (tail + chunk).split(b"\n")
+                tail = lines.pop()
+                items.extend(model.model_validate_json(l) for l in lines if l.strip())
+            if tail.strip():
+                items.append(model.model_validate_json(tail))
+            return items
+        body = await request.json()
+        return [model.model_validate(x) for x in body.get("items", [])]
+    except (ValidationError, ValueError, AttributeError) as e:
+        raise HTTPException(422, f"bad bulk payload: {e}")
+
+async def _bulk_get(chunks, request: Request, fmt: str):
+    if _wants_ndjson(request, fmt):
+        async def lines():
+            async for chunk in chunks:
+                if chunk:
+                    yield "".join(json.dumps(x, ensure_ascii=False) + "\n" for x in chunk).encode("utf-8")
+        return StreamingResponse(lines(), media_type=NDJSON)
+    return {"items": [x async for chunk in chunks for x in chunk]}
+
+@router.post("/profiles/get")
+async def bulk_profiles_get(body: BulkIds, request: Request, format: str = "json"):
+    return await _bulk_get(iter_profiles(body.user_ids), request, format)
+
+@router.put("/profiles")
+async def bulk_profiles_put(request: Request):
+    items = await _read_items(request, ProfileItem)
+    n = await upsert_profiles([x.model_dump() for x in items])
+    for x in items:
+        precomputer.notify(x.user_id)
+    return {"ok": True, "count": n}
+
+@router.post("/quiz/get")
+async def bulk_quiz_get(body: BulkIds, request: Request, format: str = "json"):
+    return await _bulk_get(iter_quizzes(body.user_ids), request, format)
+
+@router.put("/quiz")
+async def bulk_quiz_put(request: Request):
+    items = await _read_items(request, QuizItem)
+    n = await upsert_quizzes([x.model_dump() for x in items])
+    for x in items:
+        precomputer.notify(x.user_id)
+    return {"ok": True, "count": n}
@@ -0,0 +1,56 @@
+import json
+from datetime import date, datetime, timedelta, timezone
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+
+from app.events import event_log
+from app.routers.bulk import NDJSON, _read_items
+
+# Приём событий взаимодействия: одиночные и пачкой (NDJSON или {"items": [...]}).
+# Ответ 202 сразу после попадания в буфер — запись в events.db идёт в фоне (см. app/events.py).
+router = APIRouter(prefix="/v1/events", tags=["events"])
+
+EventType = Literal["impression", "click", "like", "dislike", "read", "dismiss"]
+
+class EventIn(BaseModel):
+    user_id: int
+    type: EventType
+    title: Optional[str] = Field(None, max_length=500)
+    ts: Optional[float] = None          # unix-время на клиенте; по умолчанию — время приёма
+    props: Optional[dict] = None        # источник показа, позиция в списке и т.п.
+
+def _rows(items):
+    return ((e.ts, e.user_id, e.type, e.title.strip() if e.title else None, e.props) for e in items)
+
+@router.post("", status_code=202)
+async def events_post(body: EventIn):
+    return {"ok": True, "accepted": event_log.put(_rows([body]))}
+
+@router.post("/bulk", status_code=202)
+async def events_bulk(request: Request):
+    items = await _read_items(request, EventIn)
+    return {"ok": True, "accepted": event_log.put(_rows(items))}
+
+def _period(day_from: Optional[date], day_to: Optional[date], days: int = 7):
+    # сутки в журнале — UTC
+    day_to = day_to or datetime.now(timezone.utc).date()
+    return day_from or day_to - timedelta(days=days - 1), day_to
+
+@router.get("/rollups/titles")
+async def events_titles(type: EventType = "impression", day_from: Optional[date] = None,
+                        day_to: Optional[date] = None, title: Optional[str] = None,
+                        limit: int = Query(100, ge=1, le=10_000)):
+    """Число событий по названию за каждый день периода (по умолчанию — показы за 7 дней)."""
+    day_from, day_to = _period(day_from, day_to)
+    return {"items": await event_log.title_rollup(type, day_from, day_to, title, limit)}
+
+@router.get("/raw")
+async def events_raw(day: date, after: int = 0):
+    """Сырые события за сутки (UTC) NDJSON-потоком; id — для продолжения с места обрыва (after)."""
+    async def lines():
+        async for chunk in event_log.iter_raw(day, after):
+            yield "".join(json.dumps(x, ensure_ascii=False) + "\n" for x in chunk).encode("utf-8")
+    return StreamingResponse(lines(), media_type=NDJSON)
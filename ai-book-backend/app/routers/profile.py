@@ -1,7 +1,9 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 from pydantic import BaseModel, Field
 from typing import List, Optional
-from app.db import get_profile, upsert_profile
+from app.db import get_profile, get_version, upsert_profile
+from app.resp_cache import resp_cache
+from app.precompute import precomputer
 
 router = APIRouter(prefix="/v1", tags=["profile"])
 
@@ -13,12 +15,23 @@ class ProfileIn(BaseModel):
     preferred_genres: List[str] = Field(default_factory=list)
     preferred_authors: List[str] = Field(default_factory=list)
 
+async def cached_get(request: Request, table: str, user_id: int, load):
+    """GET по готовым байтам из resp_cache: 200 с ETag или 304 по If-None-Match; None — строки нет."""
+    entry, not_modified = await resp_cache.lookup(
+        table, user_id, request.headers.get("if-none-match"), load, get_version)
+    if entry is None:
+        return None
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    return Response(entry.body, media_type="application/json", headers=headers)
+
 @router.get("/users/{user_id}/profile")
-async def profile_get(user_id: int):
-    p = await get_profile(user_id)
-    if not p:
+async def profile_get(user_id: int, request: Request):
+    r = await cached_get(request, "profiles", user_id, get_profile)
+    if r is None:
         raise HTTPException(404, "profile not found")
-    return p
+    return r
 
 @router.put("/users/{user_id}/profile")
 async def profile_put(user_id: int, body: ProfileIn):
@@ -31,4 +44,5 @@ async def profile_put(user_id: int, body: ProfileIn):
         genres=body.preferred_genres,
         authors=body.preferred_authors,
     )
+    precomputer.notify(user_id)
     return {"ok": True}
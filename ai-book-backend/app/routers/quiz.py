@@ -1,7 +1,9 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from pydantic import BaseModel
 from typing import Optional
 from app.db import get_quiz, upsert_quiz
+from app.precompute import precomputer
+from app.routers.profile import cached_get
 
 router = APIRouter(prefix="/v1", tags=["quiz"])
 
@@ -10,11 +12,12 @@ class QuizIn(BaseModel):
     q2_books_per_year: Optional[int] = None
 
 @router.get("/users/{user_id}/quiz")
-async def quiz_get(user_id: int):
-    q = await get_quiz(user_id)
-    return q or {}
+async def quiz_get(user_id: int, request: Request):
+    r = await cached_get(request, "quiz", user_id, get_quiz)
+    return r if r is not None else {}
 
 @router.post("/users/{user_id}/quiz")
 async def quiz_post(user_id: int, body: QuizIn):
     await upsert_quiz(user_id, body.q1_favorite_book or "", body.q2_books_per_year or 0)
+    precomputer.notify(user_id)
     return {"ok": True}
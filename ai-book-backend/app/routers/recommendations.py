@@ -1,12 +1,28 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-import os, aiohttp, asyncio, json, re
-from typing import List, Optional
+import os, aiohttp, asyncio, json, time
+from typing import AsyncIterator, List, Optional
+
+from app.llm_http import get_llm_session, llm_api_url
+from app.rec_cache import rec_cache, pref_key
+from app.llm_scheduler import (
+    llm_scheduler, LLMUpstreamError, RETRY_STATUSES, parse_retry_after,
+)
+from app.llm_router import llm_router
+from app.llm_parser import JsonArrayStream, parse_array
+from app.catalog import catalog, CATALOG_STRICT
+from app.recommender import recommender
+from app.precompute import precomputer, user_inputs
+from app.db import get_user_context, upsert_profile
+from app.jobs import job_queue, JOBS_MAX_WAIT
+from app.metrics import LLM_PHASE, LLM_RESPONSES, LLM_FALLBACKS, LLM_PARSE_FAILURES
 
 router = APIRouter(prefix="/v1", tags=["recommendations"])
 
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-OPENROUTER_MODEL = os.getenv("OPENROUTER_MODEL", "deepseek/deepseek-chat-v3.1:free")
+# structured output: auto — просим JSON-схему, пока модель не ответит 400 на response_format; on — всегда; off — никогда
+LLM_RESPONSE_FORMAT = os.getenv("LLM_RESPONSE_FORMAT", "auto")
 
 class BookPref(BaseModel):
     favorites: List[str] = Field(default_factory=list)
@@ -17,9 +33,29 @@ class BookOut(BaseModel):
     title: str
     author: Optional[str] = None
     reason: Optional[str] = None
+    # заполняются, если книга нашлась в локальном каталоге
+    catalog_id: Optional[int] = None
+    cover_url: Optional[str] = None
+    description: Optional[str] = None
 
 class RecResponse(BaseModel):
     books: List[BookOut]
+    source: str = "llm"
+
+class AutoIn(BaseModel):
+    # None — взять из сохранённых квиза/профиля
+    favorites: Optional[List[str]] = None
+    genres: Optional[List[str]] = None
+    authors: Optional[List[str]] = None
+    # поля профиля из Telegram; сохраняются вместе с предпочтениями
+    username: Optional[str] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    lang: Optional[str] = None
+    save: bool = True
+
+class AutoResponse(RecResponse):
+    prefs: BookPref
 
 PROMPT = (
     "Ты книжный ассистент. Дай 5 рекомендаций.\n"
@@ -29,6 +65,27 @@ PROMPT = (
     "Ответ строго в JSON-массиве объектов с полями title, author, reason. Без пояснений."
 )
 
+# корень схемы — объект: strict-режим OpenAI-совместимых API не принимает массив верхнего уровня
+BOOKS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "book_recommendations",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"books": {"type": "array", "items": {
+                "type": "object",
+                "properties": {"title": {"type": "string"}, "author": {"type": "string"}, "reason": {"type": "string"}},
+                "required": ["title", "author", "reason"],
+                "additionalProperties": False,
+            }}},
+            "required": ["books"],
+            "additionalProperties": False,
+        },
+    },
+}
+_no_response_format = set()     # модели, ответившие 400 на response_format
+
 FALLBACK = [
     {"title": "Солярис", "author": "Станислав Лем", "reason": "Философская фантастика классического уровня"},
     {"title": "451 градус по Фаренгейту", "author": "Рэй Брэдбери", "reason": "Классика антиутопии о ценности книг"},
@@ -37,76 +94,404 @@ FALLBACK = [
     {"title": "Ночной полет", "author": "Антуан де Сент-Экзюпери", "reason": "Философская проза автора 'Маленького принца'"},
 ]
 
-async def _call_llm(prefs: BookPref) -> List[BookOut]:
-    # если нет ключа — сразу даём запасной список
-    if not OPENROUTER_API_KEY:
-        return [BookOut(**x) for x in FALLBACK]
+def _headers() -> dict:
+    return {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "Content-Type": "application/json",
+    }
 
+def _build_payload(prefs: BookPref, model: str) -> dict:
     prompt_text = PROMPT.format(
         favorites=", ".join(prefs.favorites) or "-",
         genres=", ".join(prefs.genres) or "-",
         authors=", ".join(prefs.authors) or "-",
     )
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": "Отвечай строго в JSON-массиве."},
+            {"role": "user", "content": prompt_text},
+        ],
+    }
+    if LLM_RESPONSE_FORMAT == "on" or (LLM_RESPONSE_FORMAT == "auto" and model not in _no_response_format):
+        payload["response_format"] = BOOKS_RESPONSE_FORMAT
+    return payload
 
-    async with aiohttp.ClientSession() as session:
-        headers = {
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-            "Content-Type": "application/json",
-        }
-        payload = {
-            "model": OPENROUTER_MODEL,
-            "messages": [
-                {"role": "system", "content": "Отвечай строго в JSON-массиве."},
-                {"role": "user", "content": prompt_text},
-            ],
-        }
-        try:
-            async with session.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers, json=payload, timeout=60
-            ) as resp:
-                if resp.status >= 400:
-                    # вернем запасной список с маппингом на 502
-                    raise HTTPException(502, f"LLM HTTP {resp.status}: {await resp.text()}")
-                data = await resp.json()
-        except asyncio.TimeoutError:
-            raise HTTPException(504, "LLM timeout")
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(502, f"LLM transport error: {e}")
-
-    content = data["choices"][0]["message"]["content"]
-
-    # Лояльный парсер JSON (вырезаем первый массив из текста)
-    match = re.search(r"\[\s*{.*}\s*\]", content, re.S)
-    raw = match.group(0) if match else content
+def _rejects_response_format(payload: dict, status: int, text: str) -> bool:
+    # модель без structured output: запоминаем и дальше шлём обычный запрос (парсер справится и с текстом)
+    if status != 400 or LLM_RESPONSE_FORMAT != "auto" or "response_format" not in payload:
+        return False
+    if "response_format" not in text and "json_schema" not in text:
+        return False
+    _no_response_format.add(payload["model"])
+    return True
+
+def _to_book(it) -> Optional[BookOut]:
+    if isinstance(it, dict):
+        title = (it.get("title") or "").strip()
+        if not title:
+            return None
+        author = (it.get("author") or None)
+        reason = (it.get("reason") or None)
+        return BookOut(title=title, author=author, reason=reason)
+    # элемент — строка
+    s = str(it).strip()
+    return BookOut(title=s) if s else None
+
+def _observe_phases(timing: dict, mode: str):
+    # отметки ставит trace-конфиг сессии (app/llm_http.py): connect — до отправки запроса, generate — до конца ответа
+    if "start" in timing and "sent" in timing:
+        LLM_PHASE.observe(timing["sent"] - timing["start"], "connect", mode)
+        LLM_PHASE.observe(time.perf_counter() - timing["sent"], "generate", mode)
+
+async def _post_completion(payload: dict, url: Optional[str] = None, timeout: float = 60) -> dict:
+    session = await get_llm_session()
+    timing = {}
     try:
-        arr = json.loads(raw)
-        if not isinstance(arr, list):
-            raise ValueError("not a list")
-    except Exception:
-        # если модель ответила не-JSON — деградация в список строк
-        lines = [l.strip("-• \n") for l in content.splitlines() if l.strip()]
-        arr = [{"title": l} for l in lines[:5]]
+        async with session.post(
+            url or llm_api_url(), trace_request_ctx=timing,
+            headers=_headers(), json=payload, timeout=aiohttp.ClientTimeout(total=timeout)
+        ) as resp:
+            LLM_RESPONSES.inc(str(resp.status))
+            if resp.status >= 400:
+                text = await resp.text()
+                if _rejects_response_format(payload, resp.status, text):
+                    # планировщик повторит — модель уже в _no_response_format, запрос уйдёт без схемы
+                    raise LLMUpstreamError(502, f"LLM HTTP {resp.status}: {text}", retry_after=0, retryable=True,
+                                           fault=False)
+                # 429/5xx повторяем, остальное сразу отдаём как 502
+                raise LLMUpstreamError(
+                    502, f"LLM HTTP {resp.status}: {text}",
+                    retry_after=parse_retry_after(resp.headers.get("Retry-After")),
+                    retryable=resp.status in RETRY_STATUSES,
+                )
+            data = await resp.json()
+            _observe_phases(timing, "json")
+            return data
+    except asyncio.TimeoutError:
+        LLM_RESPONSES.inc("timeout")
+        # с пулом моделей повтор уйдёт другой модели; с одной — ждать ещё раз столько же незачем
+        raise LLMUpstreamError(504, "LLM timeout", retryable=len(llm_router.models) > 1)
+    except (HTTPException, LLMUpstreamError):
+        raise
+    except Exception as e:
+        LLM_RESPONSES.inc("error")
+        raise LLMUpstreamError(502, f"LLM transport error: {e}")
 
+async def _routed_completion(prefs: BookPref) -> dict:
+    # одна попытка планировщика: модель выбирается заново, так что повтор уходит самой быстрой здоровой
+    model, probe = llm_router.pick()
+    async with llm_router.track(model, probe):
+        return await _post_completion(_build_payload(prefs, model.name), model.url, llm_router.timeout(model))
+
+class _NoLLMAnswer(Exception):
+    """Пригодного ответа LLM нет (нет ключа, пустой разбор, всё мимо каталога) — отвечаем _fallback мимо кэша."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+async def _fallback(prefs: BookPref) -> List[BookOut]:
+    # локальный рекомендатель по каталогу, если артефакт собран; иначе — статичный список
+    if recommender.ready:
+        local = await recommender.recommend(prefs.favorites, prefs.genres, prefs.authors)
+        if local:
+            return [BookOut(**x) for x in local]
+    return [BookOut(**x) for x in FALLBACK]
+
+async def _call_llm(prefs: BookPref) -> List[BookOut]:
+    # если нет ключа — сразу запасной список (его подставит _recommend_cached)
+    if not OPENROUTER_API_KEY:
+        raise _NoLLMAnswer("no_key")
+
+    # лимиты, очередь, повторы и hedging — в планировщике, выбор модели — в роутере
+    data = await llm_scheduler.run(lambda: _routed_completion(prefs))
+
+    out = _parse_books(_content(data))
+    if not out:
+        raise _NoLLMAnswer("empty")
+    return out[:5]
+
+def _content(data) -> str:
+    # конверт без choices / с content: null — то же, что пустой ответ
+    try:
+        return data["choices"][0]["message"]["content"] or ""
+    except (KeyError, IndexError, TypeError):
+        return ""
+
+def _parse_books(content: str) -> List[BookOut]:
+    # массив ищем линейным сканером (app/llm_parser.py): ```json, пояснения, оборванный хвост
+    arr = parse_array(content)
+    if arr is None:
+        LLM_PARSE_FAILURES.inc()
+        # массива нет совсем — модель ответила списком строк; обрывки JSON за названия не считаем
+        if "[" in content or "{" in content:
+            return []
+        lines = [l.strip("-•* \n") for l in content.splitlines() if l.strip()]
+        arr = lines[:5]
+    return [b for b in map(_to_book, arr) if b]
+
+async def _enrich(books: List[BookOut], prefs: Optional[BookPref] = None) -> List[BookOut]:
+    # сверка с каталогом одним запросом на переданный список (в потоке — на каждую книгу, чтобы не
+    # задерживать первую); выдуманные LLM книги в strict-режиме отбрасываем
+    if not catalog.ready:
+        return books
+    matches = await catalog.resolve([b.model_dump() for b in books])
     out: List[BookOut] = []
-    for it in arr:
-        if isinstance(it, dict):
-            title = (it.get("title") or "").strip()
-            if not title:
-                continue
-            author = (it.get("author") or None)
-            reason = (it.get("reason") or None)
-            out.append(BookOut(title=title, author=author, reason=reason))
-        else:
-            # элемент — строка
-            s = str(it).strip()
-            if s:
-                out.append(BookOut(title=s))
-    return out[:5] if out else [BookOut(**x) for x in FALLBACK[:5]]
+    for b, m in zip(books, matches):
+        if m is None:
+            if not CATALOG_STRICT:
+                out.append(b)
+            continue
+        out.append(b.model_copy(update={
+            "catalog_id": m["id"],
+            "author": b.author or m["authors"],
+            "cover_url": m["cover_url"],
+            "description": m["description"],
+        }))
+    if not out and prefs is not None:
+        raise _NoLLMAnswer("catalog_miss")
+    return out
+
+async def _recommend(prefs: BookPref) -> List[BookOut]:
+    return await _enrich(await _call_llm(prefs), prefs)
+
+async def _recommend_cached(prefs: BookPref) -> List[BookOut]:
+    # в кэш попадают только ответы LLM: запасной список не должен закрепиться за этими предпочтениями на TTL
+    key = pref_key(prefs.favorites, prefs.genres, prefs.authors, llm_router.key)
+    try:
+        return await rec_cache.get_or_compute(key, lambda: _recommend(prefs))
+    except _NoLLMAnswer as e:
+        LLM_FALLBACKS.inc(e.reason)
+        return await _fallback(prefs)
+    except HTTPException as e:
+        # LLM недоступен — отвечаем локальным рекомендателем (в кэш не кладём)
+        if e.status_code >= 500 and recommender.ready:
+            LLM_FALLBACKS.inc("upstream_error")
+            return await _fallback(prefs)
+        raise
+
+async def precompute_books(favorites, genres, authors) -> List[dict]:
+    # для фонового предрасчёта: без локального запасного варианта, ошибка LLM — повторим при следующем изменении
+    prefs = BookPref(favorites=favorites, genres=genres, authors=authors)
+    key = pref_key(prefs.favorites, prefs.genres, prefs.authors, llm_router.key)
+    try:
+        books = await rec_cache.get_or_compute(key, lambda: _recommend(prefs))
+    except _NoLLMAnswer as e:
+        # запасной список не сохраняем: эндпоинт посчитает его сам, а LLM попробуем при следующем изменении
+        LLM_FALLBACKS.inc(e.reason)
+        return []
+    return [b.model_dump() for b in books]
+
+async def _stored(user_id: int, key: str) -> Optional[List[BookOut]]:
+    # сначала кэш в памяти, затем предрасчитанное фоновым воркером (если отпечаток входа совпал)
+    cached = rec_cache.get(key)
+    if cached is not None:
+        return cached
+    books = await precomputer.lookup(user_id, key)
+    if not books:
+        return None
+    books = [BookOut(**b) for b in books]
+    rec_cache.put(key, books)
+    return books
+
+async def run_job(user_id: int, request: dict) -> dict:
+    # воркер очереди задач: тот же путь, что и у синхронного эндпоинта
+    prefs = BookPref(**request)
+    key = pref_key(prefs.favorites, prefs.genres, prefs.authors, llm_router.key)
+    books = await _stored(user_id, key)
+    if books is None:
+        books = await _recommend_cached(prefs)
+    return {"books": [b.model_dump() for b in books]}
+
+_background = set()
+
+def _in_background(coro):
+    task = asyncio.ensure_future(coro)
+    _background.add(task)
+    task.add_done_callback(lambda t: (_background.discard(t), t.cancelled() or t.exception()))
+    return task
+
+async def _stream_llm(prefs: BookPref) -> AsyncIterator[BookOut]:
+    # stream: true — книги отдаются по мере того, как в ответе закрывается очередной объект
+    count = 0
+    if OPENROUTER_API_KEY:
+        parser = JsonArrayStream()
+        session = await get_llm_session()
+        timing = {}
+        async with llm_scheduler.slot():
+            try:
+                model, probe = llm_router.pick()
+            except LLMUpstreamError as e:
+                raise HTTPException(e.status_code, e.detail)
+            payload = dict(_build_payload(prefs, model.name), stream=True)
+            try:
+                async with llm_router.track(model, probe), session.post(
+                    model.url or llm_api_url(), trace_request_ctx=timing, headers=_headers(), json=payload,
+                    timeout=aiohttp.ClientTimeout(total=llm_router.timeout(model))
+                ) as resp:
+                    LLM_RESPONSES.inc(str(resp.status))
+                    if resp.status >= 400:
+                        text = await resp.text()
+                        # без схемы уйдёт уже следующий запрос; модель при этом исправна
+                        fault = not _rejects_response_format(payload, resp.status, text)
+                        raise LLMUpstreamError(502, f"LLM HTTP {resp.status}: {text}", fault=fault)
+                    async for raw in resp.content:
+                        line = raw.decode("utf-8", "ignore").strip()
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        try:
+                            delta = json.loads(data)["choices"][0]["delta"].get("content") or ""
+                        except Exception:
+                            continue
+                        for it in parser.feed(delta):
+                            book = _to_book(it)
+                            if book and count < 5:
+                                count += 1
+                                yield book
+                        if parser.done or count >= 5:
+                            break
+                    # поток оборвался посреди объекта — достраиваем, если есть целые поля
+                    for it in parser.finish():
+                        book = _to_book(it)
+                        if book and count < 5:
+                            count += 1
+                            yield book
+                    _observe_phases(timing, "stream")
+            except asyncio.TimeoutError:
+                LLM_RESPONSES.inc("timeout")
+                raise HTTPException(504, "LLM timeout")
+            except LLMUpstreamError as e:
+                raise HTTPException(e.status_code, e.detail)
+            except HTTPException:
+                raise
+            except Exception as e:
+                LLM_RESPONSES.inc("error")
+                raise HTTPException(502, f"LLM transport error: {e}")
+
+def _sse(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
 
 @router.post("/users/{user_id}/recommendations", response_model=RecResponse)
-async def recommend(user_id: int, prefs: BookPref):
-    books = await _call_llm(prefs)
+async def recommend(user_id: int, prefs: BookPref, mode: str = "llm"):
+    key = pref_key(prefs.favorites, prefs.genres, prefs.authors, llm_router.key)
+    stored = await _stored(user_id, key)
+    if stored is not None:
+        return {"books": stored}
+    # mode=instant: сразу локальный ответ, LLM досчитывается в фоне и попадает в кэш к следующему запросу
+    if mode == "instant" and recommender.ready:
+        if OPENROUTER_API_KEY:
+            _in_background(_recommend_cached(prefs))
+        LLM_FALLBACKS.inc("instant")
+        return {"books": await _fallback(prefs), "source": "local"}
+    books = await _recommend_cached(prefs)
     return {"books": books}
+
+@router.post("/users/{user_id}/recommendations/auto", response_model=AutoResponse)
+async def recommend_auto(user_id: int, body: AutoIn, mode: str = "llm"):
+    # один запрос вместо трёх: профиль+квиз одним чтением, подбор, сохранение предпочтений
+    profile, quiz = await get_user_context(user_id)
+    favorites, genres, authors = user_inputs(profile, quiz)
+    prefs = BookPref(
+        favorites=favorites if body.favorites is None else body.favorites,
+        genres=genres if body.genres is None else body.genres,
+        authors=authors if body.authors is None else body.authors,
+    )
+    result = await recommend(user_id, prefs, mode)
+    if body.save and result["books"]:
+        old = profile or {}
+        new = {
+            "username": body.username or old.get("username"),
+            "first_name": body.first_name or old.get("first_name"),
+            "last_name": body.last_name or old.get("last_name"),
+            "lang": body.lang or old.get("lang") or "ru",
+            "genres": prefs.genres,
+            "authors": prefs.authors,
+        }
+        if profile is None or any(new[k] != old.get(k) for k in ("username", "first_name", "last_name", "lang")) \
+                or prefs.genres != genres or prefs.authors != authors:
+            await upsert_profile(user_id=user_id, **new)
+            precomputer.notify(user_id)
+    return dict(result, prefs=prefs)
+
+@router.post("/users/{user_id}/recommendations/stream")
+async def recommend_stream(user_id: int, prefs: BookPref):
+    key = pref_key(prefs.favorites, prefs.genres, prefs.authors, llm_router.key)
+
+    async def events():
+        books: List[BookOut] = []
+        try:
+            cached = await _stored(user_id, key)
+            if cached is not None:
+                books = list(cached)
+                for b in books:
+                    yield _sse("book", b.model_dump())
+            else:
+                async for b in _stream_llm(prefs):
+                    for e in await _enrich([b]):
+                        books.append(e)
+                        yield _sse("book", e.model_dump())
+                if books:
+                    rec_cache.put(key, books)
+                else:
+                    # запасной список — в ответ, но не в кэш
+                    LLM_FALLBACKS.inc("empty")
+                    books = await _fallback(prefs)
+                    for b in books:
+                        yield _sse("book", b.model_dump())
+        except HTTPException as e:
+            if books or not recommender.ready:
+                yield _sse("error", {"status": e.status_code, "detail": e.detail})
+                return
+            LLM_FALLBACKS.inc("upstream_error")
+            books = await _fallback(prefs)
+            for b in books:
+                yield _sse("book", b.model_dump())
+        yield _sse("done", {"count": len(books)})
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.post("/users/{user_id}/recommendations/jobs", status_code=202)
+async def recommend_job_create(user_id: int, prefs: BookPref, response: Response):
+    # задача в очередь, ответ сразу; результат — GET /v1/recommendations/jobs/{job_id}[?wait=сек]
+    job = await job_queue.enqueue(user_id, prefs.model_dump())
+    response.headers["Location"] = f"/v1/recommendations/jobs/{job['job_id']}"
+    return job
+
+@router.get("/recommendations/jobs/{job_id}")
+async def recommend_job_get(job_id: str, wait: float = 0):
+    job = await (job_queue.wait(job_id, wait) if wait > 0 else job_queue.get(job_id))
+    if job is None:
+        raise HTTPException(404, "job not found")
+    return job
+
+@router.get("/recommendations/jobs")
+async def recommend_jobs_stats():
+    return dict(job_queue.stats(), max_wait=JOBS_MAX_WAIT)
+
+@router.get("/recommendations/cache")
+async def recommend_cache_stats():
+    return rec_cache.stats()
+
+@router.get("/recommendations/precompute")
+async def recommend_precompute_stats():
+    return precomputer.stats()
+
+@router.get("/llm/models")
+async def llm_models_stats():
+    # состояние роутера: EWMA задержки и ошибок, circuit breaker и таймаут по каждой модели
+    return llm_router.stats()
+
+@router.post("/llm/models/{name:path}/reset")
+async def llm_model_reset(name: str):
+    model = llm_router.get(name)
+    if model is None:
+        raise HTTPException(404, "model not found")
+    llm_router.reset(model)
+    return llm_router.stats()
@@ -0,0 +1,23 @@
+from typing import Literal, Optional
+
+from fastapi import APIRouter, HTTPException, Query
+
+from app.db import segment_users, top_segment
+
+# Сегменты аудитории по жанрам и авторам профиля: топы с числом пользователей и списки user_id
+# (например, для рассылки «новинки фантастики»). Идут по индексам profile_genres/profile_authors.
+router = APIRouter(prefix="/v1/segments", tags=["segments"])
+
+SEGMENT_PAGE_MAX = 10_000
+
+@router.get("/top/{kind}")
+async def segments_top(kind: Literal["genres", "authors"], limit: int = Query(20, ge=1, le=1000)):
+    return {"items": await top_segment(kind[:-1], limit)}
+
+@router.get("/users")
+async def segments_users(genre: Optional[str] = None, author: Optional[str] = None,
+                         after: int = 0, limit: int = Query(1000, ge=1, le=SEGMENT_PAGE_MAX)):
+    filters = {k: v for k, v in (("genre", genre), ("author", author)) if v}
+    if not filters:
+        raise HTTPException(422, "genre or author is required")
+    return await segment_users(filters, after, limit)
@@ -0,0 +1,17 @@
+from datetime import date
+from typing import Optional
+
+from fastapi import APIRouter
+
+from app.events import event_log
+from app.routers.logs import _period
+
+# Аудитория по журналу событий: активный пользователь — тот, у кого за сутки было хоть одно событие.
+router = APIRouter(prefix="/v1/users", tags=["users"])
+
+@router.get("/active")
+async def users_active(day_from: Optional[date] = None, day_to: Optional[date] = None):
+    """DAU по дням периода (по умолчанию 7 дней) и число уникальных пользователей за весь период."""
+    day_from, day_to = _period(day_from, day_to)
+    return dict(await event_log.active_users(day_from, day_to),
+                day_from=day_from.isoformat(), day_to=day_to.isoformat())
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+log = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """
+    Отложенная групповая запись: put() кладёт строку в буфер (последняя запись по ключу побеждает),
+    фоновая задача сбрасывает накопленное одним вызовом flush_fn — по размеру пачки или по таймеру.
+    Пока пачка не записана, её видно через get() (read-your-writes).
+    """
+
+    def __init__(self, flush_fn: Callable[[Dict[Hashable, Any]], Awaitable[None]],
+                 max_batch: int = 256, max_delay: float = 0.05):
+        self.flush_fn = flush_fn
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending: Dict[Hashable, Any] = {}
+        self._flushing: Dict[Hashable, Any] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.flushes = 0
+        self.rows = 0
+        self.coalesced = 0
+
+    def start(self):
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.ensure_future(self._run())
+
+    def put(self, key: Hashable, value: Any):
+        if key in self._pending:
+            self.coalesced += 1
+        self._pending[key] = value
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if key in self._pending:
+            return self._pending[key]
+        return self._flushing.get(key, default)
+
+    def __len__(self):
+        return len(self._pending) + len(self._flushing)
+
+    async def flush(self):
+        if not self._pending:
+            return
+        self._flushing, self._pending = self._pending, {}
+        try:
+            await self.flush_fn(self._flushing)
+            self.flushes += 1
+            self.rows += len(self._flushing)
+        except Exception:
+            log.exception("write-behind flush failed, %d rows will be retried", len(self._flushing))
+            # возвращаем пачку в буфер, не перетирая более свежие записи
+            for k, v in self._flushing.items():
+                self._pending.setdefault(k, v)
+            raise
+        finally:
+            self._flushing = {}
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                await asyncio.sleep(self.max_delay)
+
+    async def close(self):
+        # дренируем очередь при остановке
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self),
+            "flushes": self.flushes,
+            "rows": self.rows,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,153 @@
+"""
+Микробенчмарки горячих функций: app/db.py (одиночные и пакетные чтения/записи на временной базе)
+и разбор ответа LLM (_parse_books и потоковый JsonArrayStream) на ответах разной формы,
+включая битые — те же формы, что отдаёт bench/stub_llm.py.
+
+    python -m bench.bench_micro
+    python -m bench.bench_micro --only parser --n 20000
+
+Результат печатается и сохраняется в bench/results/micro-<время>.json.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+# база — временная: app.db читает DB_PATH при импорте
+_TMP = tempfile.TemporaryDirectory()
+os.environ["DB_PATH"] = os.path.join(_TMP.name, "micro.db")
+
+from app import db                                                   # noqa: E402
+from app.llm_parser import JsonArrayStream                           # noqa: E402
+from app.resp_cache import resp_cache                                # noqa: E402
+from app.routers.recommendations import _parse_books                 # noqa: E402
+from bench.load import git_commit, RESULTS_DIR, _percentile          # noqa: E402
+from bench.stub_llm import SHAPES, make_content                      # noqa: E402
+
+
+def _summary(times: list, n_items: int = 1, n_bytes: int = 0) -> dict:
+    total = sum(times)
+    out = {
+        "calls": len(times),
+        "ops_per_s": round(len(times) * n_items / total, 1) if total else None,
+        "us": {"p50": round(_percentile(times, 50) * 1e6, 2), "p99": round(_percentile(times, 99) * 1e6, 2)},
+    }
+    if n_bytes:
+        out["mb_per_s"] = round(n_bytes * len(times) / total / 2 ** 20, 2)
+    return out
+
+
+async def _timed(fn, n: int) -> list:
+    times = []
+    for i in range(n):
+        t = time.perf_counter()
+        await fn(i)
+        times.append(time.perf_counter() - t)
+    return times
+
+
+async def bench_db(n: int, users: int, batch: int) -> dict:
+    await db.init_db()
+    rnd = random.Random(1)
+    uid = lambda i: i % users + 1
+
+    async def upsert_profile(i):
+        await db.upsert_profile(uid(i), f"user{i}", "Имя", "Фамилия", "ru", ["фантастика", "детектив"], ["Лем"])
+
+    async def upsert_quiz(i):
+        await db.upsert_quiz(uid(i), "Солярис", i % 50)
+
+    out = {
+        "upsert_profile": _summary(await _timed(upsert_profile, n)),
+        "upsert_quiz": _summary(await _timed(upsert_quiz, n)),
+        "get_profile": _summary(await _timed(lambda i: db.get_profile(rnd.randint(1, users)), n)),
+        "get_quiz": _summary(await _timed(lambda i: db.get_quiz(rnd.randint(1, users)), n)),
+        "get_user_context": _summary(await _timed(lambda i: db.get_user_context(rnd.randint(1, users)), n)),
+        "get_version": _summary(await _timed(lambda i: db.get_version("profiles", rnd.randint(1, users)), n)),
+        # путь GET /v1/users/{id}/profile: сверка версии + готовые байты вместо get_profile + JSON
+        "resp_cache_profile": _summary(await _timed(lambda i: resp_cache.lookup(
+            "profiles", rnd.randint(1, min(users, n // 4)), None, db.get_profile, db.get_version), n)),
+        "save_precomputed": _summary(await _timed(
+            lambda i: db.save_precomputed(uid(i), f"fp{i}", [{"title": "Солярис", "author": "Лем"}] * 5), n)),
+        "get_precomputed": _summary(await _timed(lambda i: db.get_precomputed(rnd.randint(1, users)), n)),
+    }
+    rounds = max(1, n // batch)
+    ids = lambda: rnd.sample(range(1, users + 1), min(batch, users))
+    out[f"get_profiles[{batch}]"] = _summary(await _timed(lambda i: db.get_profiles(ids()), rounds), batch)
+    out[f"get_quizzes[{batch}]"] = _summary(await _timed(lambda i: db.get_quizzes(ids()), rounds), batch)
+    out[f"upsert_profiles[{batch}]"] = _summary(await _timed(lambda i: db.upsert_profiles([
+        {"user_id": u, "username": f"user{u}", "lang": "ru", "preferred_genres": ["роман"], "preferred_authors": []}
+        for u in ids()]), rounds), batch)
+    out[f"upsert_quizzes[{batch}]"] = _summary(await _timed(lambda i: db.upsert_quizzes([
+        {"user_id": u, "q1_favorite_book": "Дюна", "q2_books_per_year": 12} for u in ids()]), rounds), batch)
+    # повторы user_id в одной пачке: побеждает последняя запись, без ошибки уникальности связей
+    dup = lambda: (lambda x: x + x[: len(x) // 10 or 1])(ids())
+    out[f"upsert_profiles_dup[{batch}]"] = _summary(await _timed(lambda i: db.upsert_profiles([
+        {"user_id": u, "username": f"user{u}", "lang": "ru", "preferred_genres": ["роман", "детектив"],
+         "preferred_authors": ["Лем"]} for u in dup()]), rounds), batch)
+    out[f"upsert_quizzes_dup[{batch}]"] = _summary(await _timed(lambda i: db.upsert_quizzes([
+        {"user_id": u, "q1_favorite_book": "Дюна", "q2_books_per_year": 12} for u in dup()]), rounds), batch)
+    await db.close_db()
+    return out
+
+
+def bench_parser(n: int) -> dict:
+    rnd = random.Random(2)
+    out = {}
+    for shape in SHAPES + ("long_prose",):
+        if shape == "long_prose":
+            # длинное рассуждение модели вокруг массива — худший случай для регулярки
+            contents = [("Рассуждаю [о жанрах] {и авторах}. " * 200) + make_content("json", rnd)
+                        + (" Ещё мысли [x] {y}." * 200) for _ in range(50)]
+        else:
+            contents = [make_content(shape, rnd) for _ in range(50)]
+        size = sum(len(c.encode("utf-8")) for c in contents) // len(contents)
+        times, found = [], 0
+        for i in range(n):
+            c = contents[i % len(contents)]
+            t = time.perf_counter()
+            found += len(_parse_books(c))
+            times.append(time.perf_counter() - t)
+        stream_times = []
+        for i in range(max(1, n // 10)):
+            c = contents[i % len(contents)]
+            t = time.perf_counter()
+            p = JsonArrayStream()
+            for j in range(0, len(c), 16):
+                p.feed(c[j:j + 16])
+            stream_times.append(time.perf_counter() - t)
+        out[shape] = {"bytes": size, "books_per_call": round(found / n, 2),
+                      "parse_books": _summary(times, n_bytes=size),
+                      "stream": _summary(stream_times, n_bytes=size)}
+    return out
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--only", choices=["db", "parser"])
+    ap.add_argument("--n", type=int, default=5000)
+    ap.add_argument("--users", type=int, default=10000)
+    ap.add_argument("--batch", type=int, default=100)
+    args = ap.parse_args()
+
+    result = {"commit": git_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": sys.version.split()[0], "params": vars(args)}
+    if args.only in (None, "db"):
+        result["db"] = await bench_db(args.n, args.users, args.batch)
+    if args.only in (None, "parser"):
+        result["parser"] = bench_parser(args.n)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    out = os.path.join(RESULTS_DIR, f"micro-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"saved {out}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
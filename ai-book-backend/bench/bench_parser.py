@@ -0,0 +1,201 @@
+"""
+Фаззинг и пропускная способность парсера ответов LLM (app/llm_parser.py).
+
+Фаззинг: случайные массивы книг со «злыми» строками (кавычки, обратные слэши, скобки, \\u-escape)
+в случайной обёртке (```json, пояснения со скобками, хвост после массива) проверяются на:
+  - разбор целиком совпадает с исходным массивом;
+  - разбор по случайным кускам (feed/finish) даёт то же, что целиком;
+  - обрыв в случайном месте: не падает, отдаёт префикс массива, а достроенный объект содержит
+    только целые поля исходного;
+  - случайный мусор: не падает.
+Пропускная способность: большие ответы и вход, на котором старая регулярка r"\\[\\s*{.*}\\s*\\]"
+уходит в квадратичный перебор; для сравнения она гоняется на небольших размерах.
+
+    python -m bench.bench_parser
+    python -m bench.bench_parser --fuzz 20000 --sizes 1,4,16
+
+Ненулевой код возврата — если фаззинг нашёл расхождение. Результат — bench/results/parser-<время>.json.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+from app.llm_parser import JsonArrayStream, parse_array
+from bench.load import git_commit, RESULTS_DIR
+
+OLD_RE = re.compile(r"\[\s*{.*}\s*\]", re.S)
+ALPHABET = 'abcxyz АБВ эюя 0123 "\\/[]{},:\n\t' + "é—\U0001F4DA"
+
+
+def _rand_str(rnd: random.Random, k: int) -> str:
+    return "".join(rnd.choice(ALPHABET) for _ in range(rnd.randint(0, k)))
+
+
+def _books(rnd: random.Random) -> list:
+    out = []
+    for _ in range(rnd.randint(1, 7)):
+        b = {"title": _rand_str(rnd, 20) or "x", "author": _rand_str(rnd, 15)}
+        if rnd.random() < 0.7:
+            b["reason"] = _rand_str(rnd, 60)
+        if rnd.random() < 0.2:
+            b["tags"] = [_rand_str(rnd, 5) for _ in range(rnd.randint(0, 3))]
+        out.append(b)
+    return out
+
+
+def _wrap(rnd: random.Random, arr: list) -> str:
+    body = json.dumps(arr, ensure_ascii=rnd.random() < 0.3, indent=rnd.choice([None, 2]))
+    prefix = rnd.choice(["", "Вот список:\n", "```json\n", "Подумал [о жанрах] и {авторах}.\n", "[] пусто, а вот: "])
+    suffix = rnd.choice(["", "\n```", "\nНадеюсь, понравится! [конец]", " {ps}"])
+    return prefix + body + suffix
+
+
+def _chunked(text: str, rnd: random.Random) -> list:
+    p = JsonArrayStream()
+    items, i = [], 0
+    while i < len(text):
+        n = rnd.randint(1, 40)
+        items += p.feed(text[i:i + n])
+        i += n
+    return items + p.finish()
+
+
+def _is_partial_of(repaired, original) -> bool:
+    if isinstance(repaired, dict) and isinstance(original, dict):
+        return all(k in original and _is_partial_of(v, original[k]) for k, v in repaired.items())
+    if isinstance(repaired, list) and isinstance(original, list):
+        return len(repaired) <= len(original) and all(_is_partial_of(a, b) for a, b in zip(repaired, original))
+    return repaired == original
+
+
+def fuzz(n: int, seed: int) -> dict:
+    rnd = random.Random(seed)
+    failures = []
+    stats = {"cases": n, "truncated_repaired": 0, "truncated_dropped": 0}
+
+    def fail(kind, text, got, want=None):
+        if len(failures) < 20:
+            failures.append({"kind": kind, "text": text[:500], "got": repr(got)[:300], "want": repr(want)[:300]})
+
+    for _ in range(n):
+        arr = _books(rnd)
+        text = _wrap(rnd, arr)
+        try:
+            whole = parse_array(text)
+            if whole != arr:
+                fail("whole", text, whole, arr)
+            chunked = _chunked(text, rnd)
+            if chunked != arr:
+                fail("chunked", text, chunked, arr)
+
+            # обрыв: только внутри массива, хвост пояснения не интересен
+            start = text.index("[", text.index("[{") if "[{" in text else 0)
+            cut = rnd.randint(start + 1, len(text) - 1)
+            got = parse_array(text[:cut]) or []
+            if got and (len(got) > len(arr) or got[:-1] != arr[:len(got) - 1]
+                        or not _is_partial_of(got[-1], arr[len(got) - 1])):
+                fail("truncated", text[:cut], got, arr)
+            elif got and got[-1] != arr[len(got) - 1]:
+                stats["truncated_repaired"] += 1
+            elif len(got) < len(arr):
+                stats["truncated_dropped"] += 1
+            if _chunked(text[:cut], rnd) != got:
+                fail("truncated_chunked", text[:cut], _chunked(text[:cut], rnd), got)
+
+            garbage = "".join(rnd.choice(ALPHABET) for _ in range(rnd.randint(0, 200)))
+            parse_array(garbage)
+            _chunked(garbage, rnd)
+        except Exception as e:      # парсер не должен бросать ни на чём
+            fail("exception", text, f"{type(e).__name__}: {e}")
+    stats["failures"] = failures
+    return stats
+
+
+def _big_response(size_mb: float) -> str:
+    reason = "Очень подробное обоснование с \"цитатами\", [скобками] и {фигурными} скобками. " * 40
+    books, total = [], 0
+    while total < size_mb * 2 ** 20:
+        b = {"title": f"Книга {len(books)}", "author": "Автор", "reason": reason}
+        books.append(b)
+        total += len(json.dumps(b, ensure_ascii=False).encode("utf-8"))
+    return "Вот подборка:\n```json\n" + json.dumps(books, ensure_ascii=False) + "\n```"
+
+
+def _adversarial(size_mb: float) -> str:
+    # много открытых "[{" без закрытия: регулярка перебирает каждую позицию до конца текста
+    return "[{" * int(size_mb * 2 ** 20 / 2) + "x"
+
+
+def _deep(size_mb: float) -> str:
+    # глубокая вложенность: json.loads упирается в лимит рекурсии — парсер не должен падать
+    n = int(size_mb * 2 ** 20 / 8)
+    return "[" + '{"a":[' * n + "]}" * n + "]"
+
+
+def _time(fn, text: str, repeat: int = 3) -> float:
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn(text)
+        dt = time.perf_counter() - t
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def _stream(text: str, chunk: int = 64):
+    p = JsonArrayStream()
+    for i in range(0, len(text), chunk):
+        p.feed(text[i:i + chunk])
+    p.finish()
+
+
+def throughput(sizes, regex_max_kb: int) -> dict:
+    out = {}
+    for name, make in (("large_response", _big_response), ("adversarial", _adversarial), ("deep", _deep)):
+        rows = []
+        for mb in sizes:
+            text = make(mb)
+            n = len(text.encode("utf-8")) / 2 ** 20
+            t_parse = _time(parse_array, text)
+            t_stream = _time(_stream, text)
+            rows.append({"mb": round(n, 2), "parse_array_s": round(t_parse, 4), "parse_mb_s": round(n / t_parse, 1),
+                         "stream_s": round(t_stream, 4), "stream_mb_s": round(n / t_stream, 1)})
+        # сравнение со старой регуляркой — на небольших входах, иначе ждать минутами
+        old = []
+        kb = 16
+        while kb <= regex_max_kb:
+            text = make(kb / 1024)
+            old.append({"kb": kb, "regex_s": round(_time(OLD_RE.search, text, 1), 4),
+                        "parse_array_s": round(_time(parse_array, text, 1), 4)})
+            kb *= 2
+        out[name] = {"parser": rows, "vs_regex": old}
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--fuzz", type=int, default=5000)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--sizes", default="1,4", help="размеры больших входов, МБ")
+    ap.add_argument("--regex-max-kb", type=int, default=128)
+    args = ap.parse_args()
+
+    result = {"commit": git_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "params": vars(args)}
+    result["fuzz"] = fuzz(args.fuzz, args.seed)
+    result["throughput"] = throughput([float(s) for s in args.sizes.split(",")], args.regex_max_kb)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    out = os.path.join(RESULTS_DIR, f"parser-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"saved {out}")
+    return 1 if result["fuzz"]["failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""
+Бенчмарк локального рекомендателя: время сборки, размер артефакта, загрузка, память и латентность
+запроса в зависимости от размера каталога. Каталог синтетический.
+
+    python -m bench.bench_recommender                  # 10k и 100k книг
+    python -m bench.bench_recommender --sizes 10000,100000,1000000 --queries 1000
+
+Результат печатается и сохраняется в bench/results/recommender-<время>.json.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+from app.catalog import Catalog, import_catalog
+from app.recommender import LocalRecommender, build
+
+GENRES = ["фантастика", "фэнтези", "детектив", "классика", "роман", "триллер", "ужасы", "поэзия",
+          "история", "биография", "психология", "бизнес", "наука", "приключения", "драма", "юмор"]
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def _percentile(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(len(xs) * p / 100))]
+
+
+def _make_dump(path: str, n: int, rnd: random.Random):
+    words = [f"слово{i}" for i in range(5000)]
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(n):
+            f.write(json.dumps({
+                "id": i + 1,
+                "title": " ".join(rnd.choices(words, k=3)),
+                "authors": f"Автор {rnd.randrange(max(1, n // 20))}",
+                "genres": ", ".join(rnd.sample(GENRES, rnd.randint(1, 3))),
+                "description": " ".join(rnd.choices(words, k=30)),
+            }, ensure_ascii=False) + "\n")
+
+
+async def _run_size(n: int, queries: int, dim: int, tmp: str) -> dict:
+    rnd = random.Random(n)
+    dump = os.path.join(tmp, f"dump-{n}.jsonl")
+    cat_path = os.path.join(tmp, f"catalog-{n}.db")
+    model_dir = os.path.join(tmp, f"model-{n}")
+    _make_dump(dump, n, rnd)
+
+    t = time.perf_counter()
+    import_catalog(dump, db_path=cat_path)
+    import_s = time.perf_counter() - t
+
+    t = time.perf_counter()
+    build(catalog_path=cat_path, db_path=os.path.join(tmp, "none.db"), out_dir=model_dir, dim=dim)
+    build_s = time.perf_counter() - t
+    artifact_mb = sum(os.path.getsize(os.path.join(model_dir, f)) for f in os.listdir(model_dir)) / 2 ** 20
+
+    cat = Catalog(cat_path)
+    await cat.open()
+    rss0 = _rss_mb()
+    t = time.perf_counter()
+    rec = LocalRecommender(model_dir, cat)
+    rec.load()
+    load_ms = (time.perf_counter() - t) * 1000
+
+    compute, full = [], []
+    for _ in range(queries):
+        genres = rnd.sample(GENRES, 2)
+        authors = [f"Автор {rnd.randrange(max(1, n // 20))}"]
+        t = time.perf_counter()
+        rec.top_k(rec.query_vector(genres, authors), 5)
+        compute.append((time.perf_counter() - t) * 1000)
+        t = time.perf_counter()
+        await rec.recommend([], genres, authors)
+        full.append((time.perf_counter() - t) * 1000)
+    rss1 = _rss_mb()
+    await cat.close()
+
+    return {
+        "books": n,
+        "dim": dim,
+        "import_s": round(import_s, 2),
+        "build_s": round(build_s, 2),
+        "artifact_mb": round(artifact_mb, 2),
+        "load_ms": round(load_ms, 2),
+        "rss_delta_mb": round(rss1 - rss0, 2),
+        "topk_ms": {"p50": round(_percentile(compute, 50), 3), "p99": round(_percentile(compute, 99), 3)},
+        "recommend_ms": {"p50": round(_percentile(full, 50), 3), "p99": round(_percentile(full, 99), 3)},
+    }
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10000,100000")
+    ap.add_argument("--queries", type=int, default=500)
+    ap.add_argument("--dim", type=int, default=128)
+    args = ap.parse_args()
+
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in (int(x) for x in args.sizes.split(",")):
+            r = await _run_size(n, args.queries, args.dim, tmp)
+            print(json.dumps(r, ensure_ascii=False))
+            runs.append(r)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    out = os.path.join(RESULTS_DIR, f"recommender-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"numpy": np.__version__, "maxrss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                   "runs": runs}, f, ensure_ascii=False, indent=2)
+    print(f"saved {out}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
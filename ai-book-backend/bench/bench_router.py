@@ -0,0 +1,131 @@
+"""
+Маршрутизация по пулу моделей (app/llm_router.py) без сети: несколько заглушек bench/stub_llm.py
+изображают быструю, медленную и нестабильную модели, бэкенд поднимается с LLM_MODELS на них.
+Прогон идёт фазами; между фазами заглушкам меняют поведение (быстрая «падает» и «поднимается»),
+после каждой фазы печатаются задержки ответов и состояние роутера из GET /v1/llm/models.
+
+    python -m bench.bench_router
+    python -m bench.bench_router --requests 60 --concurrency 8 --cooldown 2
+
+Результат — bench/results/router-<время>.json.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from bench.load import git_commit, RESULTS_DIR, ROOT, Recorder, _wait_ready
+from bench.stub_llm import StubLLM
+
+# имя модели -> параметры заглушки
+MODELS = {
+    "fast": dict(latency=0.2, jitter=0.05),
+    "slow": dict(latency=1.5, jitter=0.3),
+    "flaky": dict(latency=0.3, jitter=0.05, error_rate=0.6, error_statuses=(500, 503)),
+}
+
+# фаза: (название, {модель: error_rate}) — что поменять в заглушках перед фазой
+PHASES = [
+    ("warmup", {}),
+    ("steady", {}),
+    ("fast_down", {"fast": 1.0}),
+    ("fast_back", {"fast": 0.0}),
+]
+
+
+async def run_phase(session: aiohttp.ClientSession, base: str, n: int, concurrency: int, offset: int) -> dict:
+    rec = Recorder()
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        # разные предпочтения — мимо кэша рекомендаций, каждый запрос доходит до LLM
+        body = {"favorites": [f"Книга {offset + i}"], "genres": ["фантастика"], "authors": []}
+        async with sem:
+            t = time.perf_counter()
+            status = "error"
+            try:
+                async with session.post(f"{base}/v1/users/{offset + i}/recommendations", json=body) as r:
+                    await r.read()
+                    status = str(r.status)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = type(e).__name__
+            rec.add("POST /users/{id}/recommendations", time.perf_counter() - t, status)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    report = rec.report(time.perf_counter() - started)
+    async with session.get(f"{base}/v1/llm/models") as r:
+        router = await r.json()
+    return {"requests": report, "router": router}
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=40, help="запросов на фазу")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--cooldown", type=float, default=2, help="LLM_BREAKER_COOLDOWN бэкенда, сек")
+    ap.add_argument("--port", type=int, default=8795)
+    ap.add_argument("--stub-port", type=int, default=8796, help="первый порт заглушек, дальше подряд")
+    args = ap.parse_args()
+
+    stubs = {name: StubLLM(seed=i, **params) for i, (name, params) in enumerate(MODELS.items())}
+    urls = {}
+    for i, (name, stub) in enumerate(stubs.items()):
+        urls[name] = await stub.start(port=args.stub_port + i)
+    base = f"http://127.0.0.1:{args.port}"
+    phases = {}
+    proc = None
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            env = dict(os.environ,
+                       DB_PATH=os.path.join(tmp, "app.db"),
+                       OPENROUTER_API_KEY="bench",
+                       LLM_MODELS=",".join(f"{name}={url}" for name, url in urls.items()),
+                       LLM_BREAKER_COOLDOWN=str(args.cooldown),
+                       LLM_TIMEOUT_MIN="2",
+                       PRECOMPUTE_WORKERS="0",
+                       CATALOG_PATH=os.path.join(tmp, "none.db"),
+                       REC_MODEL_DIR=os.path.join(tmp, "none"))
+            proc = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port),
+                 "--log-level", "warning", "--no-access-log"], cwd=ROOT, env=env)
+            await _wait_ready(base, proc)
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120)) as s:
+                for i, (phase, changes) in enumerate(PHASES):
+                    for name, rate in changes.items():
+                        stubs[name].error_rate = rate
+                    if phase == "fast_back":
+                        await asyncio.sleep(args.cooldown * 2)     # дать пройти паузе breaker'а
+                    before = {name: stub.counts["requests"] for name, stub in stubs.items()}
+                    result = await run_phase(s, base, args.requests, args.concurrency, i * args.requests)
+                    result["stub_requests"] = {name: stub.counts["requests"] - before[name]
+                                               for name, stub in stubs.items()}
+                    phases[phase] = result
+                    print(phase, json.dumps(result["stub_requests"]),
+                          json.dumps(result["requests"]["POST /users/{id}/recommendations"]["ms"]))
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait(10)
+            for stub in stubs.values():
+                await stub.close()
+
+    result = {"commit": git_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "params": vars(args),
+              "models": {name: dict(p, error_statuses=list(p.get("error_statuses", ()))) for name, p in MODELS.items()},
+              "phases": phases}
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    out = os.path.join(RESULTS_DIR, f"router-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"saved {out}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,269 @@
+"""
+Нагрузочный прогон бэкенда с заглушкой LLM (bench/stub_llm.py). Поднимает заглушку и uvicorn
+с временной базой, воспроизводит сценарии бота с заданной частотой запросов (открытая модель:
+новые сессии приходят по Пуассону независимо от того, успевает ли сервер) и считает
+p50/p95/p99, пропускную способность и ошибки по каждому эндпоинту.
+
+    python -m bench.load --rps 50 --duration 30
+    python -m bench.load --rps 200 --latency 1.5 --error-rate 0.05 --malformed-rate 0.2 --mix quiz=2,auto=5,wizard=1
+    python -m bench.load --backend http://127.0.0.1:8000 --rps 20     # уже запущенный бэкенд, без заглушки
+
+Результат печатается и сохраняется в bench/results/load-<время>.json (вместе с коммитом и параметрами),
+так что прогоны можно сравнивать между коммитами.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from bench.stub_llm import StubLLM, add_args, from_args, TITLES
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GENRES = ["фантастика", "фэнтези", "детектив", "классика", "роман", "триллер", "ужасы", "история", "психология"]
+AUTHORS = sorted({a for _, a in TITLES})
+BOOKS = [t for t, _ in TITLES]
+
+
+def _percentile(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(len(xs) * p / 100))] if xs else None
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+class Recorder:
+    def __init__(self):
+        self.latency: Dict[str, List[float]] = defaultdict(list)
+        self.status: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def add(self, name: str, seconds: float, status: str):
+        self.latency[name].append(seconds)
+        self.status[name][status] += 1
+
+    def report(self, elapsed: float) -> dict:
+        out = {}
+        for name in sorted(self.latency):
+            xs = self.latency[name]
+            statuses = dict(self.status[name])
+            errors = sum(n for s, n in statuses.items() if not s.startswith("2"))
+            out[name] = {
+                "requests": len(xs),
+                "rps": round(len(xs) / elapsed, 2),
+                "ok_rps": round((len(xs) - errors) / elapsed, 2),
+                "error_rate": round(errors / len(xs), 4),
+                "statuses": statuses,
+                "ms": {p: round(_percentile(xs, q) * 1000, 2) for p, q in (("p50", 50), ("p95", 95), ("p99", 99))},
+                "max_ms": round(max(xs) * 1000, 2),
+            }
+        return out
+
+
+class Traffic:
+    """Сценарии бота: какие запросы к бэкенду делает один пользователь за одно действие."""
+
+    def __init__(self, session: aiohttp.ClientSession, base: str, rec: Recorder, users: int, rnd: random.Random):
+        self.s = session
+        self.base = base.rstrip("/")
+        self.rec = rec
+        self.users = users
+        self.rnd = rnd
+
+    async def call(self, name: str, method: str, path: str, body=None):
+        t = time.perf_counter()
+        status = "error"
+        try:
+            async with self.s.request(method, f"{self.base}/v1{path}", json=body) as r:
+                await r.read()
+                status = str(r.status)
+        except asyncio.TimeoutError:
+            status = "timeout"
+        except aiohttp.ClientError as e:
+            status = type(e).__name__
+        finally:
+            self.rec.add(name, time.perf_counter() - t, status)
+
+    def _pick(self, items, k):
+        # популярное встречается чаще — как у живых пользователей (и как это видит кэш)
+        weights = [1 / (i + 1) for i in range(len(items))]
+        return list(dict.fromkeys(self.rnd.choices(items, weights=weights, k=k)))
+
+    async def quiz(self, uid: int):
+        # /start -> викторина: два ответа, потом бот показывает профиль
+        await self.call("POST /users/{id}/quiz", "POST", f"/users/{uid}/quiz",
+                        {"q1_favorite_book": self._pick(BOOKS, 1)[0], "q2_books_per_year": self.rnd.randint(1, 50)})
+        await self.call("GET /users/{id}/profile", "GET", f"/users/{uid}/profile")
+
+    async def auto(self, uid: int):
+        # «⚡ Авто»: один запрос, профиль и квиз бэкенд берёт сам
+        await self.call("POST /users/{id}/recommendations/auto", "POST", f"/users/{uid}/recommendations/auto",
+                        {"username": f"user{uid}", "first_name": "Bench"})
+
+    async def wizard(self, uid: int):
+        # «🛠 Мастер»: явные предпочтения и сохранение в профиль, затем просмотр профиля
+        body = {"favorites": self._pick(BOOKS, 2), "genres": self._pick(GENRES, 2), "authors": self._pick(AUTHORS, 1),
+                "username": f"user{uid}"}
+        await self.call("POST /users/{id}/recommendations/auto", "POST", f"/users/{uid}/recommendations/auto", body)
+        await self.call("GET /users/{id}/profile", "GET", f"/users/{uid}/profile")
+
+    SCENARIOS = {"quiz": 2, "auto": 1, "wizard": 2}    # запросов к бэкенду на сценарий
+
+    def user(self) -> int:
+        return self.rnd.randint(1, self.users)
+
+
+def parse_mix(s: str) -> Dict[str, float]:
+    mix = {}
+    for part in s.split(","):
+        name, _, w = part.partition("=")
+        if name not in Traffic.SCENARIOS:
+            raise SystemExit(f"unknown scenario {name!r}, expected one of {sorted(Traffic.SCENARIOS)}")
+        mix[name] = float(w or 1)
+    return mix
+
+
+async def run_load(base: str, rps: float, duration: float, mix: Dict[str, float], users: int,
+                   max_inflight: int, timeout: float, seed: int) -> dict:
+    rnd = random.Random(seed)
+    rec = Recorder()
+    names, weights = list(mix), list(mix.values())
+    # rps — запросы к бэкенду; сессии приходят реже на среднее число запросов в сценарии
+    per_session = sum(Traffic.SCENARIOS[n] * w for n, w in mix.items()) / sum(weights)
+    session_rate = rps / per_session
+    inflight = set()
+    skipped = 0
+    connector = aiohttp.TCPConnector(limit=max_inflight)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as s:
+        traffic = Traffic(s, base, rec, users, rnd)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        next_at = started
+        while next_at - started < duration:
+            delay = next_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_at += rnd.expovariate(session_rate)
+            if len(inflight) >= max_inflight:
+                skipped += 1       # генератор упёрся в лимит — сервер не успевает за заданной частотой
+                continue
+            scenario = rnd.choices(names, weights=weights)[0]
+            task = asyncio.ensure_future(getattr(traffic, scenario)(traffic.user()))
+            inflight.add(task)
+            task.add_done_callback(inflight.discard)
+        if inflight:
+            await asyncio.wait(inflight)
+        elapsed = loop.time() - started
+        server = {}
+        for path in ("/v1/recommendations/cache", "/v1/recommendations/precompute"):
+            try:
+                async with s.get(f"{base.rstrip('/')}{path}") as r:
+                    server[path.rsplit("/", 1)[1]] = await r.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                pass
+    total = sum(len(v) for v in rec.latency.values())
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "requests": total,
+        "achieved_rps": round(total / elapsed, 2),
+        "skipped_sessions": skipped,
+        "endpoints": rec.report(elapsed),
+        "server": server,
+    }
+
+
+async def _wait_ready(base: str, proc: subprocess.Popen, timeout: float = 30):
+    async with aiohttp.ClientSession() as s:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise SystemExit(f"backend exited with {proc.returncode}")
+            try:
+                async with s.get(f"{base}/") as r:
+                    if r.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise SystemExit("backend did not start")
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rps", type=float, default=50, help="целевая частота запросов к бэкенду")
+    ap.add_argument("--duration", type=float, default=30)
+    ap.add_argument("--mix", default="quiz=1,auto=3,wizard=1", help="веса сценариев")
+    ap.add_argument("--users", type=int, default=5000)
+    ap.add_argument("--max-inflight", type=int, default=1000)
+    ap.add_argument("--timeout", type=float, default=60)
+    ap.add_argument("--backend", help="URL уже запущенного бэкенда; без него поднимается свой с заглушкой LLM")
+    ap.add_argument("--port", type=int, default=8791)
+    ap.add_argument("--stub-port", type=int, default=8790)
+    ap.add_argument("--uvicorn-workers", type=int, default=1)
+    ap.add_argument("--env", action="append", default=[], help="доп. переменные бэкенда: --env DB_WRITE_BEHIND=1")
+    add_args(ap)
+    args = ap.parse_args()
+    mix = parse_mix(args.mix)
+
+    stub: Optional[StubLLM] = None
+    proc: Optional[subprocess.Popen] = None
+    base = args.backend
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            if base is None:
+                stub = from_args(args)
+                llm_url = await stub.start(port=args.stub_port)
+                env = dict(os.environ,
+                           DB_PATH=os.path.join(tmp, "app.db"),
+                           LLM_API_URL=llm_url,
+                           OPENROUTER_API_KEY=os.getenv("OPENROUTER_API_KEY", "bench"),
+                           CATALOG_PATH=os.getenv("CATALOG_PATH", os.path.join(tmp, "none.db")),
+                           REC_MODEL_DIR=os.getenv("REC_MODEL_DIR", os.path.join(tmp, "none")))
+                env.update(kv.split("=", 1) for kv in args.env)
+                base = f"http://127.0.0.1:{args.port}"
+                proc = subprocess.Popen(
+                    [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port),
+                     "--workers", str(args.uvicorn_workers), "--log-level", "warning", "--no-access-log"],
+                    cwd=ROOT, env=env)
+                await _wait_ready(base, proc)
+
+            result = await run_load(base, args.rps, args.duration, mix, args.users,
+                                    args.max_inflight, args.timeout, args.seed)
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait(10)
+            if stub is not None:
+                await stub.close()
+
+    result = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": {k: v for k, v in vars(args).items() if k != "env"} | {"env": args.env},
+        "stub": dict(stub.counts) if stub is not None else None,
+        **result,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    out = os.path.join(RESULTS_DIR, f"load-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"saved {out}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
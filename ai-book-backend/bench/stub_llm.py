@@ -0,0 +1,160 @@
+"""
+Заглушка OpenAI-совместимого /v1/chat/completions для нагрузочных тестов: задержка ответа,
+доля ошибок и форма ответа (включая битые) настраиваются. Понимает stream: true (SSE).
+
+    python -m bench.stub_llm --port 8790 --latency 0.8 --jitter 0.3 --error-rate 0.05 --malformed-rate 0.1
+
+Бэкенд направляется на неё через LLM_API_URL=http://127.0.0.1:8790/v1/chat/completions.
+"""
+import argparse
+import asyncio
+import json
+import random
+from collections import Counter
+from typing import Optional
+
+from aiohttp import web
+
+TITLES = [
+    ("Солярис", "Станислав Лем"), ("Дюна", "Фрэнк Герберт"), ("Основание", "Айзек Азимов"),
+    ("Пикник на обочине", "Аркадий и Борис Стругацкие"), ("Гиперион", "Дэн Симмонс"),
+    ("Левая рука тьмы", "Урсула Ле Гуин"), ("Нейромант", "Уильям Гибсон"), ("Ложная слепота", "Питер Уоттс"),
+    ("Убийство Роджера Экройда", "Агата Кристи"), ("Имя розы", "Умберто Эко"), ("Мастер и Маргарита", "Михаил Булгаков"),
+    ("Сто лет одиночества", "Габриэль Гарсиа Маркес"), ("Шантарам", "Грегори Дэвид Робертс"), ("Террор", "Дэн Симмонс"),
+]
+
+# формы content: валидные и те, что реально приходят от моделей
+SHAPES = ("json", "fenced", "prose", "strings", "truncated", "object", "lines", "empty")
+
+
+def make_books(rnd: random.Random, n: int = 5) -> list:
+    return [{"title": t, "author": a, "reason": f"Похожа по настроению на выбранное ({rnd.randrange(1000)})"}
+            for t, a in rnd.sample(TITLES, n)]
+
+
+def make_content(shape: str, rnd: random.Random, n: int = 5) -> str:
+    books = make_books(rnd, n)
+    arr = json.dumps(books, ensure_ascii=False)
+    if shape == "json":
+        return arr
+    if shape == "fenced":
+        return f"```json\n{json.dumps(books, ensure_ascii=False, indent=2)}\n```"
+    if shape == "prose":
+        return f"Вот подборка по вашим предпочтениям:\n{arr}\nПриятного чтения! [если что — спрашивайте]"
+    if shape == "strings":
+        return json.dumps([f"{b['title']} — {b['author']}" for b in books], ensure_ascii=False)
+    if shape == "truncated":
+        return arr[:rnd.randrange(len(arr) // 3, len(arr) - 5)]
+    if shape == "object":
+        return json.dumps({"books": books}, ensure_ascii=False)
+    if shape == "lines":
+        return "\n".join(f"- {b['title']} ({b['author']})" for b in books)
+    return ""
+
+
+class StubLLM:
+    def __init__(self, latency: float = 0.5, jitter: float = 0.2, error_rate: float = 0.0,
+                 error_statuses=(429, 500, 503), malformed_rate: float = 0.0, envelope_rate: float = 0.0,
+                 chunk: int = 16, seed: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.malformed_rate = malformed_rate
+        self.envelope_rate = envelope_rate      # битый конверт: без choices / content: null
+        self.chunk = chunk
+        self.rnd = random.Random(seed)
+        self.counts = Counter()
+        self._runner: Optional[web.AppRunner] = None
+
+    def _delay(self) -> float:
+        return max(0.0, self.rnd.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+
+    def _shape(self) -> str:
+        if self.rnd.random() < self.malformed_rate:
+            return self.rnd.choice(SHAPES[1:])
+        return "json"
+
+    async def completions(self, request: web.Request):
+        body = await request.json()
+        self.counts["requests"] += 1
+        await asyncio.sleep(self._delay())
+        if self.rnd.random() < self.error_rate:
+            status = self.rnd.choice(self.error_statuses)
+            self.counts[f"status_{status}"] += 1
+            return web.json_response({"error": {"message": "stub error"}}, status=status,
+                                     headers={"Retry-After": "0"} if status == 429 else None)
+        shape = self._shape()
+        self.counts[f"shape_{shape}"] += 1
+        content = make_content(shape, self.rnd)
+        if body.get("stream"):
+            return await self._stream(request, content)
+        if self.rnd.random() < self.envelope_rate:
+            self.counts["envelope"] += 1
+            return web.json_response(self.rnd.choice([{"choices": []}, {"choices": [{"message": {"content": None}}]},
+                                                      {"error": "overloaded"}]))
+        return web.json_response({
+            "id": "stub", "object": "chat.completion", "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        })
+
+    async def _stream(self, request: web.Request, content: str):
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        per_chunk = self._delay() / 20 / max(1, len(content) // self.chunk)
+        for i in range(0, len(content), self.chunk):
+            delta = {"choices": [{"index": 0, "delta": {"content": content[i:i + self.chunk]}}]}
+            await resp.write(f"data: {json.dumps(delta, ensure_ascii=False)}\n\n".encode("utf-8"))
+            if per_chunk:
+                await asyncio.sleep(per_chunk)
+        await resp.write(b"data: [DONE]\n\n")
+        return resp
+
+    async def stats(self, request: web.Request):
+        return web.json_response(dict(self.counts))
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.completions)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8790) -> str:
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def add_args(ap: argparse.ArgumentParser):
+    ap.add_argument("--latency", type=float, default=0.5, help="средняя задержка ответа, сек")
+    ap.add_argument("--jitter", type=float, default=0.2, help="стандартное отклонение задержки, сек")
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--error-statuses", default="429,500,503")
+    ap.add_argument("--malformed-rate", type=float, default=0.0, help="доля ответов не в виде чистого JSON-массива")
+    ap.add_argument("--envelope-rate", type=float, default=0.0, help="доля ответов без choices/content")
+    ap.add_argument("--seed", type=int, default=1)
+
+
+def from_args(args) -> StubLLM:
+    return StubLLM(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                   error_statuses=[int(s) for s in args.error_statuses.split(",") if s],
+                   malformed_rate=args.malformed_rate, envelope_rate=args.envelope_rate, seed=args.seed)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8790)
+    add_args(ap)
+    args = ap.parse_args()
+    web.run_app(from_args(args).app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
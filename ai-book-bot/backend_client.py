@@ -0,0 +1,304 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Optional
+
+import aiohttp
+
+from metrics import BACKEND_LATENCY, path_template
+
+# --- ENV ---
+_BASE = os.getenv("BACKEND_URL", "http://127.0.0.1:8000").rstrip("/")
+API_V1 = _BASE if _BASE.endswith("/v1") else f"{_BASE}/v1"
+
+BACKEND_POOL_LIMIT = int(os.getenv("BACKEND_POOL_LIMIT", "32"))
+BACKEND_KEEPALIVE = float(os.getenv("BACKEND_KEEPALIVE", "30"))
+BACKEND_TIMEOUT = float(os.getenv("BACKEND_TIMEOUT", "10"))
+BACKEND_REC_TIMEOUT = float(os.getenv("BACKEND_REC_TIMEOUT", "60"))
+BACKEND_JOB_POLL = float(os.getenv("BACKEND_JOB_POLL", "25"))
+BACKEND_JOB_DEADLINE = float(os.getenv("BACKEND_JOB_DEADLINE", "600"))
+# локальные копии профилей с ETag: повторное чтение — If-None-Match, при 304 бэкенд не шлёт тело
+BACKEND_PROFILE_CACHE = int(os.getenv("BACKEND_PROFILE_CACHE", "10000"))    # 0 — без копий
+# события (показы рекомендаций) копятся в памяти и уходят на бэкенд пачкой раз в BOT_EVENTS_FLUSH сек
+BOT_EVENTS = os.getenv("BOT_EVENTS", "1") == "1"
+BOT_EVENTS_FLUSH = float(os.getenv("BOT_EVENTS_FLUSH", "2"))
+BOT_EVENTS_BUFFER = int(os.getenv("BOT_EVENTS_BUFFER", "10000"))
+
+log = logging.getLogger(__name__)
+
+
+def api(path: str) -> str:
+    return f"{API_V1}{path}"
+
+
+class BackendError(Exception):
+    """Бэкенд ответил статусом >= 400."""
+
+    def __init__(self, status: int, text: str = ""):
+        self.status = status
+        self.text = text
+        super().__init__(f"HTTP {status}: {text[:200]}" if text else f"HTTP {status}")
+
+
+class BackendClient:
+    """
+    Асинхронный клиент бэкенда: одна keep-alive сессия на весь процесс бота,
+    ограниченный пул соединений и таймаут на каждый вызов.
+    """
+
+    def __init__(self, limit: int = BACKEND_POOL_LIMIT, keepalive: float = BACKEND_KEEPALIVE):
+        self._limit = limit
+        self._keepalive = keepalive
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._lock = asyncio.Lock()
+        self._profiles: "OrderedDict[int, tuple]" = OrderedDict()     # user_id -> (etag, профиль)
+        self.profile_hits = 0
+
+    async def session(self) -> aiohttp.ClientSession:
+        # сессию создаём лениво — внутри уже запущенного event loop
+        if self._session is None or self._session.closed:
+            async with self._lock:
+                if self._session is None or self._session.closed:
+                    connector = aiohttp.TCPConnector(
+                        limit=self._limit,
+                        keepalive_timeout=self._keepalive,
+                        ttl_dns_cache=300,
+                    )
+                    self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def request(self, method: str, path: str, *, json: Any = None, data: Any = None,
+                      headers: Optional[dict] = None, timeout: float = BACKEND_TIMEOUT, allow_404: bool = False,
+                      conditional: bool = False):
+        """conditional=True — (статус, ETag, тело) для запросов с If-None-Match; при 304 и 404 тело None."""
+        s = await self.session()
+        started = time.perf_counter()
+        status = "error"
+        try:
+            async with s.request(method, api(path), json=json, data=data, headers=headers,
+                                 timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+                status = str(r.status)
+                if conditional and r.status in (304, 404):
+                    return r.status, r.headers.get("ETag"), None
+                if allow_404 and r.status == 404:
+                    return None
+                if r.status >= 400:
+                    raise BackendError(r.status, await r.text())
+                body = await r.json()
+                return (r.status, r.headers.get("ETag"), body) if conditional else body
+        except asyncio.TimeoutError:
+            status = "timeout"
+            raise
+        finally:
+            BACKEND_LATENCY.observe(time.perf_counter() - started, method, path_template(path), status)
+
+    # --- API ---
+
+    async def get_profile(self, user_id: int) -> Optional[dict]:
+        cached = self._profiles.get(user_id)
+        status, etag, data = await self.request("GET", f"/users/{user_id}/profile", conditional=True,
+                                                headers={"If-None-Match": cached[0]} if cached else None)
+        if status == 304 and cached:
+            self.profile_hits += 1
+            self._profiles.move_to_end(user_id)
+            return cached[1]
+        if status == 404:
+            self._profiles.pop(user_id, None)
+            return None
+        if data is not None and etag and BACKEND_PROFILE_CACHE > 0:
+            self._profiles[user_id] = (etag, data)
+            self._profiles.move_to_end(user_id)
+            while len(self._profiles) > BACKEND_PROFILE_CACHE:
+                self._profiles.popitem(last=False)
+        return data
+
+    async def save_profile(self, user_id: int, profile: dict) -> dict:
+        return await self.request("PUT", f"/users/{user_id}/profile", json=profile)
+
+    async def save_quiz(self, user_id: int, q1: str, q2: int) -> dict:
+        return await self.request(
+            "POST", f"/users/{user_id}/quiz",
+            json={"q1_favorite_book": q1, "q2_books_per_year": q2},
+        )
+
+    async def recommend(self, user_id: int, favorites, genres, authors) -> dict:
+        return await self.request(
+            "POST", f"/users/{user_id}/recommendations",
+            json={"favorites": favorites, "genres": genres, "authors": authors},
+            timeout=BACKEND_REC_TIMEOUT,
+        )
+
+    async def recommend_auto(self, user_id: int, body: dict) -> dict:
+        """Один запрос: бэкенд сам берёт профиль и квиз, подбирает книги и сохраняет предпочтения."""
+        return await self.request(
+            "POST", f"/users/{user_id}/recommendations/auto", json=body, timeout=BACKEND_REC_TIMEOUT,
+        )
+
+    async def create_job(self, user_id: int, favorites, genres, authors) -> dict:
+        return await self.request(
+            "POST", f"/users/{user_id}/recommendations/jobs",
+            json={"favorites": favorites, "genres": genres, "authors": authors},
+        )
+
+    async def get_job(self, job_id: str, wait: float = 0) -> Optional[dict]:
+        # long-poll: бэкенд держит запрос не дольше wait секунд
+        return await self.request(
+            "GET", f"/recommendations/jobs/{job_id}?wait={wait}",
+            timeout=wait + BACKEND_TIMEOUT, allow_404=True,
+        )
+
+    async def wait_job(self, job_id: str, deadline: float = BACKEND_JOB_DEADLINE) -> dict:
+        """Ждёт завершения задачи серией коротких long-poll'ов; переживает рестарт бэкенда."""
+        loop = asyncio.get_event_loop()
+        until = loop.time() + deadline
+        while loop.time() < until:
+            try:
+                job = await self.get_job(job_id, wait=BACKEND_JOB_POLL)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                await asyncio.sleep(1)
+                continue
+            if job is None:
+                raise BackendError(404, "job not found")
+            if job["status"] == "done":
+                return job["result"]
+            if job["status"] == "failed":
+                raise BackendError(502, job.get("error") or "job failed")
+        raise BackendError(504, "job timeout")
+
+    async def recommend_stream(self, user_id: int, favorites, genres, authors) -> AsyncIterator[dict]:
+        """SSE-вариант рекомендаций: отдаёт книги по одной, по мере генерации."""
+        s = await self.session()
+        async with s.post(
+            api(f"/users/{user_id}/recommendations/stream"),
+            json={"favorites": favorites, "genres": genres, "authors": authors},
+            timeout=aiohttp.ClientTimeout(total=BACKEND_REC_TIMEOUT),
+        ) as r:
+            if r.status >= 400:
+                raise BackendError(r.status, await r.text())
+            event, data = None, []
+            async for raw in r.content:
+                line = raw.decode("utf-8").rstrip("\r\n")
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data.append(line[5:].strip())
+                elif not line and data:
+                    payload = json.loads("\n".join(data))
+                    if event == "book":
+                        yield payload
+                    elif event == "error":
+                        raise BackendError(payload.get("status", 502), payload.get("detail", ""))
+                    elif event == "done":
+                        return
+                    event, data = None, []
+
+    def profile_stats(self) -> dict:
+        return {"size": len(self._profiles), "not_modified": self.profile_hits}
+
+    async def send_events(self, lines: bytes) -> dict:
+        return await self.request("POST", "/events/bulk", data=lines,
+                                  headers={"Content-Type": "application/x-ndjson"})
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+class EventReporter:
+    """
+    События без ожидания в хендлере: track() только кладёт событие в буфер (при переполнении
+    вытесняются старые), фоновая задача раз в interval шлёт накопленное одним NDJSON-запросом.
+    Недоставленная пачка возвращается в буфер и уйдёт со следующей.
+    """
+
+    def __init__(self, client: BackendClient, interval: float = BOT_EVENTS_FLUSH,
+                 size: int = BOT_EVENTS_BUFFER, enabled: bool = BOT_EVENTS):
+        self.client = client
+        self.interval = interval
+        self.enabled = enabled
+        self._buf: deque = deque(maxlen=max(1, size))
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def track(self, user_id: int, type: str, title: Optional[str] = None, **props):
+        if not self.enabled:
+            return
+        if len(self._buf) == self._buf.maxlen:
+            self.dropped += 1
+        event = {"user_id": user_id, "type": type, "ts": time.time()}
+        if title:
+            event["title"] = title
+        if props:
+            event["props"] = props
+        self._buf.append(event)
+        # задачу запускаем лениво — внутри уже запущенного event loop
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                # цикл не должен умирать: _task остаётся, и track() его уже не перезапустит
+                log.exception("event flush failed, %d events buffered", len(self._buf))
+
+    async def flush(self):
+        if not self._buf:
+            return
+        batch = list(self._buf)
+        self._buf.clear()
+        try:
+            # default=str: несериализуемое значение в props не должно навсегда застрять в буфере
+            lines = "".join(json.dumps(e, ensure_ascii=False, default=str) + "\n" for e in batch).encode("utf-8")
+            await self.client.send_events(lines)
+            self.sent += len(batch)
+        except BackendError as e:
+            # 4xx — пачку не примут и при повторе
+            self.failed += 1
+            if e.status < 500:
+                self.dropped += len(batch)
+                log.warning("backend rejected %d events: %s", len(batch), e)
+                return
+            self._requeue(batch)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.failed += 1
+            self._requeue(batch)
+        except asyncio.CancelledError:
+            # остановка посреди отправки: close() дошлёт пачку
+            self._requeue(batch)
+            raise
+        except Exception:
+            # закрытая сессия, ответ не JSON и т.п. — пачку возвращаем, ошибку логирует вызывающий
+            self.failed += 1
+            self._requeue(batch)
+            raise
+
+    def _requeue(self, batch: list):
+        room = self._buf.maxlen - len(self._buf)
+        self.dropped += max(0, len(batch) - room)
+        self._buf.extendleft(reversed(batch[max(0, len(batch) - room):]))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            log.exception("event flush on shutdown failed, %d events lost", len(self._buf))
+
+    def stats(self) -> dict:
+        return {"buffered": len(self._buf), "sent": self.sent, "dropped": self.dropped, "failed": self.failed}
+
+
+backend = BackendClient()
+events = EventReporter(backend)
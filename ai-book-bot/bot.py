@@ -1,25 +1,39 @@
 import os
-import requests
+from functools import lru_cache
 from aiogram import Bot, Dispatcher, executor, types
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
+
+from backend_client import backend, events, BackendError
+from state_store import create_store
+from sender import Sender
+import metrics
 
 # --- ENV / API ---
 API_TOKEN = os.getenv("TELEGRAM_TOKEN")
-
-_BASE = os.getenv("BACKEND_URL", "http://127.0.0.1:8000").rstrip("/")
-API_V1 = _BASE if _BASE.endswith("/v1") else f"{_BASE}/v1"
-
-def api(path: str) -> str:
-    return f"{API_V1}{path}"
+# свой Bot API сервер (или заглушка из webhook_stub.py для локальной проверки)
+TELEGRAM_API_SERVER = os.getenv("TELEGRAM_API_SERVER")
+# стрим рекомендаций: одно сообщение дописывается по мере прихода книг
+BOT_STREAM_RECS = os.getenv("BOT_STREAM_RECS", "0") == "1"
+# задачи: бэкенд ставит подбор в очередь, бот ждёт результат в фоне и присылает его в чат
+BOT_REC_JOBS = os.getenv("BOT_REC_JOBS", "0") == "1"
 
 # --- BOT ---
-bot = Bot(token=API_TOKEN)
+bot = Bot(token=API_TOKEN,
+          server=TelegramAPIServer.from_base(TELEGRAM_API_SERVER) if TELEGRAM_API_SERVER else TELEGRAM_PRODUCTION)
 dp = Dispatcher(bot)
+# время апдейтов и хендлеров — в metrics.py, GET /metrics на BOT_METRICS_PORT
+dp.middleware.setup(metrics.HandlerMetrics())
+# все исходящие сообщения — через очередь с лимитами Telegram (см. sender.py)
+sender = Sender(bot)
 
+# клавиатуры неизменны: собираем один раз, sender кэширует и их JSON
+@lru_cache(maxsize=None)
 def main_kb():
     kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
     kb.add("📚 Рекомендации", "🧩 Викторина", "👤 Профиль")
     return kb
 
+@lru_cache(maxsize=None)
 def rec_mode_kb():
     ikb = types.InlineKeyboardMarkup()
     ikb.add(
@@ -28,30 +42,100 @@ def rec_mode_kb():
     )
     return ikb
 
-# --- SIMPLE STATE ---
-quiz_cache = {}        # user_id -> {"q1": str, "q2": int}
-wizard_state = {}      # user_id -> {"step": str, "favorites":[], "genres":[], "authors":[]}
+# --- STATE ---
+# BOT_STATE_BACKEND=memory (TTL + лимит записей) или sqlite (общее для нескольких процессов)
+state = create_store()
+metrics.registry.gauge("bot_sender", "Outgoing message queue state", sender.stats)
+metrics.registry.gauge("bot_state", "Dialog state store", state.stats)
+metrics.registry.gauge("bot_events", "Interaction events waiting to be sent to the backend", events.stats)
+metrics.registry.gauge("bot_profile_cache", "Local profile copies revalidated with ETag", backend.profile_stats)
+metrics.registry.gauge("bot_event_loop_lag_last_seconds", "Last sampled event loop lag", lambda: metrics.loop_lag.last)
+QUIZ = "quiz"          # user_id -> {"q": 1|2|None, "q1": str, "q2": int}
+WIZARD = "wizard"      # user_id -> {"step": str, "favorites":[], "genres":[], "authors":[]}
+
+def format_books(books) -> str:
+    lines = []
+    for b in books:
+        line = f"📚 {b.get('title')}"
+        if b.get("author"):
+            line += f" — {b['author']}"
+        if b.get("reason"):
+            line += f"\n▫ {b['reason']}"
+        lines.append(line)
+    return "\n\n".join(lines)
+
+def report_shown(uid: int, books, source: str):
+    # показы — в журнал событий бэкенда; не ждём: уйдут пачкой в фоне
+    for pos, b in enumerate(books):
+        events.track(uid, "impression", b.get("title"), source=source, pos=pos)
+
+def job_task(handler):
+    # в режиме задач обработчик не держит апдейт: ответ придёт в чат, когда задача завершится
+    return dp.async_task(handler) if BOT_REC_JOBS else handler
+
+async def fetch_books(msg: types.Message, uid: int, favorites, genres, authors) -> list:
+    if BOT_REC_JOBS:
+        job = await backend.create_job(uid, favorites, genres, authors)
+        data = await backend.wait_job(job["job_id"])
+        return data.get("books", [])
+    if not BOT_STREAM_RECS:
+        data = await backend.recommend(uid, favorites, genres, authors)
+        return data.get("books", [])
+    books = []
+    async for b in backend.recommend_stream(uid, favorites, genres, authors):
+        books.append(b)
+        # не ждём: промежуточные правки схлопываются в очереди до последней
+        sender.edit(msg.chat.id, msg.message_id, f"{msg.text}\n\n{format_books(books)}")
+    return books
+
+async def recommend_and_save(msg: types.Message, user: types.User,
+                             favorites=None, genres=None, authors=None) -> list:
+    """Подбор и сохранение предпочтений в профиль. None — взять из сохранённых профиля/викторины."""
+    fields = {
+        "username": user.username,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "lang": "ru",
+    }
+    if not (BOT_STREAM_RECS or BOT_REC_JOBS):
+        # один запрос: профиль и квиз бэкенд читает и обновляет сам
+        data = await backend.recommend_auto(
+            user.id, dict(fields, favorites=favorites, genres=genres, authors=authors))
+        return data.get("books", [])
+
+    if genres is None or authors is None:
+        try:
+            pdata = await backend.get_profile(user.id) or {}
+        except Exception:
+            pdata = {}
+        genres = (pdata.get("preferred_genres") or []) if genres is None else genres
+        authors = (pdata.get("preferred_authors") or []) if authors is None else authors
+    books = await fetch_books(msg, user.id, favorites or [], genres, authors)
+    if books:
+        try:
+            await backend.save_profile(user.id, dict(fields, preferred_genres=genres, preferred_authors=authors))
+        except Exception:
+            pass
+    return books
 
 # ===================== COMMON =====================
 
 @dp.message_handler(commands=['start'])
 async def start(message: types.Message):
-    await message.answer("Привет! Выбери действие:", reply_markup=main_kb())
+    await sender.send(message.chat.id, "Привет! Выбери действие:", reply_markup=main_kb())
 
 # ===================== PROFILE =====================
 
 @dp.message_handler(lambda m: m.text == "👤 Профиль")
 async def profile_show(message: types.Message):
     try:
-        r = requests.get(api(f"/users/{message.from_user.id}/profile"), timeout=10)
-        if r.status_code == 404:
-            await message.answer(
+        p = await backend.get_profile(message.from_user.id)
+        if p is None:
+            await sender.send(message.chat.id,
                 "Профиль пока пуст. Пройди «📚 Рекомендации» (Авто) или «🧩 Викторина».",
                 reply_markup=main_kb()
             )
             return
-        r.raise_for_status()
-        p = r.json()
         txt = (
             "Профиль:\n"
             f"Имя: {p.get('first_name') or '-'} {p.get('last_name') or ''}\n"
@@ -59,214 +143,162 @@ async def profile_show(message: types.Message):
             f"Жанры: {', '.join(p.get('preferred_genres', [])) or '-'}\n"
             f"Авторы: {', '.join(p.get('preferred_authors', [])) or '-'}"
         )
-        await message.answer(txt, reply_markup=main_kb())
+        await sender.send(message.chat.id, txt, reply_markup=main_kb())
     except Exception as e:
-        await message.answer(f"Не удалось получить профиль: {e}", reply_markup=main_kb())
+        await sender.send(message.chat.id, f"Не удалось получить профиль: {e}", reply_markup=main_kb())
 
 # ===================== QUIZ =====================
 
 @dp.message_handler(lambda m: m.text == "🧩 Викторина")
 async def quiz_start(message: types.Message):
-    quiz_cache[message.from_user.id] = {"q": 1}
-    await message.answer("Вопрос 1: Какая твоя любимая книга?",
+    await state.set(QUIZ, message.from_user.id, {"q": 1})
+    await sender.send(message.chat.id, "Вопрос 1: Какая твоя любимая книга?",
                          reply_markup=main_kb())
 
-@dp.message_handler(lambda m: quiz_cache.get(m.from_user.id, {}).get("q") == 1)
+@dp.message_handler(state.match(QUIZ, "q", 1))
 async def quiz_q1(message: types.Message):
-    st = quiz_cache[message.from_user.id]
+    st = await state.get(QUIZ, message.from_user.id)
     st["q1"] = message.text.strip()
     st["q"] = 2
-    await message.answer("Вопрос 2: Сколько книг ты читаешь в год? (цифрой)",
+    await state.set(QUIZ, message.from_user.id, st)
+    await sender.send(message.chat.id, "Вопрос 2: Сколько книг ты читаешь в год? (цифрой)",
                          reply_markup=main_kb())
 
-@dp.message_handler(lambda m: quiz_cache.get(m.from_user.id, {}).get("q") == 2)
+@dp.message_handler(state.match(QUIZ, "q", 2))
 async def quiz_q2(message: types.Message):
-    st = quiz_cache[message.from_user.id]
+    st = await state.get(QUIZ, message.from_user.id)
     try:
         st["q2"] = int(message.text.strip())
     except ValueError:
-        await message.answer("Нужно число. Например: 5", reply_markup=main_kb())
+        await sender.send(message.chat.id, "Нужно число. Например: 5", reply_markup=main_kb())
         return
 
     # сохраняем на бэкенд (не обязательно для работы «Авто», но полезно)
     try:
-        r = requests.post(
-            api(f"/users/{message.from_user.id}/quiz"),
-            json={"q1_favorite_book": st["q1"], "q2_books_per_year": st["q2"]},
-            timeout=10
-        )
-        r.raise_for_status()
+        await backend.save_quiz(message.from_user.id, st["q1"], st["q2"])
     except Exception:
         pass
 
     st["q"] = None
-    await message.answer(
+    await state.set(QUIZ, message.from_user.id, st)
+    sender.send(message.chat.id,
         "Готово! Как продолжим подборку?",
         reply_markup=main_kb()
     )
-    await message.answer("Выбери режим:", reply_markup=rec_mode_kb())
+    await sender.send(message.chat.id, "Выбери режим:", reply_markup=rec_mode_kb())
 
 # ===================== RECOMMENDATIONS =====================
 
 @dp.message_handler(lambda m: m.text == "📚 Рекомендации")
 async def rec_entry(message: types.Message):
     # ПЕРВЫМ ДЕЛОМ — всегда показать выбор режима
-    await message.answer("Выбери режим:", reply_markup=rec_mode_kb())
-    await message.answer("Можно вернуться в меню в любой момент.", reply_markup=main_kb())
+    sender.send(message.chat.id, "Выбери режим:", reply_markup=rec_mode_kb())
+    await sender.send(message.chat.id, "Можно вернуться в меню в любой момент.", reply_markup=main_kb())
 
 # ---- Авто режим ----
 @dp.callback_query_handler(lambda c: c.data == "rec_auto")
+@job_task
 async def rec_auto(call: types.CallbackQuery):
     uid = call.from_user.id
 
-    # собираем предпочтения: сначала из викторины, затем дополняем профилем
-    favorites, genres, authors = [], [], []
-
-    q = quiz_cache.get(uid)
-    if q and q.get("q1"):
-        favorites.append(q["q1"])
-
-    try:
-        pr = requests.get(api(f"/users/{uid}/profile"), timeout=10)
-        if pr.status_code == 200:
-            pdata = pr.json()
-            genres = pdata.get("preferred_genres") or []
-            authors = pdata.get("preferred_authors") or []
-    except Exception:
-        pass
+    # любимая книга из только что пройденной викторины; жанры и авторы — из профиля
+    q = await state.get(QUIZ, uid)
+    favorites = [q["q1"]] if q and q.get("q1") else None
 
     # если пусто — всё равно идём в LLM: он сможет дать «популярное» по умолчанию
     await bot.answer_callback_query(call.id)
-    await bot.send_message(uid, "Готовлю рекомендации…", reply_markup=main_kb())
+    msg = await sender.send(uid, "Готовлю рекомендации…",
+                                 reply_markup=None if BOT_STREAM_RECS else main_kb())
 
     try:
-        r = requests.post(
-            api(f"/users/{uid}/recommendations"),
-            json={"favorites": favorites, "genres": genres, "authors": authors},
-            timeout=60
-        )
-        r.raise_for_status()
-        data = r.json()
-        books = data.get("books", [])
+        books = await recommend_and_save(msg, call.from_user, favorites)
         if not books:
-            await bot.send_message(uid, "Пока нечего посоветовать 😔", reply_markup=main_kb())
+            await sender.send(uid, "Пока нечего посоветовать 😔", reply_markup=main_kb())
             return
 
-        # обновим профиль жанрами/авторами, если есть
-        try:
-            requests.post(
-                api(f"/users/{uid}/profile"),
-                json={
-                    "username": call.from_user.username,
-                    "first_name": call.from_user.first_name,
-                    "last_name": call.from_user.last_name,
-                    "lang": "ru",
-                    "preferred_genres": genres,
-                    "preferred_authors": authors,
-                },
-                timeout=10
-            )
-        except Exception:
-            pass
-
-        lines = []
-        for b in books:
-            line = f"📚 {b.get('title')}"
-            if b.get("author"):
-                line += f" — {b['author']}"
-            if b.get("reason"):
-                line += f"\n▫ {b['reason']}"
-            lines.append(line)
-        await bot.send_message(uid, "Готово! Рекомендации:", reply_markup=main_kb())
-        await bot.send_message(uid, "\n\n".join(lines), reply_markup=main_kb())
-    except requests.HTTPError as e:
-        await bot.send_message(uid, f"Бэкенд вернул ошибку: {e}", reply_markup=main_kb())
+        if BOT_STREAM_RECS:
+            await sender.edit(msg.chat.id, msg.message_id, f"Готово! Рекомендации:\n\n{format_books(books)}")
+        else:
+            # без await: заголовок и список уйдут одним сообщением
+            sender.send(uid, "Готово! Рекомендации:", reply_markup=main_kb())
+            await sender.send(uid, format_books(books), reply_markup=main_kb())
+        report_shown(uid, books, "auto")
+    except BackendError as e:
+        await sender.send(uid, f"Бэкенд вернул ошибку: {e}", reply_markup=main_kb())
     except Exception as e:
-        await bot.send_message(uid, f"Ошибка запроса: {e}", reply_markup=main_kb())
+        await sender.send(uid, f"Ошибка запроса: {e}", reply_markup=main_kb())
 
 # ---- Мастер вопросов ----
 @dp.callback_query_handler(lambda c: c.data == "rec_master")
 async def rec_master(call: types.CallbackQuery):
     uid = call.from_user.id
-    wizard_state[uid] = {"step": "books", "favorites": [], "genres": [], "authors": []}
+    await state.set(WIZARD, uid, {"step": "books", "favorites": [], "genres": [], "authors": []})
     await bot.answer_callback_query(call.id)
-    await bot.send_message(uid,
+    await sender.send(uid,
         "Напиши 2–3 любимые книги через запятую (например: Маленький принц, Дюна, Три товарища)",
         reply_markup=main_kb()
     )
 
-@dp.message_handler(lambda m: wizard_state.get(m.from_user.id, {}).get("step") == "books")
+@dp.message_handler(state.match(WIZARD, "step", "books"))
 async def w_books(message: types.Message):
-    st = wizard_state[message.from_user.id]
+    st = await state.get(WIZARD, message.from_user.id)
     st["favorites"] = [x.strip() for x in message.text.split(",") if x.strip()]
     st["step"] = "genres"
-    await message.answer("Окей! Теперь жанры (через запятую): фантастика, классика, детектив ...",
+    await state.set(WIZARD, message.from_user.id, st)
+    await sender.send(message.chat.id, "Окей! Теперь жанры (через запятую): фантастика, классика, детектив ...",
                          reply_markup=main_kb())
 
-@dp.message_handler(lambda m: wizard_state.get(m.from_user.id, {}).get("step") == "genres")
+@dp.message_handler(state.match(WIZARD, "step", "genres"))
 async def w_genres(message: types.Message):
-    st = wizard_state[message.from_user.id]
+    st = await state.get(WIZARD, message.from_user.id)
     st["genres"] = [x.strip() for x in message.text.split(",") if x.strip()]
     st["step"] = "authors"
-    await message.answer("И пару любимых авторов (через запятую), или '-' если нет:",
+    await state.set(WIZARD, message.from_user.id, st)
+    await sender.send(message.chat.id, "И пару любимых авторов (через запятую), или '-' если нет:",
                          reply_markup=main_kb())
 
-@dp.message_handler(lambda m: wizard_state.get(m.from_user.id, {}).get("step") == "authors")
+@dp.message_handler(state.match(WIZARD, "step", "authors"))
+@job_task
 async def w_authors(message: types.Message):
     uid = message.from_user.id
-    st = wizard_state[uid]
+    st = await state.get(WIZARD, uid)
     st["authors"] = [] if message.text.strip() == "-" else [x.strip() for x in message.text.split(",") if x.strip()]
     st["step"] = None
+    await state.set(WIZARD, uid, st)
 
-    await message.answer("Готовлю рекомендации…", reply_markup=main_kb())
+    msg = await sender.send(message.chat.id, "Готовлю рекомендации…",
+                               reply_markup=None if BOT_STREAM_RECS else main_kb())
 
     try:
-        r = requests.post(
-            api(f"/users/{uid}/recommendations"),
-            json={"favorites": st["favorites"], "genres": st["genres"], "authors": st["authors"]},
-            timeout=60
-        )
-        r.raise_for_status()
-        data = r.json()
-        books = data.get("books", [])
+        books = await recommend_and_save(msg, message.from_user, st["favorites"], st["genres"], st["authors"])
         if not books:
-            await message.answer("Пока нечего посоветовать 😔", reply_markup=main_kb())
+            await sender.send(message.chat.id, "Пока нечего посоветовать 😔", reply_markup=main_kb())
             return
 
-        # сохраним предпочтения в профиль
-        try:
-            requests.post(
-                api(f"/users/{uid}/profile"),
-                json={
-                    "username": message.from_user.username,
-                    "first_name": message.from_user.first_name,
-                    "last_name": message.from_user.last_name,
-                    "lang": "ru",
-                    "preferred_genres": st["genres"],
-                    "preferred_authors": st["authors"],
-                },
-                timeout=10
-            )
-        except Exception:
-            pass
-
-        lines = []
-        for b in books:
-            line = f"📚 {b.get('title')}"
-            if b.get("author"):
-                line += f" — {b['author']}"
-            if b.get("reason"):
-                line += f"\n▫ {b['reason']}"
-            lines.append(line)
-        await message.answer("\n\n".join(lines), reply_markup=main_kb())
-    except requests.HTTPError as e:
-        await message.answer(f"Бэкенд вернул ошибку: {e}", reply_markup=main_kb())
+        if BOT_STREAM_RECS:
+            await sender.edit(msg.chat.id, msg.message_id, f"Готово! Рекомендации:\n\n{format_books(books)}")
+        else:
+            await sender.send(message.chat.id, format_books(books), reply_markup=main_kb())
+        report_shown(uid, books, "master")
+    except BackendError as e:
+        await sender.send(message.chat.id, f"Бэкенд вернул ошибку: {e}", reply_markup=main_kb())
     except Exception as e:
-        await message.answer(f"Ошибка запроса: {e}", reply_markup=main_kb())
+        await sender.send(message.chat.id, f"Ошибка запроса: {e}", reply_markup=main_kb())
     finally:
-        wizard_state.pop(uid, None)
+        await state.delete(WIZARD, uid)
 
 # ===================================================
 
+async def on_startup(dp: Dispatcher):
+    await metrics.serve()
+
+async def on_shutdown(dp: Dispatcher):
+    await sender.close()
+    await events.close()
+    await backend.close()
+    await state.close()
+    await metrics.close()
+
 if __name__ == "__main__":
-    executor.start_polling(dp, skip_updates=True)
+    # long polling для разработки; продакшн — webhook.py (несколько процессов-воркеров)
+    executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)
@@ -0,0 +1,245 @@
+"""
+Метрики бота в текстовом формате Prometheus: время обработки апдейтов и хендлеров, вызовы бэкенда,
+состояние очереди отправки и хранилища, лаг event loop. Отдаются маленьким aiohttp-сервером
+на локальном порту (BOT_METRICS_PORT; в webhook-режиме воркер i слушает BOT_METRICS_PORT + 1 + i).
+"""
+import os
+import re
+import time
+import bisect
+import asyncio
+import inspect
+import logging
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+log = logging.getLogger(__name__)
+
+# --- ENV ---
+BOT_METRICS_HOST = os.getenv("BOT_METRICS_HOST", "127.0.0.1")
+BOT_METRICS_PORT = int(os.getenv("BOT_METRICS_PORT", "9101"))       # 0 — не поднимать сервер
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+UPDATE_KINDS = ("message", "callback_query", "edited_message", "inline_query", "my_chat_member")
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(v: float) -> str:
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, n: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + n
+
+    async def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"] + [
+            f"{self.name}{_labels(self.label_names, k)} {_num(v)}" for k, v in self._values.items()]
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values: Dict[Tuple, list] = {}     # labels -> [счётчики по корзинам..., +Inf, sum]
+
+    def observe(self, value: float, *labels):
+        row = self._values.get(labels)
+        if row is None:
+            row = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        row[bisect.bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    async def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for k, row in self._values.items():
+            acc = 0
+            for le, n in zip(self.buckets + ("+Inf",), row):
+                acc += n
+                bucket = 'le="%s"' % le
+                out.append(f"{self.name}_bucket{_labels(self.label_names, k, bucket)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.label_names, k)} {_num(row[-1])}")
+            out.append(f"{self.name}_count{_labels(self.label_names, k)} {acc}")
+        return out
+
+
+class GaugeFunc:
+    """fn() (можно async) -> число или {значение метки field: число}; считается при выдаче /metrics."""
+
+    def __init__(self, name: str, help: str, fn: Callable):
+        self.name, self.help, self.fn = name, help, fn
+
+    async def render(self) -> List[str]:
+        value = self.fn()
+        if inspect.isawaitable(value):
+            value = await value
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        if isinstance(value, dict):
+            out += [f"{self.name}{_labels(('field',), (k,))} {_num(v)}"
+                    for k, v in value.items() if isinstance(v, (int, float)) and not isinstance(v, bool)]
+        elif value is not None:
+            out.append(f"{self.name} {_num(value)}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def gauge(self, name: str, help: str, fn: Callable):
+        return self.add(GaugeFunc(name, help, fn))
+
+    async def render(self) -> str:
+        lines: List[str] = []
+        for m in list(self._metrics.values()):
+            try:
+                lines += await m.render()
+            except Exception:
+                log.exception("metric %s failed", m.name)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+UPDATE_LATENCY = registry.add(Histogram(
+    "bot_update_duration_seconds", "Update processing time by update type", ("kind",)))
+HANDLER_LATENCY = registry.add(Histogram(
+    "bot_handler_duration_seconds", "Handler time (async_task handlers only until scheduled)", ("handler",)))
+UNHANDLED = registry.add(Counter("bot_unhandled_updates_total", "Updates no handler matched", ("kind",)))
+BACKEND_LATENCY = registry.add(Histogram(
+    "bot_backend_request_seconds", "Backend API call time by path template and status", ("method", "path", "status")))
+LOOP_LAG = registry.add(Histogram(
+    "bot_event_loop_lag_seconds", "Event loop scheduling delay",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)))
+
+_ID_SEGMENT = re.compile(r"/(\d+|[0-9a-f-]{16,})(?=/|$|\?)")
+
+
+def path_template(path: str) -> str:
+    """/users/42/profile -> /users/{id}/profile: по ряду метрик на маршрут, а не на пользователя."""
+    return _ID_SEGMENT.sub("/{id}", path.split("?", 1)[0])
+
+
+def _update_kind(update) -> str:
+    for kind in UPDATE_KINDS:
+        if getattr(update, kind, None) is not None:
+            return kind
+    return "other"
+
+
+class HandlerMetrics(BaseMiddleware):
+    """Время апдейта целиком и время сработавшего хендлера (по имени функции)."""
+
+    async def on_pre_process_update(self, update, data: dict):
+        data["_metrics_started"] = time.perf_counter()
+
+    async def on_post_process_update(self, update, results, data: dict):
+        started = data.get("_metrics_started")
+        if started is not None:
+            UPDATE_LATENCY.observe(time.perf_counter() - started, _update_kind(update))
+
+    async def _process(self, obj, data: dict):
+        # вызывается после фильтров, перед самим хендлером — current_handler уже выставлен
+        data["_metrics_handler"] = (getattr(current_handler.get(None), "__name__", "unknown"), time.perf_counter())
+
+    async def _post(self, kind: str, obj, results, data: dict):
+        handler = data.get("_metrics_handler")
+        if handler is None:
+            UNHANDLED.inc(kind)
+            return
+        HANDLER_LATENCY.observe(time.perf_counter() - handler[1], handler[0])
+
+    async def on_process_message(self, message, data: dict):
+        await self._process(message, data)
+
+    async def on_post_process_message(self, message, results, data: dict):
+        await self._post("message", message, results, data)
+
+    async def on_process_callback_query(self, query, data: dict):
+        await self._process(query, data)
+
+    async def on_post_process_callback_query(self, query, results, data: dict):
+        await self._post("callback_query", query, results, data)
+
+
+class LoopLagMonitor:
+    """Раз в interval засыпает и меряет, насколько позже запланированного проснулся."""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.last = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            t = loop.time()
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, loop.time() - t - self.interval)
+            LOOP_LAG.observe(self.last)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+loop_lag = LoopLagMonitor()
+_runner: Optional[web.AppRunner] = None
+
+
+async def serve(port: int = BOT_METRICS_PORT, host: str = BOT_METRICS_HOST):
+    """Поднимает GET /metrics; занятый порт — не повод ронять бота, только предупреждение."""
+    global _runner
+    loop_lag.start()
+    if not port or _runner is not None:
+        return
+
+    async def metrics(request: web.Request):
+        return web.Response(text=await registry.render(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        log.warning("metrics server on %s:%s not started: %s", host, port, e)
+        await runner.cleanup()
+        return
+    _runner = runner
+
+
+async def close():
+    global _runner
+    await loop_lag.close()
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
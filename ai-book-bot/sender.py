@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional
+
+from aiogram import Bot
+from aiogram.utils.exceptions import MessageNotModified, RetryAfter
+
+log = logging.getLogger(__name__)
+
+# --- ENV ---
+# лимиты Telegram: ~30 сообщений/с на бота и ~1/с в один чат (короткие всплески допустимы).
+# В webhook-режиме лимит считается на процесс — делите BOT_SEND_RATE на BOT_WORKERS.
+BOT_SEND_RATE = float(os.getenv("BOT_SEND_RATE", "25"))
+BOT_SEND_BURST = int(os.getenv("BOT_SEND_BURST", "25"))
+BOT_CHAT_RATE = float(os.getenv("BOT_CHAT_RATE", "1"))
+BOT_CHAT_BURST = int(os.getenv("BOT_CHAT_BURST", "3"))
+BOT_SEND_RETRIES = int(os.getenv("BOT_SEND_RETRIES", "3"))
+
+MAX_TEXT = 4096
+MARKUP_CACHE = 256
+
+
+class TokenBucket:
+    """Резервирующий бакет: reserve() списывает токен сразу и говорит, сколько ждать до его появления."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        self._refill(time.monotonic())
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.burst
+
+
+class _Item:
+    __slots__ = ("kind", "message_id", "text", "markup", "kwargs", "futures")
+
+    def __init__(self, kind: str, text: str, markup, kwargs: dict, message_id: Optional[int] = None):
+        self.kind = kind
+        self.message_id = message_id
+        self.text = text
+        self.markup = markup
+        self.kwargs = kwargs
+        self.futures: List[asyncio.Future] = [asyncio.get_event_loop().create_future()]
+
+
+class _Chat:
+    __slots__ = ("queue", "bucket", "task")
+
+    def __init__(self, rate: float, burst: int):
+        self.queue: Deque[_Item] = deque()
+        self.bucket = TokenBucket(rate, burst)
+        self.task: Optional[asyncio.Task] = None
+
+
+def _log_failure(fut: asyncio.Future):
+    if not fut.cancelled() and fut.exception() is not None:
+        log.warning("send failed: %s", fut.exception())
+
+
+class Sender:
+    """
+    Очередь исходящих сообщений: общий и початовый token bucket, автоматический повтор после
+    RetryAfter, склейка подряд идущих сообщений в один чат (пока они ждут своей очереди)
+    и схлопывание правок одного сообщения до последней.
+
+    send()/edit() возвращают future с итоговым Message: ждать её не обязательно — сообщения,
+    отправленные подряд без await, уйдут одним сообщением, если это возможно.
+    """
+
+    def __init__(self, bot: Optional[Bot] = None, rate: float = BOT_SEND_RATE, burst: int = BOT_SEND_BURST,
+                 chat_rate: float = BOT_CHAT_RATE, chat_burst: int = BOT_CHAT_BURST,
+                 retries: int = BOT_SEND_RETRIES):
+        self._bot = bot
+        self._global = TokenBucket(rate, burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.retries = retries
+        self._chats: "OrderedDict[int, _Chat]" = OrderedDict()
+        self._markups: "OrderedDict[int, tuple]" = OrderedDict()
+        self.sent = 0
+        self.merged = 0
+        self.retried = 0
+        self.failed = 0
+
+    @property
+    def bot(self) -> Bot:
+        return self._bot or Bot.get_current()
+
+    # --- API ---
+
+    def send(self, chat_id: int, text: str, reply_markup=None, **kwargs) -> asyncio.Future:
+        return self._put(chat_id, _Item("send", text, reply_markup, kwargs))
+
+    def edit(self, chat_id: int, message_id: int, text: str, reply_markup=None, **kwargs) -> asyncio.Future:
+        return self._put(chat_id, _Item("edit", text, reply_markup, kwargs, message_id))
+
+    async def close(self):
+        tasks = [c.task for c in self._chats.values() if c.task is not None]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "chats": len(self._chats),
+            "queued": sum(len(c.queue) for c in self._chats.values()),
+            "sent": self.sent,
+            "merged": self.merged,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+    # --- внутреннее ---
+
+    def _chat(self, chat_id: int) -> _Chat:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            # бакеты давно молчащих чатов уже полные — такие записи можно выбросить
+            while self._chats:
+                old_id, old = next(iter(self._chats.items()))
+                if old.queue or old.task is not None or not old.bucket.idle():
+                    break
+                del self._chats[old_id]
+            chat = self._chats[chat_id] = _Chat(self.chat_rate, self.chat_burst)
+        else:
+            self._chats.move_to_end(chat_id)
+        return chat
+
+    def _put(self, chat_id: int, item: _Item) -> asyncio.Future:
+        chat = self._chat(chat_id)
+        chat.queue.append(item)
+        fut = item.futures[0]
+        fut.add_done_callback(_log_failure)
+        if chat.task is None:
+            chat.task = asyncio.ensure_future(self._drain(chat_id, chat))
+        return fut
+
+    def _markup(self, markup):
+        # клавиатуры сериализуем один раз: aiogram передаёт готовую JSON-строку как есть
+        if markup is None or isinstance(markup, str):
+            return markup
+        cached = self._markups.get(id(markup))
+        if cached is not None and cached[0] is markup:
+            self._markups.move_to_end(id(markup))
+            return cached[1]
+        raw = json.dumps(markup.to_python())
+        self._markups[id(markup)] = (markup, raw)
+        if len(self._markups) > MARKUP_CACHE:
+            self._markups.popitem(last=False)
+        return raw
+
+    @staticmethod
+    def _mergeable(a: _Item, b: _Item) -> bool:
+        if a.kind != b.kind or a.kwargs != b.kwargs:
+            return False
+        if a.kind == "edit":
+            return a.message_id == b.message_id
+        if a.markup is not None and b.markup is not None and a.markup is not b.markup:
+            return False
+        return len(a.text) + 2 + len(b.text) <= MAX_TEXT
+
+    def _take(self, chat: _Chat) -> _Item:
+        item = chat.queue.popleft()
+        while chat.queue and self._mergeable(item, chat.queue[0]):
+            nxt = chat.queue.popleft()
+            if item.kind == "edit":
+                item.text, item.markup = nxt.text, nxt.markup     # важна только последняя правка
+            else:
+                item.text = f"{item.text}\n\n{nxt.text}"
+                item.markup = nxt.markup if nxt.markup is not None else item.markup
+            item.futures += nxt.futures
+            self.merged += 1
+        return item
+
+    async def _drain(self, chat_id: int, chat: _Chat):
+        try:
+            while chat.queue:
+                # сначала ждём свою очередь в чате, и только потом занимаем общий лимит
+                wait = chat.bucket.reserve()
+                if wait:
+                    await asyncio.sleep(wait)
+                wait = self._global.reserve()
+                if wait:
+                    await asyncio.sleep(wait)
+                await self._deliver(chat_id, self._take(chat))
+        finally:
+            chat.task = None
+
+    async def _call(self, chat_id: int, item: _Item):
+        markup = self._markup(item.markup)
+        if item.kind == "send":
+            return await self.bot.send_message(chat_id, item.text, reply_markup=markup, **item.kwargs)
+        return await self.bot.edit_message_text(item.text, chat_id, item.message_id,
+                                                reply_markup=markup, **item.kwargs)
+
+    async def _deliver(self, chat_id: int, item: _Item):
+        error: Optional[BaseException] = None
+        result = None
+        for attempt in range(self.retries + 1):
+            try:
+                result = await self._call(chat_id, item)
+                error = None
+                self.sent += 1
+                break
+            except RetryAfter as e:
+                # флуд-контроль: ждём сколько сказали и повторяем (очередь чата стоит, сообщения копятся и склеиваются)
+                error = e
+                self.retried += 1
+                await asyncio.sleep(e.timeout)
+            except MessageNotModified:
+                break
+            except Exception as e:
+                error = e
+                break
+        if error is not None:
+            self.failed += 1
+        for fut in item.futures:
+            if fut.done():
+                continue
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(result)
+
+
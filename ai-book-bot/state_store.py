@@ -0,0 +1,284 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import aiosqlite
+
+log = logging.getLogger(__name__)
+
+# --- ENV ---
+BOT_STATE_BACKEND = os.getenv("BOT_STATE_BACKEND", "memory")     # memory | sqlite
+BOT_STATE_TTL = float(os.getenv("BOT_STATE_TTL", str(24 * 3600)))
+BOT_STATE_MAX = int(os.getenv("BOT_STATE_MAX", "100000"))
+BOT_STATE_DB = os.getenv("BOT_STATE_DB", os.path.join(os.path.dirname(__file__), "bot_state.db"))
+BOT_STATE_FLUSH_MS = int(os.getenv("BOT_STATE_FLUSH_MS", "200"))
+BOT_STATE_BATCH = int(os.getenv("BOT_STATE_BATCH", "256"))
+# сколько секунд верить локальной копии записи из SQLite (апдейты одного чата идут в один процесс)
+BOT_STATE_READ_CACHE = float(os.getenv("BOT_STATE_READ_CACHE", "1"))
+
+Key = Tuple[str, int]
+
+
+def _size(value) -> int:
+    # грубая оценка памяти: сам объект плюс ключи/значения первого уровня
+    n = sys.getsizeof(value)
+    if isinstance(value, dict):
+        n += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    return n
+
+
+class StateStore(ABC):
+    """
+    Состояние диалогов: пространство имён ("quiz", "wizard") + user_id -> dict.
+    Значение, полученное через get(), после изменения нужно сохранить через set().
+    """
+
+    @abstractmethod
+    async def get(self, ns: str, user_id: int) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def set(self, ns: str, user_id: int, value: dict):
+        ...
+
+    @abstractmethod
+    async def delete(self, ns: str, user_id: int):
+        ...
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def stats(self) -> dict:
+        ...
+
+    def match(self, ns: str, field: str, value):
+        """Фильтр для хендлеров aiogram: состояние пользователя ns[field] == value."""
+        async def check(obj) -> bool:
+            st = await self.get(ns, obj.from_user.id)
+            return st is not None and st.get(field) == value
+        return check
+
+
+class MemoryStateStore(StateStore):
+    """TTL от последнего обращения; при переполнении вытесняются самые давние записи."""
+
+    def __init__(self, ttl: float = BOT_STATE_TTL, max_entries: int = BOT_STATE_MAX):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Key, Tuple[float, dict]]" = OrderedDict()
+        self.evicted = 0
+        self.expired = 0
+
+    async def get(self, ns: str, user_id: int) -> Optional[dict]:
+        key = (ns, user_id)
+        item = self._data.get(key)
+        if item is None:
+            return None
+        now = time.monotonic()
+        if item[0] < now:
+            del self._data[key]
+            self.expired += 1
+            return None
+        self._data[key] = (now + self.ttl, item[1])
+        self._data.move_to_end(key)
+        return item[1]
+
+    async def set(self, ns: str, user_id: int, value: dict):
+        key = (ns, user_id)
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        self._expire()
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evicted += 1
+
+    async def delete(self, ns: str, user_id: int):
+        self._data.pop((ns, user_id), None)
+
+    def _expire(self):
+        # записи упорядочены по последнему обращению, а значит и по сроку — просроченные в начале
+        now = time.monotonic()
+        while self._data:
+            key, (expires, _) = next(iter(self._data.items()))
+            if expires >= now:
+                break
+            del self._data[key]
+            self.expired += 1
+
+    async def stats(self) -> dict:
+        self._expire()
+        return {
+            "backend": "memory",
+            "entries": len(self._data),
+            "memory_bytes": sys.getsizeof(self._data) + sum(_size(v) for _, v in self._data.values()),
+            "evicted": self.evicted,
+            "expired": self.expired,
+        }
+
+
+class SqliteStateStore(StateStore):
+    """
+    Общее для нескольких процессов бота состояние в SQLite (WAL). Записи копятся и сбрасываются
+    пачкой в одной транзакции раз в BOT_STATE_FLUSH_MS; до сброса их видно через get() этого процесса.
+    """
+
+    def __init__(self, path: str = BOT_STATE_DB, ttl: float = BOT_STATE_TTL,
+                 flush_ms: int = BOT_STATE_FLUSH_MS, max_batch: int = BOT_STATE_BATCH,
+                 read_cache: float = BOT_STATE_READ_CACHE):
+        self.path = path
+        self.ttl = ttl
+        self.flush_delay = flush_ms / 1000
+        self.max_batch = max_batch
+        self.read_cache = read_cache
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._lock = asyncio.Lock()
+        self._pending: Dict[Key, Optional[dict]] = {}        # None — удаление
+        self._cache: "OrderedDict[Key, Tuple[float, Optional[dict]]]" = OrderedDict()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._last_cleanup = 0.0
+        self.flushes = 0
+        self.rows = 0
+
+    async def _db(self) -> aiosqlite.Connection:
+        if self._conn is None:
+            async with self._lock:
+                if self._conn is None:
+                    conn = await aiosqlite.connect(self.path, timeout=5)
+                    await conn.execute_fetchall("PRAGMA journal_mode=WAL")
+                    await conn.execute_fetchall("PRAGMA synchronous=NORMAL")
+                    await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS bot_state (
+                        ns TEXT NOT NULL,
+                        user_id INTEGER NOT NULL,
+                        value TEXT NOT NULL,
+                        expires_at REAL NOT NULL,
+                        PRIMARY KEY (ns, user_id)
+                    ) WITHOUT ROWID""")
+                    await conn.commit()
+                    self._conn = conn
+                    self._closing = False
+                    self._wakeup = asyncio.Event()
+                    self._task = asyncio.ensure_future(self._run())
+        return self._conn
+
+    async def get(self, ns: str, user_id: int) -> Optional[dict]:
+        key = (ns, user_id)
+        if key in self._pending:
+            return self._pending[key]
+        item = self._cache.get(key)
+        if item is not None and item[0] >= time.monotonic():
+            return item[1]
+        conn = await self._db()
+        rows = await conn.execute_fetchall(
+            "SELECT value FROM bot_state WHERE ns=? AND user_id=? AND expires_at>=?", (ns, user_id, time.time()))
+        value = json.loads(rows[0][0]) if rows else None
+        self._remember(key, value)
+        return value
+
+    def _remember(self, key: Key, value: Optional[dict]):
+        if self.read_cache <= 0:
+            return
+        self._cache[key] = (time.monotonic() + self.read_cache, value)
+        self._cache.move_to_end(key)
+        while len(self._cache) > BOT_STATE_MAX:
+            self._cache.popitem(last=False)
+
+    async def _put(self, key: Key, value: Optional[dict]):
+        await self._db()
+        self._pending[key] = value
+        self._cache.pop(key, None)
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+    async def set(self, ns: str, user_id: int, value: dict):
+        await self._put((ns, user_id), value)
+
+    async def delete(self, ns: str, user_id: int):
+        await self._put((ns, user_id), None)
+
+    async def flush(self):
+        if not self._pending or self._conn is None:
+            return
+        batch, self._pending = self._pending, {}
+        expires = time.time() + self.ttl
+        upserts = [(ns, uid, json.dumps(v, ensure_ascii=False), expires)
+                   for (ns, uid), v in batch.items() if v is not None]
+        deletes = [(ns, uid) for (ns, uid), v in batch.items() if v is None]
+        try:
+            if upserts:
+                await self._conn.executemany(
+                    "INSERT INTO bot_state(ns, user_id, value, expires_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(ns, user_id) DO UPDATE SET value=excluded.value, expires_at=excluded.expires_at",
+                    upserts)
+            if deletes:
+                await self._conn.executemany("DELETE FROM bot_state WHERE ns=? AND user_id=?", deletes)
+            if time.time() - self._last_cleanup > 60:
+                self._last_cleanup = time.time()
+                await self._conn.execute("DELETE FROM bot_state WHERE expires_at<?", (time.time(),))
+            await self._conn.commit()
+        except Exception:
+            await self._conn.rollback()
+            # не перетираем более свежие записи
+            for k, v in batch.items():
+                self._pending.setdefault(k, v)
+            raise
+        self.flushes += 1
+        self.rows += len(batch)
+        for k, v in batch.items():
+            if k not in self._pending:
+                self._remember(k, v)
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("state flush failed, %d rows will be retried", len(self._pending))
+
+    async def close(self):
+        # цикл не отменяем: отмена посреди flush() потеряла бы уже вынутую пачку и открытую транзакцию
+        self._closing = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        if self._conn is not None:
+            await self.flush()
+            await self._conn.close()
+            self._conn = None
+
+    async def stats(self) -> dict:
+        conn = await self._db()
+        rows = await conn.execute_fetchall("SELECT count(*) FROM bot_state WHERE expires_at>=?", (time.time(),))
+        return {
+            "backend": "sqlite",
+            "entries": rows[0][0],
+            "pending": len(self._pending),
+            "cached": len(self._cache),
+            "memory_bytes": sys.getsizeof(self._pending) + sys.getsizeof(self._cache)
+                            + sum(_size(v) for v in self._pending.values())
+                            + sum(_size(v) for _, v in self._cache.values()),
+            "flushes": self.flushes,
+            "rows": self.rows,
+        }
+
+
+def create_store(backend: str = BOT_STATE_BACKEND) -> StateStore:
+    if backend == "sqlite":
+        return SqliteStateStore()
+    return MemoryStateStore()
@@ -0,0 +1,263 @@
+"""
+Webhook-режим бота: aiohttp-сервер принимает апдейты от Telegram, отбрасывает повторы по update_id
+и раздаёт их пулу процессов-воркеров. Воркер выбирается по chat_id, поэтому апдейты одного чата
+обрабатываются по порядку, а разные чаты — параллельно на всех ядрах.
+
+    python webhook.py            # webhook (BOT_WEBHOOK_URL — публичный адрес для setWebhook)
+    python bot.py                # long polling, как раньше — для разработки
+
+Проверка без Telegram: python webhook_stub.py (см. там).
+"""
+import os
+import sys
+import json
+import time
+import queue
+import asyncio
+import logging
+import importlib
+import multiprocessing as mp
+from collections import OrderedDict
+from typing import List, Optional
+
+from aiohttp import web
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+# --- ENV ---
+BOT_WEBHOOK_HOST = os.getenv("BOT_WEBHOOK_HOST", "0.0.0.0")
+BOT_WEBHOOK_PORT = int(os.getenv("BOT_WEBHOOK_PORT", "8080"))
+BOT_WEBHOOK_PATH = os.getenv("BOT_WEBHOOK_PATH", "/webhook")
+BOT_WEBHOOK_URL = os.getenv("BOT_WEBHOOK_URL")              # https://host/webhook; пусто — setWebhook не вызываем
+BOT_WEBHOOK_SECRET = os.getenv("BOT_WEBHOOK_SECRET")        # X-Telegram-Bot-Api-Secret-Token
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", str(os.cpu_count() or 2)))
+BOT_WORKER_QUEUE = int(os.getenv("BOT_WORKER_QUEUE", "10000"))
+BOT_WORKER_CONCURRENCY = int(os.getenv("BOT_WORKER_CONCURRENCY", "64"))
+BOT_DEDUP_WINDOW = int(os.getenv("BOT_DEDUP_WINDOW", "100000"))   # сколько последних update_id помнить
+BOT_MODULE = os.getenv("BOT_MODULE", "bot")                 # модуль с dp (и on_shutdown)
+
+
+def make_bot():
+    from aiogram import Bot
+    from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
+    server = os.getenv("TELEGRAM_API_SERVER")
+    return Bot(token=os.getenv("TELEGRAM_TOKEN"),
+               server=TelegramAPIServer.from_base(server) if server else TELEGRAM_PRODUCTION)
+
+
+def chat_key(update: dict) -> int:
+    """Ключ шардирования: id чата, иначе id пользователя, иначе update_id."""
+    for kind, body in update.items():
+        if not isinstance(body, dict):
+            continue
+        chat = body.get("chat") or (body.get("message") or {}).get("chat")
+        if chat and "id" in chat:
+            return chat["id"]
+        user = body.get("from") or body.get("user")
+        if user and "id" in user:
+            return user["id"]
+    return update.get("update_id", 0)
+
+
+# ---------- воркер ----------
+
+def _worker_main(index: int, q, module: str):
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s w{index} %(levelname)s %(name)s: %(message)s")
+    asyncio.run(_worker(index, q, module))
+
+
+async def _worker(index: int, q, module: str):
+    from aiogram import Bot, Dispatcher, types
+
+    mod = importlib.import_module(module)
+    dp: Dispatcher = mod.dp
+    # метрики воркера — на своём порту: BOT_METRICS_PORT + 1 + номер (сам BOT_METRICS_PORT у приёмника)
+    await metrics.serve(metrics.BOT_METRICS_PORT + 1 + index if metrics.BOT_METRICS_PORT else 0)
+    Bot.set_current(dp.bot)
+    Dispatcher.set_current(dp)
+    loop = asyncio.get_running_loop()
+    sem = asyncio.Semaphore(BOT_WORKER_CONCURRENCY)
+    tails = {}      # chat_id -> последняя задача чата: следующая ждёт её завершения
+
+    async def handle(data: dict, prev: Optional[asyncio.Task]):
+        try:
+            if prev is not None:
+                await asyncio.wait([prev])
+            await dp.process_update(types.Update(**data))
+        except Exception:
+            log.exception("update %s failed", data.get("update_id"))
+        finally:
+            sem.release()
+
+    def forget(chat_id, task):
+        if tails.get(chat_id) is task:
+            del tails[chat_id]
+
+    while True:
+        item = await loop.run_in_executor(None, q.get)
+        if item is None:
+            break
+        chat_id, body = item
+        await sem.acquire()
+        task = asyncio.ensure_future(handle(json.loads(body), tails.get(chat_id)))
+        tails[chat_id] = task
+        task.add_done_callback(lambda t, c=chat_id: forget(c, t))
+
+    await asyncio.gather(*tails.values(), return_exceptions=True)
+    if hasattr(mod, "on_shutdown"):
+        await mod.on_shutdown(dp)
+    session = await dp.bot.get_session()
+    await session.close()
+
+
+# ---------- приём ----------
+
+class UpdateRouter:
+    """Дедупликация по update_id и раздача апдейтов воркерам по chat_id."""
+
+    def __init__(self, workers: int = BOT_WORKERS, queue_size: int = BOT_WORKER_QUEUE,
+                 module: str = BOT_MODULE, dedup_window: int = BOT_DEDUP_WINDOW):
+        self.module = module
+        self.queue_size = queue_size
+        self.dedup_window = dedup_window
+        self._ctx = mp.get_context("spawn")
+        self.queues = [self._ctx.Queue(queue_size) for _ in range(max(1, workers))]
+        self.procs: List[Optional[mp.Process]] = [None] * len(self.queues)
+        self._seen: "OrderedDict[int, None]" = OrderedDict()
+        self.accepted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.restarts = 0
+
+    def _spawn(self, i: int):
+        p = self._ctx.Process(target=_worker_main, args=(i, self.queues[i], self.module),
+                              name=f"bot-worker-{i}", daemon=True)
+        p.start()
+        self.procs[i] = p
+
+    def start(self):
+        for i in range(len(self.queues)):
+            self._spawn(i)
+
+    def check(self):
+        # упавший воркер перезапускаем; его очередь сохраняется
+        for i, p in enumerate(self.procs):
+            if p is not None and not p.is_alive():
+                log.warning("worker %d exited with %s, restarting", i, p.exitcode)
+                self.restarts += 1
+                self._spawn(i)
+
+    def dispatch(self, update: dict, body: bytes) -> bool:
+        """False — очередь воркера переполнена (Telegram повторит доставку)."""
+        update_id = update["update_id"]
+        if update_id in self._seen:
+            self.duplicates += 1
+            return True
+        chat_id = chat_key(update)
+        try:
+            self.queues[chat_id % len(self.queues)].put_nowait((chat_id, body))
+        except queue.Full:
+            self.rejected += 1
+            return False
+        self._seen[update_id] = None
+        if len(self._seen) > self.dedup_window:
+            self._seen.popitem(last=False)
+        self.accepted += 1
+        return True
+
+    def stop(self, timeout: float = 10):
+        for q in self.queues:
+            try:
+                q.put(None, timeout=1)
+            except queue.Full:
+                pass
+        deadline = time.monotonic() + timeout
+        for p in self.procs:
+            if p is not None:
+                p.join(max(0.0, deadline - time.monotonic()))
+                if p.is_alive():
+                    p.terminate()
+
+    def stats(self) -> dict:
+        def qsize(q):
+            try:
+                return q.qsize()
+            except NotImplementedError:
+                return None
+        return {
+            "workers": len(self.procs),
+            "alive": sum(1 for p in self.procs if p is not None and p.is_alive()),
+            "queued": [qsize(q) for q in self.queues],
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "restarts": self.restarts,
+        }
+
+
+def create_app(router: UpdateRouter, path: str = BOT_WEBHOOK_PATH, secret: Optional[str] = BOT_WEBHOOK_SECRET):
+    async def receive(request: web.Request):
+        if secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret:
+            return web.Response(status=403)
+        body = await request.read()
+        try:
+            update = json.loads(body)
+            update["update_id"]
+        except (ValueError, KeyError, TypeError):
+            return web.Response(status=400, text="bad update")
+        if not router.dispatch(update, body):
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        return web.Response(status=200)
+
+    async def stats(request: web.Request):
+        return web.json_response(router.stats())
+
+    registry = metrics.Registry()
+    registry.gauge("bot_webhook_router", "Webhook receiver: accepted/duplicate/rejected updates", router.stats)
+    registry.gauge("bot_webhook_queued", "Updates waiting in worker queues",
+                   lambda: sum(n or 0 for n in router.stats()["queued"]))
+
+    async def metrics_page(request: web.Request):
+        return web.Response(text=await registry.render(), content_type="text/plain")
+
+    async def watchdog(app):
+        while True:
+            await asyncio.sleep(1)
+            router.check()
+
+    async def on_startup(app):
+        app["watchdog"] = asyncio.ensure_future(watchdog(app))
+        if BOT_WEBHOOK_URL:
+            bot = make_bot()
+            try:
+                await bot.set_webhook(BOT_WEBHOOK_URL, secret_token=secret,
+                                      max_connections=min(100, 8 * len(router.procs)))
+            finally:
+                await (await bot.get_session()).close()
+
+    async def on_cleanup(app):
+        app["watchdog"].cancel()
+
+    app = web.Application()
+    app.router.add_post(path, receive)
+    app.router.add_get("/stats", stats)
+    app.router.add_get("/metrics", metrics_page)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    router = UpdateRouter()
+    router.start()
+    try:
+        web.run_app(create_app(router), host=BOT_WEBHOOK_HOST, port=BOT_WEBHOOK_PORT, access_log=None)
+    finally:
+        router.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+Локальная проверка webhook-режима без Telegram: поднимает заглушку Bot API (отвечает ok на любые
+методы и запоминает отправленные сообщения), запускает webhook.py с воркерами и шлёт ему апдейты —
+с повторами по update_id, вперемешку по чатам. В конце проверяет, что повторы отброшены, а ответы
+в каждом чате пришли в том же порядке, что и апдейты.
+
+    python webhook_stub.py --chats 200 --rounds 5 --dup 0.1
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+from collections import defaultdict
+
+import aiohttp
+from aiohttp import web
+
+sent = defaultdict(list)      # chat_id -> тексты sendMessage в порядке прихода
+
+# чередуем команды: по ответам видно, сохранился ли порядок апдейтов внутри чата
+SCRIPT = [("/start", ["Привет! Выбери действие:"]),
+          ("📚 Рекомендации", ["Выбери режим:", "Можно вернуться в меню в любой момент."])]
+
+
+async def fake_api(request: web.Request):
+    method = request.match_info["method"]
+    data = dict(await request.post()) if request.content_type != "application/json" else await request.json()
+    if method in ("sendMessage", "editMessageText"):
+        chat_id = int(data.get("chat_id", 0))
+        sent[chat_id].append(data.get("text", ""))
+        return web.json_response({"ok": True, "result": {
+            "message_id": len(sent[chat_id]), "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "text": data.get("text", ""),
+        }})
+    if method == "getMe":
+        return web.json_response({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "stub"}})
+    return web.json_response({"ok": True, "result": True})
+
+
+def make_update(update_id: int, chat_id: int, text: str) -> dict:
+    user = {"id": chat_id, "is_bot": False, "first_name": f"u{chat_id}"}
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "text": text,
+        "chat": {"id": chat_id, "type": "private"}, "from": user,
+        **({"entities": [{"type": "bot_command", "offset": 0, "length": len(text)}]} if text.startswith("/") else {}),
+    }}
+
+
+async def post_updates(url: str, chats: int, rounds: int, dup: float, concurrency: int):
+    rnd = random.Random(1)
+    per_chat = [[make_update(r * chats + c + 1, 1000 + c, SCRIPT[r % len(SCRIPT)][0]) for r in range(rounds)]
+                for c in range(chats)]
+    stream, cursor = [], [0] * chats
+    while any(cursor[c] < rounds for c in range(chats)):
+        c = rnd.choice([c for c in range(chats) if cursor[c] < rounds])
+        stream.append(per_chat[c][cursor[c]])
+        cursor[c] += 1
+        if rnd.random() < dup:
+            stream.append(stream[-1])          # Telegram повторяет доставку
+    sem = asyncio.Semaphore(concurrency)
+    statuses = defaultdict(int)
+    async with aiohttp.ClientSession() as s:
+        async def one(u):
+            async with sem:
+                async with s.post(url, json=u) as r:
+                    statuses[r.status] += 1
+        t = time.perf_counter()
+        # апдейты одного чата Telegram шлёт последовательно — соблюдаем это, чаты между собой параллельно
+        by_chat = defaultdict(list)
+        for u in stream:
+            by_chat[u["message"]["chat"]["id"]].append(u)
+
+        async def chat_seq(us):
+            for u in us:
+                await one(u)
+        await asyncio.gather(*(chat_seq(us) for us in by_chat.values()))
+        elapsed = time.perf_counter() - t
+    return len(stream), dict(statuses), elapsed
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chats", type=int, default=100)
+    ap.add_argument("--rounds", type=int, default=5)
+    ap.add_argument("--dup", type=float, default=0.1)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--concurrency", type=int, default=64)
+    ap.add_argument("--api-port", type=int, default=8091)
+    ap.add_argument("--port", type=int, default=8090)
+    args = ap.parse_args()
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", fake_api)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.api_port).start()
+
+    env = dict(os.environ,
+               TELEGRAM_TOKEN="123456:STUB",
+               TELEGRAM_API_SERVER=f"http://127.0.0.1:{args.api_port}",
+               BOT_WEBHOOK_HOST="127.0.0.1", BOT_WEBHOOK_PORT=str(args.port),
+               BOT_WORKERS=str(args.workers), BOT_WEBHOOK_URL="")
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.Popen([sys.executable, os.path.join(here, "webhook.py")], env=env, cwd=here)
+    try:
+        base = f"http://127.0.0.1:{args.port}"
+        async with aiohttp.ClientSession() as s:
+            for _ in range(100):
+                try:
+                    async with s.get(f"{base}/stats") as r:
+                        if (await r.json())["alive"] == args.workers:
+                            break
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.1)
+        total, statuses, elapsed = await post_updates(f"{base}/webhook", args.chats, args.rounds,
+                                                      args.dup, args.concurrency)
+        replies_per_chat = [t for r in range(args.rounds) for t in SCRIPT[r % len(SCRIPT)][1]]
+        expected = args.chats * len(replies_per_chat)
+        # исходящая очередь бота держит ~1 сообщение/с на чат и склеивает подряд идущие — сравниваем по тексту
+        want = "\n\n".join(replies_per_chat)
+        for _ in range(600):
+            if len(sent) == args.chats and all("\n\n".join(v) == want for v in sent.values()):
+                break
+            await asyncio.sleep(0.05)
+        async with aiohttp.ClientSession() as s:
+            async with s.get(f"{base}/stats") as r:
+                stats = await r.json()
+        replies = sum(len(v) for v in sent.values())
+        print(json.dumps({
+            "posted": total, "statuses": statuses, "post_s": round(elapsed, 3),
+            "updates_per_s": round(total / elapsed, 1), "expected_replies": expected,
+            "replies": replies, "chats_in_order": sum(1 for v in sent.values() if "\n\n".join(v) == want),
+            "router": stats,
+        }, ensure_ascii=False, indent=2))
+        ok = all("\n\n".join(v) == want for v in sent.values()) and len(sent) == args.chats
+        return 0 if ok and stats["duplicates"] == total - args.chats * args.rounds else 1
+    finally:
+        proc.terminate()
+        proc.wait(10)
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))